@@ -0,0 +1,165 @@
+"""
+Background loading and hot swap of index bundles.
+
+Activating a bundle (see retreivers/bundles.py) takes five steps. The manager
+verifies the bundle's checksums. It checks that the bundle was built with the
+query encoders this server runs. It warms the bundle up by running every
+retriever once with the bundle pinned, while the active bundle keeps serving
+requests; a retriever that fails or finds nothing fails the warmup. It checks
+that the loaded indices and metadata hold the items counted in the manifest.
+Only then does it swap the bundle in. A bundle that fails any step is
+dropped and never served. An optional before_swap hook runs around the swap,
+e.g. to replay the live ingestion journal into the new bundle.
+"""
+
+import contextlib
+import gc
+import importlib
+import logging
+import threading
+import time
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Tuple
+
+from retreivers import bundles, registry
+from backend.warmup import RetrieverWarmup
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Manifest model key -> retriever module whose MODEL_NAME encodes the queries for that index
+MODEL_MODULES = {
+    "bge": "retreivers.bge_retreiver",
+    "clip": "retreivers.clip_retreiver",
+}
+
+class BundleManager:
+    """Loads index bundles in the background and swaps them in once warmed up."""
+
+    def __init__(self, retrievers: Dict[str, Tuple[Callable, Tuple]], bundle_dir: str = bundles.BUNDLE_DIR,
+                 before_swap: Optional[Callable[[bundles.IndexBundle], ContextManager]] = None):
+        """
+        Args:
+            retrievers (Dict[str, Tuple[Callable, Tuple]]): Retriever name -> (function, extra arguments
+                after the query), as served by /get-images
+            bundle_dir (str): Directory of the versioned bundles
+            before_swap (Optional[Callable[[bundles.IndexBundle], ContextManager]]): Context entered with
+                the warmed-up bundle before it is swapped in and exited after the swap
+        """
+        self.retrievers = retrievers
+        self.bundle_dir = bundle_dir
+        self.before_swap = before_swap
+        self.status: Dict[str, Any] = {"state": "idle", "version": None, "error": None, "warmup": None}
+        self._lock = threading.Lock()
+
+    def list_versions(self) -> List[Dict[str, Any]]:
+        """List the bundle versions on disk, marking the active one."""
+        active = bundles.get_active().version
+        return [{"version": version, "active": version == active} for version in bundles.list_versions(self.bundle_dir)]
+
+    def _check_models(self, bundle: bundles.IndexBundle) -> None:
+        """Reject a bundle whose indices were built with other query encoders than the served ones."""
+        served_modules = {registry.RETRIEVERS[name][0] for name in self.retrievers if name in registry.RETRIEVERS}
+        for key, model_name in bundle.manifest.get("models", {}).items():
+            module = MODEL_MODULES.get(key)
+            if module is None or module not in served_modules:
+                continue
+            served_model = importlib.import_module(module).MODEL_NAME
+            if model_name != served_model:
+                raise ValueError(f"Bundle {bundle.version} was built with {key} model {model_name}, "
+                                 f"the server encodes queries with {served_model}")
+
+    def _check_items(self, bundle: bundles.IndexBundle) -> None:
+        """Reject a bundle whose loaded indices and metadata do not hold the items counted in its manifest."""
+        expected = bundle.manifest.get("items", {})
+        with bundles.pinned(bundle):
+            for module_name in MODEL_MODULES.values():
+                module = registry.get_loaded_module(module_name)
+                if module is None:
+                    continue
+                for path, (rows, entries) in module.get_loaded_item_counts().items():
+                    if rows != entries:
+                        raise ValueError(f"Bundle {bundle.version} has {entries} entries in {path} "
+                                         f"but {rows} rows in its index")
+                    if path in expected and expected[path] != entries:
+                        raise ValueError(f"Bundle {bundle.version} has {entries} entries in {path}, "
+                                         f"its manifest counts {expected[path]}")
+
+    def activate(self, version: str, persist: bool = True) -> bundles.IndexBundle:
+        """
+        Verify, warm up and swap in a bundle version (blocking).
+
+        Args:
+            version (str): Bundle version, the name of its directory
+            persist (bool): Also record the version in the CURRENT file, to serve it after a restart
+
+        Returns:
+            bundles.IndexBundle: The activated bundle
+
+        Raises:
+            RuntimeError: If another activation is in progress
+            FileNotFoundError, ValueError: If the bundle is missing, corrupt, built for other models,
+                fails to load or does not hold the items of its manifest
+            OSError: If the swapped-in bundle cannot be recorded in the CURRENT file
+
+        Failures other than an activation in progress are also reported in self.status.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError(f"Activation of bundle {self.status['version']} is in progress")
+        try:
+            self.status = {"state": "loading", "version": version, "error": None, "warmup": None,
+                           "started_at": time.time()}
+            with contextlib.ExitStack() as swap:
+                try:
+                    bundle = bundles.load_bundle(version, self.bundle_dir)
+                    self._check_models(bundle)
+
+                    # Load every index, pickle and derived cache of the new bundle while the old one serves
+                    warmup = RetrieverWarmup(self.retrievers)
+                    with bundles.pinned(bundle):
+                        warmup.run()
+                    self.status["warmup"] = warmup.status
+                    if not warmup.is_ready():
+                        failed = [name for name, status in warmup.status.items() if status["state"] == "failed"]
+                        raise ValueError(f"Retrievers failed to load bundle {version}: {', '.join(failed)}")
+                    self._check_items(bundle)
+                    if self.before_swap is not None:
+                        swap.enter_context(self.before_swap(bundle))
+                    previous = bundles.activate(bundle)
+                except Exception as e:
+                    self.status.update(state="failed", error=str(e), finished_at=time.time())
+                    raise
+            self.status.update(state="active", finished_at=time.time())
+            if persist:
+                try:
+                    bundles.write_current_version(version, self.bundle_dir)
+                except OSError as e:
+                    self.status["error"] = f"Serving bundle {version}, but it could not be recorded as current: {str(e)}"
+                    raise
+
+            # Requests still holding the previous bundle keep it alive, it is freed after the last one ends
+            del previous
+            gc.collect()
+            return bundle
+        finally:
+            self._lock.release()
+
+    def is_busy(self) -> bool:
+        """Whether an activation is in progress."""
+        return self._lock.locked()
+
+    def activate_current(self) -> Optional[bundles.IndexBundle]:
+        """
+        Serve the version named in the CURRENT file, if any, without warming it up (for startup).
+
+        Returns:
+            Optional[bundles.IndexBundle]: The activated bundle, or None to keep serving the repository files
+        """
+        version = bundles.read_current_version(self.bundle_dir)
+        if version is None:
+            return None
+        bundle = bundles.load_bundle(version, self.bundle_dir)
+        self._check_models(bundle)
+        bundles.activate(bundle)
+        self.status.update(state="active", version=version)
+        return bundle
@@ -0,0 +1,204 @@
+"""
+Multi-node search: shard nodes and the coordinator that fans out to them.
+
+A node is this backend started with NODE_SHARD="i/N". Its POST /shard/search
+searches only shard i of N of each index (see retreivers/sharding.py). It
+returns scored results, so that results from different nodes can be merged.
+
+A coordinator is this backend started with SHARD_NODES listing the nodes.
+/get-images then encodes the query once with BGE and CLIP and sends the query
+and its embeddings to every node, so that no node encodes it again. It merges
+the nodes' scored results by score into the global top k. A node that fails or
+does not answer within SHARD_TIMEOUT_S is left out. The response then has
+"partial": true and the outcome of each node.
+
+Only the retrievers that can be split by image are forwarded: bge, clip,
+tfidf and both BM25 variants. The hybrid and topic-routed retrievers need the
+full indices and are not served by a coordinator.
+
+Configuration:
+    SHARD_NODES          comma-separated base URLs of the nodes (coordinator mode when set)
+    SHARD_TIMEOUT_S      time a node has to answer a query (default 2)
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+from retreivers import sharding
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants
+SHARD_NODES = [url.strip().rstrip("/") for url in os.getenv("SHARD_NODES", "").split(",") if url.strip()]
+SHARD_TIMEOUT_S = float(os.getenv("SHARD_TIMEOUT_S", "2"))
+# Retrievers that can be served by shard nodes
+SHARDED_METHODS = ["bge", "clip", "tfidf", "bm25_with_stopwords", "bm25_without_stopwords"]
+# Query encoder each sharded retriever searches with
+METHOD_ENCODERS = {"bge": "bge", "clip": "clip"}
+STRUCTURES = range(1, 6)
+
+def _get_query_embedding(encoder: str, query: str) -> np.ndarray:
+    """Encode a query with the BGE or CLIP text encoder, without loading their indices."""
+    if encoder == "bge":
+        from retreivers import bge_retreiver
+        return bge_retreiver.get_query_embedding(query)
+    from retreivers import clip_retreiver
+    return clip_retreiver.get_query_embedding(query)
+
+def _get_sources(method: str) -> Dict[str, sharding.Source]:
+    """Get the shard sources a retriever searches, by result key ("all" for CLIP, else the structure)."""
+    if method == "bge":
+        from retreivers import bge_retreiver
+        return {str(structure_num): bge_retreiver.get_shard_source(structure_num) for structure_num in STRUCTURES}
+    if method == "clip":
+        from retreivers import clip_retreiver
+        return {"all": clip_retreiver.get_shard_source()}
+    if method == "tfidf":
+        return {str(structure_num): ("tfidf", structure_num) for structure_num in STRUCTURES}
+    variant = method[len("bm25_"):]
+    return {str(structure_num): ("bm25", structure_num, variant) for structure_num in STRUCTURES}
+
+def search_shard(method: str, query: str, k: int, embedding: Optional[List[float]] = None) -> Dict[str, List[Dict]]:
+    """
+    Search this node's shard for one retriever (node side of /shard/search).
+
+    Args:
+        method (str): One of SHARDED_METHODS
+        query (str): The search query
+        k (int): Number of results per structure
+        embedding (Optional[List[float]]): Query embedding computed by the coordinator; encoded here if missing
+
+    Returns:
+        Dict[str, List[Dict]]: Result key ("all" for CLIP, else the structure) -> results, best first, each
+            {"score", "row", "metadata"} with scores comparable across nodes (lower is better)
+    """
+    if method in METHOD_ENCODERS:
+        if embedding is None:
+            search_query = _get_query_embedding(METHOD_ENCODERS[method], query)
+        else:
+            search_query = np.asarray(embedding, dtype=np.float32)
+    elif method.startswith("bm25_"):
+        search_query = query.lower().split()
+    else:
+        search_query = query
+
+    results = {}
+    for key, source in _get_sources(method).items():
+        try:
+            results[key] = [
+                {"score": score, "row": row, "metadata": metadata}
+                for score, row, metadata in sharding.search_node_shard(source, search_query, k)
+            ]
+        except Exception as e:
+            logger.error(f"Error searching shard of {method} ({key}) for query '{query}': {str(e)}")
+            results[key] = []
+    return results
+
+def merge_node_results(node_results: List[Dict[str, List[Dict]]], k: int) -> Dict[str, List[Dict]]:
+    """Merge one retriever's scored results from several nodes into the top k metadata per result key."""
+    keys = sorted({key for results in node_results for key in results}, key=lambda key: (len(key), key))
+    merged = {}
+    for key in keys:
+        # Rows are unique across nodes, so entries compare by score, then row
+        partial = [
+            [(item["score"], item["row"], node, index) for index, item in enumerate(results.get(key, []))]
+            for node, results in enumerate(node_results)
+        ]
+        merged[key] = [
+            node_results[node][key][index]["metadata"]
+            for _, _, node, index in itertools.islice(heapq.merge(*partial), k)
+        ]
+    return merged
+
+class Coordinator:
+    """Fans /get-images out to the shard nodes and merges their results."""
+
+    def __init__(self, nodes: List[str], methods: List[str], timeout_s: float = SHARD_TIMEOUT_S):
+        """
+        Args:
+            nodes (List[str]): Base URLs of the shard nodes
+            methods (List[str]): Retrievers to serve; those that cannot be sharded are dropped
+            timeout_s (float): Time a node has to answer a query
+        """
+        self.nodes = nodes
+        self.methods = [method for method in methods if method in SHARDED_METHODS]
+        self.timeout_s = timeout_s
+        self.encoders = sorted({METHOD_ENCODERS[method] for method in self.methods if method in METHOD_ENCODERS})
+        self._client: Optional[httpx.AsyncClient] = None
+        dropped = [method for method in methods if method not in SHARDED_METHODS]
+        if dropped:
+            logger.warning(f"Retrievers not served in coordinator mode (they need the full indices): {dropped}")
+
+    def get_warmup_retrievers(self) -> Dict[str, Tuple[Callable, Tuple]]:
+        """Get the query encoders to warm up, in the form RetrieverWarmup expects (a coordinator loads no index)."""
+        return {
+            f"{encoder}_encoder": (lambda query, k, encoder=encoder: _get_query_embedding(encoder, query), ())
+            for encoder in self.encoders
+        }
+
+    async def _encode(self, query: str) -> Dict[str, List[float]]:
+        """Encode the query once per encoder, for every node."""
+        embeddings = await asyncio.gather(*[
+            asyncio.to_thread(_get_query_embedding, encoder, query) for encoder in self.encoders
+        ])
+        return {encoder: embedding.tolist() for encoder, embedding in zip(self.encoders, embeddings)}
+
+    async def _query_node(self, node: str, payload: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[Dict]]:
+        """Send a query to one node, returning its outcome and its results (None if it failed)."""
+        if self._client is None:
+            self._client = httpx.AsyncClient()
+        start = time.perf_counter()
+        outcome = {"node": node, "status": "ok", "latency_ms": None, "error": None}
+        results = None
+        try:
+            response = await asyncio.wait_for(
+                self._client.post(f"{node}/shard/search", json=payload, timeout=self.timeout_s),
+                self.timeout_s
+            )
+            response.raise_for_status()
+            results = response.json()["results"]
+        except (asyncio.TimeoutError, httpx.TimeoutException):
+            outcome.update(status="timeout", error=f"No answer within {self.timeout_s}s")
+        except Exception as e:
+            outcome.update(status="error", error=f"{type(e).__name__}: {e}")
+        outcome["latency_ms"] = 1000 * (time.perf_counter() - start)
+        if results is None:
+            logger.warning(f"Shard node {node} left out: {outcome['error']}")
+        return outcome, results
+
+    async def search(self, query: str, k: int) -> Dict[str, Any]:
+        """
+        Search every node and merge their results.
+
+        Returns:
+            Dict[str, Any]: "results" in the /get-images shape, "partial" (whether a node was left out)
+                and "shards" (the outcome and latency of each node)
+        """
+        payload = {"query": query, "k": k, "methods": self.methods, "embeddings": await self._encode(query)}
+        answers = await asyncio.gather(*[self._query_node(node, payload) for node in self.nodes])
+        node_results = [results for _, results in answers if results is not None]
+
+        results = {}
+        for method in self.methods:
+            merged = merge_node_results([results.get(method, {}) for results in node_results], k)
+            results[method] = merged.get("all", []) if method == "clip" else merged
+        return {
+            "results": results,
+            "partial": len(node_results) < len(self.nodes),
+            "shards": [outcome for outcome, _ in answers],
+        }
+
+    async def close(self) -> None:
+        """Close the connections to the nodes."""
+        if self._client is not None:
+            await self._client.aclose()
@@ -0,0 +1,301 @@
+"""
+Append-only storage of the human evaluation judgements.
+
+Every submitted evaluation of a query is one row in an SQLite database, and each
+of its selections ("Correct"/"Incorrect" for one retrieved image) is one row of
+judgements, keyed by method and structure so that reads can filter on them.
+Rows are only ever inserted, each evaluation in a single transaction, so
+concurrent evaluators (threads or processes) never overwrite each other. When a
+query is evaluated again, the latest evaluation wins in the per-query view.
+
+Correct/total counts per method and structure, over the latest evaluation of
+each query, are kept in the same database and updated in the transaction that
+inserts the judgements, so the accuracy summary is read without scanning them.
+"""
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants
+BUSY_TIMEOUT_S = 30.0
+MAX_PAGE_SIZE = 1000
+
+# Selection ids are "<method>_structure<n>_<rank>", or "<method>_<rank>" for CLIP
+STRUCTURED_ID = re.compile(r"^(?P<method>.+)_structure(?P<structure>\d+)_(?P<rank>\d+)$")
+UNSTRUCTURED_ID = re.compile(r"^(?P<method>.+)_(?P<rank>\d+)$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS evaluations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    query TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    images TEXT NOT NULL,
+    UNIQUE (query, timestamp)
+);
+CREATE TABLE IF NOT EXISTS judgements (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    evaluation_id INTEGER NOT NULL REFERENCES evaluations (id),
+    query TEXT NOT NULL,
+    image_id TEXT NOT NULL,
+    method TEXT NOT NULL,
+    structure INTEGER,
+    rank INTEGER NOT NULL,
+    selection TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS judgements_query ON judgements (query);
+CREATE INDEX IF NOT EXISTS judgements_method ON judgements (method, structure);
+CREATE INDEX IF NOT EXISTS judgements_evaluation ON judgements (evaluation_id);
+CREATE INDEX IF NOT EXISTS evaluations_query ON evaluations (query);
+-- structure is 0 for methods without structures, e.g. CLIP
+CREATE TABLE IF NOT EXISTS accuracy (
+    method TEXT NOT NULL,
+    structure INTEGER NOT NULL,
+    correct INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (method, structure)
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+def accuracy_key(method: str, structure: Optional[int]) -> str:
+    """Get the summary key of a method and structure, e.g. "bge_structure1" or "clip"."""
+    return f"{method}_structure{structure}" if structure else method
+
+def parse_image_id(image_id: str) -> Tuple[str, Optional[int], int]:
+    """Split a selection id such as "bm25_with_stopwords_structure3_0" into (method, structure, rank)."""
+    match = STRUCTURED_ID.match(image_id)
+    if match:
+        return match["method"], int(match["structure"]), int(match["rank"])
+    match = UNSTRUCTURED_ID.match(image_id)
+    if match:
+        return match["method"], None, int(match["rank"])
+    return image_id, None, 0
+
+class EvaluationStore:
+    """SQLite-backed, append-only store of evaluations and their judgements."""
+
+    def __init__(self, path: str, legacy_path: Optional[str] = None):
+        """
+        Args:
+            path (str): SQLite database file
+            legacy_path (Optional[str]): evaluation_results.json written by earlier versions,
+                imported once when the database is empty
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT_S, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            # WAL lets readers proceed while another process appends
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+            if self._connection.execute("SELECT COUNT(*) FROM counters").fetchone()[0] == 0:
+                # Databases written before the counters existed
+                self._rebuild_accuracy()
+
+        if legacy_path and os.path.exists(legacy_path) and self.count() == 0:
+            self.import_legacy(legacy_path)
+
+    def import_legacy(self, legacy_path: str) -> int:
+        """Import the results of a whole-file evaluation_results.json."""
+        try:
+            with open(legacy_path, "r") as f:
+                legacy = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Could not import {legacy_path}: {str(e)}")
+            return 0
+        imported = self.add_results(legacy.get("results", {}))
+        logger.info(f"Imported {imported} evaluations from {legacy_path}")
+        return imported
+
+    def count(self) -> int:
+        """Get the number of stored evaluations."""
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM evaluations").fetchone()[0]
+
+    def add_evaluation(self, query: str, selections: Dict[str, str], images: Dict[str, Any],
+                       timestamp: Optional[str] = None) -> Optional[int]:
+        """
+        Append one evaluation and its judgements in a single transaction.
+
+        Returns:
+            Optional[int]: The new evaluation id, or None if this (query, timestamp) is already stored
+        """
+        timestamp = timestamp or datetime.now(timezone.utc).isoformat()
+        with self._lock, self._connection:
+            # Take the write lock before reading the previous evaluation, against other processes
+            self._connection.execute("BEGIN IMMEDIATE")
+            previous = self._connection.execute(
+                "SELECT MAX(id) FROM evaluations WHERE query = ?", (query,)
+            ).fetchone()[0]
+            cursor = self._connection.execute(
+                "INSERT OR IGNORE INTO evaluations (query, timestamp, images) VALUES (?, ?, ?)",
+                (query, timestamp, json.dumps(images))
+            )
+            if cursor.rowcount == 0:
+                return None
+            evaluation_id = cursor.lastrowid
+            self._connection.executemany(
+                "INSERT INTO judgements (evaluation_id, query, image_id, method, structure, rank, selection) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (evaluation_id, query, image_id, *parse_image_id(image_id), selection)
+                    for image_id, selection in selections.items()
+                ]
+            )
+
+            # The new evaluation replaces the query's previous one in the counts
+            if previous is None:
+                self._increment("queries", 1)
+            else:
+                self._add_to_accuracy(previous, -1)
+            self._add_to_accuracy(evaluation_id, 1)
+            self._increment("evaluations", 1)
+            return evaluation_id
+
+    def _increment(self, name: str, amount: int) -> None:
+        """Add to a counter (within the caller's transaction)."""
+        self._connection.execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+            (name, amount)
+        )
+
+    def _add_to_accuracy(self, evaluation_id: int, sign: int) -> None:
+        """Add (sign 1) or remove (sign -1) an evaluation's judgements to the accuracy counts."""
+        self._connection.execute(
+            "INSERT INTO accuracy (method, structure, correct, total) "
+            "SELECT method, COALESCE(structure, 0), ? * SUM(selection = 'Correct'), ? * COUNT(*) "
+            "FROM judgements WHERE evaluation_id = ? GROUP BY method, COALESCE(structure, 0) "
+            "ON CONFLICT (method, structure) DO UPDATE SET "
+            "correct = correct + excluded.correct, total = total + excluded.total",
+            (sign, sign, evaluation_id)
+        )
+
+    def _rebuild_accuracy(self) -> None:
+        """Recompute the counts from the stored judgements (within the caller's transaction)."""
+        self._connection.execute("DELETE FROM accuracy")
+        self._connection.execute("DELETE FROM counters")
+        latest = self._connection.execute("SELECT MAX(id) FROM evaluations GROUP BY query").fetchall()
+        for (evaluation_id,) in latest:
+            self._add_to_accuracy(evaluation_id, 1)
+        self._increment("queries", len(latest))
+        self._increment(
+            "evaluations", self._connection.execute("SELECT COUNT(*) FROM evaluations").fetchone()[0]
+        )
+
+    def add_results(self, results: Dict[str, Dict[str, Any]]) -> int:
+        """Append the per-query results of a legacy whole-file payload, skipping ones already stored."""
+        added = 0
+        for query, result in results.items():
+            evaluation_id = self.add_evaluation(
+                result.get("query", query), result.get("selections", {}), result.get("images", {}),
+                result.get("timestamp")
+            )
+            added += evaluation_id is not None
+        return added
+
+    def get_results(self) -> Dict[str, Any]:
+        """Get the latest evaluation of every query, in the legacy {"queries", "results"} shape."""
+        with self._lock:
+            evaluations = self._connection.execute(
+                "SELECT * FROM evaluations WHERE id IN (SELECT MAX(id) FROM evaluations GROUP BY query) ORDER BY id"
+            ).fetchall()
+            judgements = self._connection.execute(
+                "SELECT evaluation_id, image_id, selection FROM judgements "
+                "WHERE evaluation_id IN (SELECT MAX(id) FROM evaluations GROUP BY query)"
+            ).fetchall()
+
+        selections: Dict[int, Dict[str, str]] = {}
+        for row in judgements:
+            selections.setdefault(row["evaluation_id"], {})[row["image_id"]] = row["selection"]
+        results = {
+            row["query"]: {
+                "query": row["query"],
+                "timestamp": row["timestamp"],
+                "selections": selections.get(row["id"], {}),
+                "images": json.loads(row["images"]),
+            }
+            for row in evaluations
+        }
+        return {"queries": list(results), "results": results}
+
+    def get_summary(self) -> Dict[str, Any]:
+        """
+        Get the correct/total counts per method and structure over the latest evaluation of each query.
+
+        Returns:
+            Dict[str, Any]: {"queries", "evaluations", "methods": {key: {"method", "structure",
+                "correct", "total", "accuracy"}}}, keyed as in accuracy_key
+        """
+        with self._lock:
+            counters = dict(self._connection.execute("SELECT name, value FROM counters").fetchall())
+            rows = self._connection.execute(
+                "SELECT method, structure, correct, total FROM accuracy WHERE total > 0 ORDER BY method, structure"
+            ).fetchall()
+        return {
+            "queries": counters.get("queries", 0),
+            "evaluations": counters.get("evaluations", 0),
+            "methods": {
+                accuracy_key(row["method"], row["structure"]): {
+                    "method": row["method"],
+                    "structure": row["structure"] or None,
+                    "correct": row["correct"],
+                    "total": row["total"],
+                    "accuracy": 100 * row["correct"] / row["total"],
+                }
+                for row in rows
+            },
+        }
+
+    def list_judgements(self, query: Optional[str] = None, method: Optional[str] = None,
+                        structure: Optional[int] = None, limit: int = 100, offset: int = 0) -> Dict[str, Any]:
+        """
+        Get a page of judgements, oldest first, optionally filtered.
+
+        Args:
+            query (Optional[str]): Only judgements of this query
+            method (Optional[str]): Only judgements of this method, e.g. "bge" or "clip"
+            structure (Optional[int]): Only judgements of this structure
+            limit (int): Page size (at most MAX_PAGE_SIZE)
+            offset (int): Judgements to skip
+
+        Returns:
+            Dict[str, Any]: {"total", "limit", "offset", "items"}
+        """
+        conditions, parameters = [], []
+        for column, value in (("query", query), ("method", method), ("structure", structure)):
+            if value is not None:
+                conditions.append(f"j.{column} = ?")
+                parameters.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        limit = max(0, min(limit, MAX_PAGE_SIZE))
+
+        with self._lock:
+            total = self._connection.execute(f"SELECT COUNT(*) FROM judgements j {where}", parameters).fetchone()[0]
+            rows = self._connection.execute(
+                "SELECT j.id, j.evaluation_id, j.query, e.timestamp, j.image_id, j.method, j.structure, j.rank, "
+                f"j.selection FROM judgements j JOIN evaluations e ON e.id = j.evaluation_id {where} "
+                "ORDER BY j.id LIMIT ? OFFSET ?",
+                parameters + [limit, max(0, offset)]
+            ).fetchall()
+        return {"total": total, "limit": limit, "offset": offset, "items": [dict(row) for row in rows]}
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._connection.close()
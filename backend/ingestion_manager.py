@@ -0,0 +1,159 @@
+"""
+Live ingestion for the API: adding and removing images on the served bundle.
+
+The manager embeds an added image outside any lock. Holding the active bundle's
+write lock, it records the change in the journal (see backend/ingestion_store.py)
+and only then applies it to the bundle's indices (see retreivers/ingestion.py),
+so that a change served from memory is never missing from the journal. Removed images are tombstoned, and a
+background task compacts them out of the indices every INGEST_COMPACT_INTERVAL_S
+once there are at least INGEST_COMPACT_MIN_TOMBSTONES of them. The journal is
+replayed into the bundle served on startup, and into every new bundle before it
+is swapped in, with further changes held off until the swap is done.
+
+Configuration:
+    INGESTION_DB                    SQLite journal of the live changes (default "ingestion/journal.sqlite3")
+    INGEST_COMPACT_INTERVAL_S       time between compaction checks (default 60)
+    INGEST_COMPACT_MIN_TOMBSTONES   tombstones needed to compact (default 1)
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from retreivers import bundles, ingestion
+from backend.ingestion_store import IngestionStore
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants
+INGESTION_DB = os.getenv("INGESTION_DB", os.path.join("ingestion", "journal.sqlite3"))
+COMPACT_INTERVAL_S = float(os.getenv("INGEST_COMPACT_INTERVAL_S", "60"))
+COMPACT_MIN_TOMBSTONES = int(os.getenv("INGEST_COMPACT_MIN_TOMBSTONES", "1"))
+
+class IngestionManager:
+    """Applies live changes to the served indices, journals them and compacts the tombstones."""
+
+    def __init__(self, methods: List[str], store: IngestionStore,
+                 compact_interval_s: float = COMPACT_INTERVAL_S,
+                 compact_min_tombstones: int = COMPACT_MIN_TOMBSTONES):
+        """
+        Args:
+            methods (List[str]): Retrievers served by /get-images, whose indices are updated
+            store (IngestionStore): Journal of the live changes
+            compact_interval_s (float): Time between compaction checks
+            compact_min_tombstones (int): Tombstones needed to compact
+        """
+        self.engines = ingestion.get_engines(methods)
+        self.store = store
+        self.compact_interval_s = compact_interval_s
+        self.compact_min_tombstones = compact_min_tombstones
+        self.status: Dict[str, Any] = {"last_compaction": None, "compacted": 0}
+        self._tokenizer_checked = False
+        self._tokenizer_lock = threading.Lock()
+
+    def check_tokenizer(self) -> None:
+        """
+        Make sure the BM25 tokenizer's NLTK data is installed, on first use rather than at import (blocking).
+
+        Raises:
+            LookupError: If the data is missing and cannot be downloaded (checked again on the next call)
+        """
+        with self._tokenizer_lock:
+            if not self._tokenizer_checked:
+                ingestion.check_tokenizer_data(self.engines)
+                self._tokenizer_checked = True
+
+    def add_image(self, item: Dict[str, Any]) -> Optional[str]:
+        """
+        Embed an image and add it to the served indices (blocking).
+
+        Args:
+            item (Dict[str, Any]): The image item, with the fields of preprocess/dataset/image_metadata.json
+
+        Returns:
+            Optional[str]: The image id, or None if the image is already indexed
+
+        Raises:
+            ValueError: If the image cannot be embedded or indexed
+            LookupError: If the NLTK data of the BM25 tokenizer is missing and cannot be downloaded
+        """
+        self.check_tokenizer()
+        try:
+            embeddings = ingestion.embed_item(item, self.engines)
+        except Exception as e:
+            raise ValueError(f"Could not embed image {item['image_url']}: {str(e)}") from e
+        added = ingestion.add_images(
+            [{"item": item, "embeddings": embeddings}], self.engines,
+            journal=lambda image_ids, entries: self.store.record_added(image_ids[0], item, embeddings)
+        )
+        return added[0] if added else None
+
+    def delete_image(self, image_id: str) -> Optional[str]:
+        """
+        Remove an image from the served indices (blocking).
+
+        Returns:
+            Optional[str]: The URL of the removed image, or None if no such image is indexed
+        """
+        removed = ingestion.delete_images(
+            [image_id], self.engines,
+            journal=lambda removed: self.store.record_deleted(image_id, removed[image_id])
+        )
+        return removed.get(image_id)
+
+    def compact(self) -> int:
+        """Remove the tombstoned images' rows from the served indices (blocking)."""
+        start = time.perf_counter()
+        removed = ingestion.compact(self.engines)
+        if removed:
+            self.status.update(
+                last_compaction=time.time(), compacted=removed, compaction_time_s=time.perf_counter() - start
+            )
+        return removed
+
+    def replay(self, bundle: Optional[bundles.IndexBundle] = None) -> None:
+        """Apply the journal to a bundle (default: the active one) that has not seen it yet (blocking)."""
+        added, deleted = self.store.get_changes()
+        if not added and not deleted:
+            return
+        if added:
+            self.check_tokenizer()
+        start = time.perf_counter()
+        with ingestion.change_lock:
+            added_ids = ingestion.add_images(added, self.engines, bundle)
+            removed = ingestion.delete_images(deleted, self.engines, bundle)
+            ingestion.compact(self.engines, bundle)
+        logger.info(f"Replayed the ingestion journal: {len(added_ids)} image(s) added, {len(removed)} removed "
+                    f"in {time.perf_counter() - start:.2f}s")
+
+    @contextmanager
+    def swapping(self, bundle: bundles.IndexBundle) -> Iterator[None]:
+        """Replay the journal into a bundle about to be swapped in, holding further changes off until it is."""
+        with ingestion.change_lock:
+            self.replay(bundle)
+            yield
+
+    async def compact_periodically(self) -> None:
+        """Compact the served indices whenever enough images are tombstoned (runs until cancelled)."""
+        while True:
+            await asyncio.sleep(self.compact_interval_s)
+            if ingestion.get_num_tombstones() >= self.compact_min_tombstones:
+                try:
+                    await asyncio.to_thread(self.compact)
+                except Exception as e:
+                    logger.error(f"Compaction failed: {str(e)}")
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get the state of the served indices, the journal and the last compaction."""
+        return {
+            "indices": ingestion.get_status(),
+            "journal": self.store.get_counts(),
+            "compaction": dict(self.status, interval_s=self.compact_interval_s,
+                               min_tombstones=self.compact_min_tombstones),
+        }
@@ -0,0 +1,103 @@
+"""
+Durable journal of the images added and removed through live ingestion.
+
+Live changes are applied to the indices in memory (see retreivers/ingestion.py),
+so they are also recorded here, one row per image id with its latest state. An
+added image is stored with its item and embeddings, so that replaying it never
+fetches or encodes it again. A removed image keeps only its id, URL and removal
+time. On startup and before a new index bundle is swapped in, the journal is
+replayed into the bundle: added images it lacks are appended, removed images it
+holds are dropped.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants
+BUSY_TIMEOUT_S = 30.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    image_id TEXT PRIMARY KEY,
+    image_url TEXT NOT NULL,
+    -- item and embeddings are NULL once the image is removed
+    item TEXT,
+    embeddings TEXT,
+    added_at TEXT,
+    deleted_at TEXT
+);
+"""
+
+class IngestionStore:
+    """SQLite-backed journal of the latest live change of each image."""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): SQLite database file
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT_S, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+
+    def record_added(self, image_id: str, item: Dict[str, Any], embeddings: Dict[str, Any]) -> None:
+        """Record an added image with the embeddings it was indexed with."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO images (image_id, image_url, item, embeddings, added_at, deleted_at) "
+                "VALUES (?, ?, ?, ?, ?, NULL) "
+                "ON CONFLICT (image_id) DO UPDATE SET image_url = excluded.image_url, item = excluded.item, "
+                "embeddings = excluded.embeddings, added_at = excluded.added_at, deleted_at = NULL",
+                (image_id, item["image_url"], json.dumps(item), json.dumps(embeddings),
+                 datetime.now(timezone.utc).isoformat())
+            )
+
+    def record_deleted(self, image_id: str, image_url: str) -> None:
+        """Record a removed image, dropping its item and embeddings."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO images (image_id, image_url, deleted_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (image_id) DO UPDATE SET item = NULL, embeddings = NULL, deleted_at = excluded.deleted_at",
+                (image_id, image_url, datetime.now(timezone.utc).isoformat())
+            )
+
+    def get_changes(self) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """
+        Get the journal to replay into a bundle.
+
+        Returns:
+            Tuple[List[Dict[str, Any]], List[str]]: The added images ({"item", "embeddings"}), oldest
+                first, and the ids of the removed images
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT image_id, item, embeddings, deleted_at FROM images ORDER BY added_at, image_id"
+            ).fetchall()
+        added = [
+            {"item": json.loads(row["item"]), "embeddings": json.loads(row["embeddings"])}
+            for row in rows if row["deleted_at"] is None
+        ]
+        deleted = [row["image_id"] for row in rows if row["deleted_at"] is not None]
+        return added, deleted
+
+    def get_counts(self) -> Dict[str, int]:
+        """Get the number of added and removed images in the journal."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT COUNT(*) - COUNT(deleted_at) AS added, COUNT(deleted_at) AS deleted FROM images"
+            ).fetchone()
+        return {"added": row["added"], "deleted": row["deleted"]}
@@ -1,18 +1,85 @@
 import fastapi
 from fastapi.middleware.cors import CORSMiddleware
 import asyncio
-import json
+import logging
 import os
-from fastapi.responses import JSONResponse
+import secrets
+import time
+from contextlib import asynccontextmanager
+from fastapi.responses import JSONResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from pydantic import BaseModel
-from typing import Dict, List, Any
-from retreivers.bge_retreiver import get_multiple_images_metadata_all_structures as get_bge_images
-from retreivers.clip_retreiver import get_multiple_images_metadata as get_clip_images
-from retreivers.tfidf_retreiver import get_multiple_images_metadata_all_structures as get_tfidf_images
-from retreivers.bm25_retreiver import get_multiple_images_metadata_all_structures as get_bm25_images
+from typing import Dict, List, Any, Optional
+from retreivers import bundles, ingestion, metrics, registry
+from retreivers.resources import apply_thread_budget
+from backend.warmup import RetrieverWarmup, get_rss_bytes
+from backend.profiling import RequestProfiler
+from backend.evaluation_store import EvaluationStore
+from backend.bundle_manager import BundleManager
+from backend.ingestion_manager import INGESTION_DB, IngestionManager
+from backend.ingestion_store import IngestionStore
+from backend.coordinator import METHOD_ENCODERS, SHARD_NODES, SHARDED_METHODS, Coordinator, search_shard
 
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
-app = fastapi.FastAPI()
+# Cap torch/FAISS/BLAS threads so concurrent retrievers do not oversubscribe the CPU
+apply_thread_budget()
+
+# Constants
+RESULTS_DIR = "evaluation_results"
+# Whole-file results of earlier versions, imported into the evaluation database once
+RESULTS_FILE = os.path.join(RESULTS_DIR, "evaluation_results.json")
+EVALUATION_DB = os.getenv("EVALUATION_DB", os.path.join(RESULTS_DIR, "evaluations.sqlite3"))
+# Load and warm up every retriever in the background right after startup
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+# Token required in the X-Admin-Token header by the /admin endpoints (unset disables them)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Retrievers served by /get-images: result key -> (function, extra arguments after the query).
+# Only the methods in RETRIEVERS_ENABLED are served, and their modules are imported on first use.
+RETRIEVERS = registry.get_retrievers()
+# With SHARD_NODES set, /get-images is answered by the shard nodes (see backend/coordinator.py)
+coordinator = Coordinator(SHARD_NODES, list(RETRIEVERS)) if SHARD_NODES else None
+
+# A coordinator loads no index, only the query encoders
+warmup = RetrieverWarmup(coordinator.get_warmup_retrievers() if coordinator is not None else RETRIEVERS)
+profiler = RequestProfiler()
+evaluation_store = EvaluationStore(EVALUATION_DB, legacy_path=RESULTS_FILE)
+# Live ingestion needs the full indices in this process, not on shard workers or nodes
+if coordinator is not None:
+    INGESTION_UNAVAILABLE = "Ingestion is not available in coordinator mode, add images to the shard nodes' bundles"
+else:
+    INGESTION_UNAVAILABLE = ingestion.get_unavailable_reason()
+ingestion_manager = (
+    IngestionManager(list(RETRIEVERS), IngestionStore(INGESTION_DB)) if INGESTION_UNAVAILABLE is None else None
+)
+# New bundles get the live changes replayed before they are swapped in
+bundle_manager = BundleManager(
+    RETRIEVERS, before_swap=ingestion_manager.swapping if ingestion_manager is not None else None
+)
+
+@asynccontextmanager
+async def lifespan(app: fastapi.FastAPI):
+    """Start the retriever warmup without blocking startup, so /healthz answers meanwhile."""
+    # Serve the index bundle named in bundles/CURRENT, if any, instead of the repository's preprocess outputs
+    await asyncio.to_thread(bundle_manager.activate_current)
+    if ingestion_manager is not None:
+        # Images added or removed live before the restart
+        await asyncio.to_thread(ingestion_manager.replay)
+        app.state.compaction_task = asyncio.create_task(ingestion_manager.compact_periodically())
+    if WARMUP_ON_STARTUP:
+        app.state.warmup_task = asyncio.create_task(asyncio.to_thread(warmup.run))
+    else:
+        warmup.mark_skipped()
+    yield
+    if ingestion_manager is not None:
+        app.state.compaction_task.cancel()
+    if coordinator is not None:
+        await coordinator.close()
+
+app = fastapi.FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -21,75 +88,429 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Profile-Id"],
 )
 
-# Constants
-RESULTS_DIR = "evaluation_results"
-RESULTS_FILE = os.path.join(RESULTS_DIR, "evaluation_results.json")
-
-# Ensure results directory exists
-os.makedirs(RESULTS_DIR, exist_ok=True)
+@app.middleware("http")
+async def record_request_metrics(request: fastapi.Request, call_next):
+    """Count requests and time them per route (the route template keeps label cardinality bounded)."""
+    metrics.HTTP_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics.HTTP_IN_FLIGHT.dec()
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        metrics.HTTP_LATENCY.labels(path).observe(time.perf_counter() - start)
+        metrics.HTTP_REQUESTS.labels(path, str(status)).inc()
 
 # Pydantic model for evaluation results
 class EvaluationResults(BaseModel):
     queries: List[str] = []
     results: Dict[str, Any] = {}
 
+# Pydantic model for a query forwarded by a coordinator to a shard node
+class ShardSearch(BaseModel):
+    query: str
+    k: int = 1
+    methods: List[str] = []
+    embeddings: Dict[str, List[float]] = {}
+
+# Pydantic model for one evaluated query
+class Evaluation(BaseModel):
+    query: str
+    timestamp: Optional[str] = None
+    selections: Dict[str, str] = {}
+    images: Dict[str, Any] = {}
+
+# Pydantic model for an image added through live ingestion, with the fields of preprocess/dataset/image_metadata.json
+class ImageItem(BaseModel):
+    image_url: str
+    topic: Optional[str] = None
+    subtopic: Optional[str] = None
+    caption: Optional[str] = None
+    topic_mapped_image_description: str = ""
+    context_free_description: str = ""
+    topic_definition: str = ""
+    subtopic_definition: str = ""
+
+def _run_retriever(method: str, function, *args):
+    """
+    Run a retriever on the thread pool, recording its queueing, latency and outcome.
+    A call counts as an error if it raised, or caught and recorded an error (see metrics.record_error).
+    Images removed through live ingestion are left out of its results.
+    """
+    metrics.TASKS_QUEUED.dec()
+    metrics.TASKS_RUNNING.inc()
+    start = time.perf_counter()
+    status = "error"
+    try:
+        with metrics.track_errors() as errors:
+            result = ingestion.run_search(function, *args)
+        status = "error" if errors else "ok"
+        return result
+    finally:
+        metrics.TASKS_RUNNING.dec()
+        elapsed = time.perf_counter() - start
+        metrics.RETRIEVER_LATENCY.labels(method).observe(elapsed)
+        metrics.record_span(method, elapsed)
+        metrics.RETRIEVER_REQUESTS.labels(method, status).inc()
+
 @app.get("/get-images")
-async def get_images(query: str, k: int = 1):
+async def get_images(query: str, k: int = 1, debug: Optional[str] = None):
     """
     Get images matching the query using multiple retrieval methods.
     
+    The response carries a Server-Timing header with the time spent per method, stage
+    (encode/search/metadata) and structure.
+    
     Args:
         query: The search query
         k: Number of results to return per method (default: 1)
+        debug: "timings" to also embed the timing breakdown in the response body
     """
+    if coordinator is not None:
+        return await _get_images_from_nodes(query, k, debug)
+    spans = metrics.start_request_spans()
+    # Every retriever thread of this request reads the same index bundle, even if a new one is swapped in meanwhile
+    bundle = bundles.pin()
+    profile = profiler.claim(query)
+    start = time.perf_counter()
+    
     # Run CPU-intensive retrieval functions in thread pool
-    bge_results, clip_results, tfidf_results, bm25_with_stopwords, bm25_without_stopwords = await asyncio.gather(
-        asyncio.to_thread(get_bge_images, query, k),
-        asyncio.to_thread(get_clip_images, query, k),
-        asyncio.to_thread(get_tfidf_images, query, k),
-        asyncio.to_thread(get_bm25_images, query, "with_stopwords", k),
-        asyncio.to_thread(get_bm25_images, query, "without_stopwords", k)
-    )
+    metrics.TASKS_QUEUED.inc(len(RETRIEVERS))
+    if profile is None:
+        results = await asyncio.gather(*[
+            asyncio.to_thread(_run_retriever, method, function, query, *arguments, k)
+            for method, (function, arguments) in RETRIEVERS.items()
+        ])
+    else:
+        results = await asyncio.gather(*[
+            asyncio.to_thread(profile.run, method, _run_retriever, method, function, query, *arguments, k)
+            for method, (function, arguments) in RETRIEVERS.items()
+        ])
+        profile.wall_time_ms = 1000 * (time.perf_counter() - start)
+    metrics.record_span("retrieval", time.perf_counter() - start)
     
     # Combine all results
-    return {
+    content = {
         "query": query,
-        "results": {
-            "bge": bge_results,
-            "clip": clip_results, 
-            "tfidf": tfidf_results,
-            "bm25_with_stopwords": bm25_with_stopwords,
-            "bm25_without_stopwords": bm25_without_stopwords
-        }
+        "results": dict(zip(RETRIEVERS, results)),
+        "index_version": bundle.version
+    }
+    timings = metrics.summarize_spans(spans)
+    if debug == "timings":
+        content["timings"] = timings
+    
+    start = time.perf_counter()
+    response = JSONResponse(content=content)
+    timings["serialize"] = {"duration_ms": 1000 * (time.perf_counter() - start), "count": 1}
+    response.headers["Server-Timing"] = metrics.format_server_timing(timings)
+    if profile is not None:
+        response.headers["X-Profile-Id"] = profile.id
+    return response
+
+async def _get_images_from_nodes(query: str, k: int, debug: Optional[str]) -> JSONResponse:
+    """Answer /get-images in coordinator mode, from the shard nodes."""
+    spans = metrics.start_request_spans()
+    start = time.perf_counter()
+    content = {"query": query, **await coordinator.search(query, k)}
+    metrics.record_span("retrieval", time.perf_counter() - start)
+    for index, outcome in enumerate(content["shards"]):
+        metrics.record_span(f"node{index}", outcome["latency_ms"] / 1000)
+    timings = metrics.summarize_spans(spans)
+    if debug == "timings":
+        content["timings"] = timings
+    response = JSONResponse(content=content)
+    response.headers["Server-Timing"] = metrics.format_server_timing(timings)
+    return response
+
+@app.post("/shard/search")
+async def search_shard_node(search: ShardSearch):
+    """
+    Search the shard this backend serves as a node (NODE_SHARD), for a coordinator.
+    
+    Results come with scores comparable across nodes (lower is better) and global row ids.
+    Queries with a precomputed embedding in "embeddings" (by encoder, "bge" or "clip") are not encoded again.
+    """
+    unknown = set(search.methods) - set(SHARDED_METHODS)
+    if unknown:
+        raise fastapi.HTTPException(status_code=400, detail=f"Retrievers cannot be sharded: {sorted(unknown)}")
+    bundles.pin()
+    methods = search.methods or SHARDED_METHODS
+    results = await asyncio.gather(*[
+        asyncio.to_thread(
+            search_shard, method, search.query, search.k, search.embeddings.get(METHOD_ENCODERS.get(method, ""))
+        )
+        for method in methods
+    ])
+    return {"results": dict(zip(methods, results))}
+
+@app.get("/readyz")
+async def readyz():
+    """
+    Readiness probe: 200 once every retriever is warmed up, 503 before that or if one failed to load.
+    """
+    if warmup.is_ready():
+        return {"status": "ready"}
+    status = "failed" if warmup.finished else "warming_up"
+    return JSONResponse(status_code=503, content={"status": status})
+
+@app.get("/healthz")
+async def healthz():
+    """
+    Liveness probe with the load state, load time and memory footprint of each retriever.
+    """
+    return {
+        "status": "ok",
+        "ready": warmup.is_ready(),
+        "memory_bytes": get_rss_bytes(),
+        "retrievers": warmup.status
+    }
+
+def _require_admin(x_admin_token: Optional[str] = fastapi.Header(None)):
+    """Reject the request unless it carries the admin token."""
+    if not ADMIN_TOKEN:
+        raise fastapi.HTTPException(status_code=404, detail="Admin endpoints are disabled, set ADMIN_TOKEN")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise fastapi.HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.post("/admin/profile", dependencies=[fastapi.Depends(_require_admin)])
+async def arm_profiler(requests: int = 1):
+    """
+    Profile the next requests to /get-images; their responses carry the report id in X-Profile-Id.
+    
+    Args:
+        requests: Number of upcoming requests to profile (default: 1)
+    """
+    profiler.arm(requests)
+    return {"armed": profiler.remaining}
+
+@app.delete("/admin/profile", dependencies=[fastapi.Depends(_require_admin)])
+async def disarm_profiler():
+    """
+    Stop profiling requests that have not started yet.
+    """
+    profiler.disarm()
+    return {"armed": 0}
+
+@app.get("/admin/profiles", dependencies=[fastapi.Depends(_require_admin)])
+async def list_profiles():
+    """
+    List the kept profile reports, oldest first.
+    """
+    return [session.summary() for session in profiler.reports.values()]
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[fastapi.Depends(_require_admin)])
+async def download_profile(profile_id: str, format: str = "text"):
+    """
+    Download a profile report.
+    
+    Args:
+        profile_id: Id from the X-Profile-Id header or the report listing
+        format: "text" for the top functions per retriever, "pstats" for a merged pstats file
+    """
+    session = profiler.reports.get(profile_id)
+    if session is None:
+        raise fastapi.HTTPException(status_code=404, detail=f"No profile {profile_id}")
+    if format == "pstats":
+        return Response(
+            content=session.to_pstats(),
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": f'attachment; filename="profile_{profile_id}.pstats"'}
+        )
+    return Response(
+        content=session.to_text(),
+        media_type="text/plain",
+        headers={"Content-Disposition": f'attachment; filename="profile_{profile_id}.txt"'}
+    )
+
+@app.get("/admin/bundles", dependencies=[fastapi.Depends(_require_admin)])
+async def list_bundles():
+    """
+    Get the active index bundle, the bundle versions on disk and the state of the last activation.
+    """
+    return {
+        "active": bundles.get_active().summary(),
+        "versions": bundle_manager.list_versions(),
+        "activation": bundle_manager.status
+    }
+
+@app.post("/admin/bundles/{version}/activate", status_code=202, dependencies=[fastapi.Depends(_require_admin)])
+async def activate_bundle(version: str, persist: bool = True):
+    """
+    Load an index bundle in the background and swap it in once verified and warmed up.
+    Requests keep being served from the active bundle meanwhile; poll /admin/bundles for the outcome.
+    
+    Args:
+        version: Bundle version, the name of its directory under INDEX_BUNDLE_DIR
+        persist: Also serve this version after a restart (default: true)
+    """
+    if version not in bundles.list_versions(bundle_manager.bundle_dir):
+        raise fastapi.HTTPException(status_code=404, detail=f"No index bundle {version}")
+    if bundle_manager.is_busy():
+        raise fastapi.HTTPException(status_code=409, detail="Another bundle activation is in progress")
+    app.state.bundle_task = asyncio.create_task(
+        asyncio.to_thread(_activate_bundle, version, persist)
+    )
+    return {"status": "loading", "version": version}
+
+def _activate_bundle(version: str, persist: bool) -> None:
+    """Activate a bundle on a worker thread; failures are logged and reported in /admin/bundles."""
+    try:
+        bundle_manager.activate(version, persist)
+    except Exception:
+        # The manager records the error in its status, unless another activation was in progress
+        logger.exception(f"Activation of bundle {version} failed")
+
+def _require_ingestion():
+    """Reject the request unless live ingestion can run, i.e. the indices are served by this process."""
+    if ingestion_manager is None:
+        raise fastapi.HTTPException(status_code=409, detail=INGESTION_UNAVAILABLE)
+    if not warmup.finished:
+        raise fastapi.HTTPException(status_code=503, detail="The retrievers are warming up, retry shortly")
+
+# Live ingestion endpoints change the served indices, they are admin-only
+INGESTION_DEPENDENCIES = [fastapi.Depends(_require_admin), fastapi.Depends(_require_ingestion)]
+
+@app.post("/images", status_code=201, dependencies=INGESTION_DEPENDENCIES)
+async def add_image(item: ImageItem):
+    """
+    Add an image to every served index without a rebuild. Its texts are embedded with BGE,
+    its image is downloaded and embedded with CLIP, and the sparse statistics are updated.
+    The image is searchable once this returns.
+    """
+    try:
+        image_id = await asyncio.to_thread(ingestion_manager.add_image, item.model_dump())
+    except ValueError as e:
+        raise fastapi.HTTPException(status_code=400, detail=str(e))
+    except LookupError as e:
+        # The BM25 tokenizer's NLTK data is missing and could not be downloaded
+        raise fastapi.HTTPException(status_code=503, detail=str(e))
+    if image_id is None:
+        raise fastapi.HTTPException(status_code=409, detail=f"Image {item.image_url} is already indexed")
+    return {"image_id": image_id, "image_url": item.image_url, "index_version": bundles.get_active().version}
+
+@app.delete("/images/{image_id}", dependencies=INGESTION_DEPENDENCIES)
+async def delete_image(image_id: str):
+    """
+    Remove an image from every served index. It is left out of the results right away,
+    and its rows are removed by the next compaction.
+    
+    Args:
+        image_id: Id returned when the image was added, the first 16 hex digits of the SHA-1 of its URL
+    """
+    image_url = await asyncio.to_thread(ingestion_manager.delete_image, image_id)
+    if image_url is None:
+        raise fastapi.HTTPException(status_code=404, detail=f"No image {image_id}")
+    return {"image_id": image_id, "image_url": image_url, "index_version": bundles.get_active().version}
+
+@app.get("/admin/ingestion", dependencies=INGESTION_DEPENDENCIES)
+async def get_ingestion_status():
+    """
+    Get the images, tombstones and rows per index of the served bundle, the journal counts
+    and the last compaction.
+    """
+    return await asyncio.to_thread(ingestion_manager.get_status)
+
+@app.post("/admin/ingestion/compact", dependencies=INGESTION_DEPENDENCIES)
+async def compact_indices():
+    """
+    Remove the rows of the tombstoned images from every served index now.
+    """
+    return {"compacted": await asyncio.to_thread(ingestion_manager.compact)}
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Prometheus metrics: request and retriever latency histograms, stage timings, cache and thread-pool
+    gauges, and the sizes of the loaded indices.
+    """
+    bge_retreiver = registry.get_loaded_module("retreivers.bge_retreiver")
+    if bge_retreiver is not None:
+        for structure_num, index in bge_retreiver.get_loaded_indices().items():
+            metrics.set_index_size("bge", str(structure_num), index)
+    clip_retreiver = registry.get_loaded_module("retreivers.clip_retreiver")
+    clip_index = clip_retreiver.get_loaded_index() if clip_retreiver is not None else None
+    if clip_index is not None:
+        metrics.set_index_size("clip", "all", clip_index)
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/encoder-stats")
+async def get_encoder_stats():
+    """
+    Get micro-batching metrics (batch sizes, queue delays) of the query encoders
+    (empty for encoders that are not loaded).
+    """
+    return {
+        name: module.get_batching_stats() if module is not None else {}
+        for name, module in (
+            ("bge", registry.get_loaded_module("retreivers.bge_retreiver")),
+            ("clip", registry.get_loaded_module("retreivers.clip_retreiver")),
+        )
     }
 
 @app.get("/evaluation-results")
 async def get_evaluation_results():
     """
-    Get all evaluation results from the JSON file.
+    Get the latest evaluation of every query.
     """
-    if os.path.exists(RESULTS_FILE):
-        try:
-            with open(RESULTS_FILE, 'r') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            return EvaluationResults().dict()
-    else:
-        return EvaluationResults().dict()
+    return await asyncio.to_thread(evaluation_store.get_results)
 
 @app.post("/evaluation-results")
 async def save_evaluation_results(results: EvaluationResults):
     """
-    Save evaluation results to the JSON file.
+    Save evaluation results posted as a whole (older clients). Only evaluations not
+    stored yet are appended, so concurrent evaluators do not overwrite each other.
     """
     try:
-        with open(RESULTS_FILE, 'w') as f:
-            json.dump(results.dict(), f, indent=2)
-        return JSONResponse(status_code=200, content={"message": "Results saved successfully"})
+        added = await asyncio.to_thread(evaluation_store.add_results, results.results)
+        return JSONResponse(status_code=200, content={"message": "Results saved successfully", "added": added})
     except Exception as e:
         return JSONResponse(
             status_code=500, 
             content={"message": f"Failed to save results: {str(e)}"}
         )
+
+@app.get("/evaluation-summary")
+async def get_evaluation_summary():
+    """
+    Get the correct/total counts and accuracy per method and structure, over the latest
+    evaluation of each query. The counts are maintained as evaluations arrive.
+    """
+    return await asyncio.to_thread(evaluation_store.get_summary)
+
+@app.post("/evaluations")
+async def add_evaluation(evaluation: Evaluation):
+    """
+    Append the evaluation of one query.
+    """
+    try:
+        evaluation_id = await asyncio.to_thread(
+            evaluation_store.add_evaluation,
+            evaluation.query, evaluation.selections, evaluation.images, evaluation.timestamp
+        )
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"message": f"Failed to save evaluation: {str(e)}"})
+    if evaluation_id is None:
+        return JSONResponse(status_code=409, content={"message": "Evaluation already saved"})
+    return {"id": evaluation_id}
+
+@app.get("/evaluations")
+async def list_evaluations(query: Optional[str] = None, method: Optional[str] = None,
+                           structure: Optional[int] = None, limit: int = 100, offset: int = 0):
+    """
+    Get a page of stored judgements (one per evaluated image), oldest first.
+    
+    Args:
+        query: Only judgements of this query
+        method: Only judgements of this method, e.g. "bge" or "clip"
+        structure: Only judgements of this structure
+        limit: Page size (at most 1000)
+        offset: Judgements to skip
+    """
+    return await asyncio.to_thread(evaluation_store.list_judgements, query, method, structure, limit, offset)
@@ -0,0 +1,111 @@
+"""
+On-demand profiling of /get-images requests.
+
+An admin arms the profiler for the next N requests. Each of those requests
+runs its retrievers under cProfile, one profile per retriever thread, and
+keeps the result as a report that can be downloaded as text or as a pstats
+file (for snakeviz, gprof2dot or pstats). While the profiler is not armed,
+the only cost per request is reading one integer.
+"""
+
+import cProfile
+import io
+import marshal
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Constants
+MAX_REPORTS = 20
+REPORT_FUNCTIONS = 40
+
+# From Python 3.12 cProfile is built on sys.monitoring and only one profiler can be active
+# at a time, so the retriever threads of a profiled request take turns there
+_exclusive = threading.Lock() if sys.version_info >= (3, 12) else nullcontext()
+
+class ProfileSession:
+    """Profiles of the retriever threads of one request."""
+
+    def __init__(self, query: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.query = query
+        self.created = time.time()
+        self.wall_time_ms: Optional[float] = None
+        self._profiles: List[Tuple[str, cProfile.Profile]] = []
+        self._lock = threading.Lock()
+
+    def run(self, name: str, function: Callable, *args) -> Any:
+        """Call a function under a profiler of its own (one per thread)."""
+        with _exclusive:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                return function(*args)
+            finally:
+                profiler.disable()
+                with self._lock:
+                    self._profiles.append((name, profiler))
+
+    def summary(self) -> Dict[str, Any]:
+        """Get the listing entry of this report."""
+        return {
+            "id": self.id,
+            "query": self.query,
+            "created": self.created,
+            "wall_time_ms": self.wall_time_ms,
+            "threads": [name for name, _ in self._profiles],
+        }
+
+    def to_text(self) -> str:
+        """Render the top functions by cumulative time, per retriever thread."""
+        out = io.StringIO()
+        wall_time = "in progress" if self.wall_time_ms is None else f"{self.wall_time_ms:.1f} ms"
+        out.write(f"Profile {self.id} of query {self.query!r}, wall time {wall_time}\n")
+        for name, profiler in self._profiles:
+            out.write(f"\n===== {name} =====\n")
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(REPORT_FUNCTIONS)
+        return out.getvalue()
+
+    def to_pstats(self) -> bytes:
+        """Merge the thread profiles into one pstats file, as written by Stats.dump_stats."""
+        profilers = [profiler for _, profiler in self._profiles]
+        stats = pstats.Stats(*profilers) if profilers else pstats.Stats()
+        return marshal.dumps(stats.stats)
+
+class RequestProfiler:
+    """Arms profiling for the next N requests and keeps their latest reports."""
+
+    def __init__(self, max_reports: int = MAX_REPORTS):
+        self.remaining = 0
+        self.max_reports = max_reports
+        self.reports: "OrderedDict[str, ProfileSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def arm(self, num_requests: int) -> None:
+        """Profile the next num_requests requests."""
+        with self._lock:
+            self.remaining = max(0, num_requests)
+
+    def disarm(self) -> None:
+        """Stop profiling requests that have not started yet."""
+        with self._lock:
+            self.remaining = 0
+
+    def claim(self, query: str) -> Optional[ProfileSession]:
+        """Start a profile session for a request if the profiler is armed, else return None."""
+        if self.remaining <= 0:
+            return None
+        with self._lock:
+            if self.remaining <= 0:
+                return None
+            self.remaining -= 1
+            session = ProfileSession(query)
+            self.reports[session.id] = session
+            while len(self.reports) > self.max_reports:
+                self.reports.popitem(last=False)
+            return session
@@ -0,0 +1,94 @@
+"""
+Startup warmup and load-state tracking for the retrievers.
+
+Models, indices and pickles load lazily on a retriever's first query. The
+warmup runs one dummy query through every retriever right after startup, one
+at a time, and records per retriever whether it loaded, how long the first
+query took and how much resident memory the process gained meanwhile. The
+retrievers catch their own errors and return no results, so a retriever also
+fails its warmup if it recorded an error or found nothing for the dummy query.
+"""
+
+import logging
+import os
+import resource
+import sys
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from retreivers import metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants
+WARMUP_QUERY = "warm up"
+
+def get_rss_bytes() -> Optional[int]:
+    """Get the resident memory of this process (current on Linux, peak elsewhere)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+        return peak if sys.platform == "darwin" else peak * 1024
+
+def is_empty(results: Any) -> bool:
+    """Whether a retriever returned no results, or none for one of its structures."""
+    if isinstance(results, dict):
+        return not results or any(is_empty(value) for value in results.values())
+    return results is None or len(results) == 0
+
+class RetrieverWarmup:
+    """Warms up retrievers and reports their load state."""
+
+    def __init__(self, retrievers: Dict[str, Tuple[Callable, Tuple]]):
+        """
+        Args:
+            retrievers (Dict[str, Tuple[Callable, Tuple]]): Retriever name -> (function, extra arguments
+                after the query), called as function(query, *arguments, k)
+        """
+        self.retrievers = retrievers
+        self.finished = False
+        self.status: Dict[str, Dict[str, Any]] = {
+            name: {"state": "pending", "load_time_s": None, "memory_bytes": None, "error": None}
+            for name in retrievers
+        }
+
+    def run(self) -> None:
+        """Run one dummy query through each retriever in turn (blocking)."""
+        for name, (function, arguments) in self.retrievers.items():
+            status = self.status[name]
+            status["state"] = "loading"
+            rss_before = get_rss_bytes()
+            start = time.perf_counter()
+            try:
+                with metrics.track_errors() as errors:
+                    results = function(WARMUP_QUERY, *arguments, 1)
+                if errors:
+                    raise RuntimeError(errors[0])
+                if is_empty(results):
+                    raise RuntimeError("No results for the warmup query")
+                status["state"] = "ready"
+            except Exception as e:
+                logger.error(f"Warmup of {name} failed: {str(e)}")
+                status["state"] = "failed"
+                status["error"] = str(e)
+            status["load_time_s"] = time.perf_counter() - start
+            rss_after = get_rss_bytes()
+            if rss_before is not None and rss_after is not None:
+                status["memory_bytes"] = max(0, rss_after - rss_before)
+            logger.info(f"Warmed up {name} in {status['load_time_s']:.2f}s ({status['state']})")
+        self.finished = True
+
+    def mark_skipped(self) -> None:
+        """Mark every retriever as loading lazily, for when warmup is disabled."""
+        for status in self.status.values():
+            status["state"] = "lazy"
+        self.finished = True
+
+    def is_ready(self) -> bool:
+        """Whether warmup has finished and no retriever failed to load."""
+        return self.finished and all(status["state"] != "failed" for status in self.status.values())
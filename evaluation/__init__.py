@@ -0,0 +1 @@
+"""Evaluation and benchmarking scripts."""
@@ -0,0 +1,268 @@
+"""
+Search latency of on-disk IVF indices against the share of the index in the page cache.
+
+An on-disk IVF index (see retreivers/ondisk_index.py) reads its inverted lists
+through the page cache. A query is fast when the lists it scans are in memory,
+and pays for disk reads when they are not. For each nprobe and each warm
+fraction, the benchmark:
+  - evicts the .ivfdata file from the page cache;
+  - reads back a random share of its 64 KiB blocks, the warm fraction;
+  - times single queries.
+Before each query, the index is reopened and the blocks that are not in the warm
+share are evicted again, so every query starts from the same cache state. A
+warm fraction of 0 is a cold cache and 1 a fully warm one. The report gives the
+share of the file actually resident before each query (measured with mincore),
+the latency and the recall of the top k against the flat float32 index.
+
+Queries are stored vectors with Gaussian noise added, so no query encoder is
+loaded. The flat index is mapped rather than read, so the corpus may be larger
+than RAM. With --build, the on-disk index of a corpus that only has flat indices
+(e.g. from preprocess/dataset/generate_synthetic.py) is built from them.
+
+Usage:
+    python evaluation/benchmark_ondisk.py --data synthetic/1m --build --nprobe 8 16 64
+"""
+
+import argparse
+import contextlib
+import ctypes
+import json
+import logging
+import mmap
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.abspath("."))
+
+from retreivers import bge_retreiver, bundles, clip_retreiver, ondisk_index
+from evaluation.run_evaluation import RESULTS_DIR
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants
+SOURCES = ["bge", "clip"]
+STRUCTURE = 1
+BLOCK_SIZE = 64 * 1024
+QUERY_NOISE = 0.05
+
+def get_index_paths(name: str) -> Tuple[str, str]:
+    """Get the flat and on-disk index paths of a benchmarked retriever, in the current bundle."""
+    if name == "bge":
+        return (bge_retreiver.get_index_path(STRUCTURE, ""),
+                bge_retreiver.get_index_path(STRUCTURE, ondisk_index.ONDISK_VARIANT))
+    return clip_retreiver.get_index_path(""), clip_retreiver.get_index_path(ondisk_index.ONDISK_VARIANT)
+
+def resident_fraction(path: str) -> Optional[float]:
+    """Get the share of a file's pages in the page cache (Linux mincore), None if it cannot be measured."""
+    size = os.path.getsize(path)
+    if size == 0:
+        return 1.0
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.mmap.restype = ctypes.c_void_p
+        libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_long]
+        libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+        libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+    except (AttributeError, OSError):
+        return None
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        # Mapping the file does not load it, mincore then reports which pages are cached
+        address = libc.mmap(None, size, mmap.PROT_READ, mmap.MAP_SHARED, fd, 0)
+        if address in (None, ctypes.c_void_p(-1).value):
+            return None
+        try:
+            pages = (ctypes.c_ubyte * ((size + mmap.PAGESIZE - 1) // mmap.PAGESIZE))()
+            if libc.mincore(address, size, pages) != 0:
+                return None
+            return float((np.frombuffer(pages, dtype=np.uint8) & 1).mean())
+        finally:
+            libc.munmap(address, size)
+    finally:
+        os.close(fd)
+
+@contextlib.contextmanager
+def silence_stdout():
+    """Silence the C-level stdout, where faiss reports the path of the lists file each time an index is read."""
+    sys.stdout.flush()
+    saved_fd = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    try:
+        os.dup2(devnull, 1)
+        yield
+    finally:
+        os.dup2(saved_fd, 1)
+        os.close(devnull)
+        os.close(saved_fd)
+
+def get_block_runs(blocks: np.ndarray) -> List[Tuple[int, int]]:
+    """Group sorted block numbers into (first block, number of blocks) runs."""
+    runs = []
+    for block in blocks:
+        if runs and runs[-1][0] + runs[-1][1] == block:
+            runs[-1] = (runs[-1][0], runs[-1][1] + 1)
+        else:
+            runs.append((int(block), 1))
+    return runs
+
+class PageCache:
+    """Holds a file's page cache state at a chosen share of warm blocks."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.num_blocks = (os.path.getsize(path) + BLOCK_SIZE - 1) // BLOCK_SIZE
+        self.cold_runs: List[Tuple[int, int]] = [(0, self.num_blocks)]
+
+    def _evict(self, fd: int, runs: List[Tuple[int, int]]) -> None:
+        """Drop block runs from the page cache (only pages that are clean and not mapped can be dropped)."""
+        for first, count in runs:
+            os.posix_fadvise(fd, first * BLOCK_SIZE, count * BLOCK_SIZE, os.POSIX_FADV_DONTNEED)
+
+    def set_warm_fraction(self, warm_fraction: float, rng: np.random.Generator) -> None:
+        """Evict the whole file, then read a random share of its blocks back."""
+        blocks = rng.permutation(self.num_blocks)
+        num_warm = int(round(warm_fraction * self.num_blocks))
+        warm_runs = get_block_runs(np.sort(blocks[:num_warm]))
+        self.cold_runs = get_block_runs(np.sort(blocks[num_warm:]))
+
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            self._evict(fd, [(0, self.num_blocks)])
+            # Without readahead, which would also load (and keep loading after the reads) cold blocks
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_RANDOM)
+            for first, count in warm_runs:
+                os.pread(fd, count * BLOCK_SIZE, first * BLOCK_SIZE)
+        finally:
+            os.close(fd)
+
+    def reset(self) -> None:
+        """Evict the cold blocks read by the last query, keeping the warm ones."""
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            self._evict(fd, self.cold_runs)
+        finally:
+            os.close(fd)
+
+def make_queries(flat_index: faiss.Index, num_queries: int, rng: np.random.Generator) -> np.ndarray:
+    """Draw queries near stored vectors: random rows with Gaussian noise, normalized."""
+    rows = np.sort(rng.choice(flat_index.ntotal, min(num_queries, flat_index.ntotal), replace=False))
+    queries = flat_index.reconstruct_batch(rows)
+    queries += rng.normal(scale=QUERY_NOISE / np.sqrt(flat_index.d), size=queries.shape).astype(np.float32)
+    faiss.normalize_L2(queries)
+    return queries
+
+def benchmark_source(name: str, nprobes: List[int], warm_fractions: List[float], num_queries: int,
+                     k: int, build: bool, nlist: Optional[int]) -> List[Dict[str, Any]]:
+    """
+    Benchmark the on-disk index of one retriever at each nprobe and warm fraction.
+
+    Returns:
+        List[Dict[str, Any]]: One report row per nprobe and warm fraction
+    """
+    flat_path, index_path = get_index_paths(name)
+    if not os.path.exists(index_path):
+        if not build:
+            logger.warning(f"Skipping {name}: {index_path} not found (build it with --ondisk-ivf or pass --build)")
+            return []
+        logger.info(f"Building {index_path} from {flat_path}")
+        faiss.write_index(ondisk_index.convert_to_ondisk_ivf(flat_path, index_path, nlist), index_path)
+
+    rng = np.random.default_rng(0)
+    flat_index = faiss.read_index(flat_path, faiss.IO_FLAG_MMAP)
+    queries = make_queries(flat_index, num_queries, rng)
+    _, reference = flat_index.search(queries, k)
+    del flat_index
+
+    ivfdata_path = ondisk_index.get_ivfdata_path(index_path)
+    page_cache = PageCache(ivfdata_path)
+    with silence_stdout():
+        nlist = ondisk_index.read_index(index_path).nlist
+
+    rows = []
+    for nprobe in nprobes:
+        for warm_fraction in warm_fractions:
+            page_cache.set_warm_fraction(warm_fraction, rng)
+            latencies, resident, recalls = [], [], []
+            for query, expected in zip(queries, reference):
+                # Reopening unmaps the pages of the previous query, so that they can be evicted
+                page_cache.reset()
+                with silence_stdout():
+                    index = ondisk_index.read_index(index_path, nprobe)
+                resident.append(resident_fraction(ivfdata_path))
+                start = time.perf_counter()
+                _, found = index.search(query.reshape(1, -1), k)
+                latencies.append(time.perf_counter() - start)
+                del index
+                recalls.append(len(set(found[0]) & set(expected)) / k)
+
+            latencies = np.array(latencies) * 1000
+            row = {
+                "source": name,
+                "nlist": nlist,
+                "nprobe": nprobe,
+                "warm_fraction": warm_fraction,
+                "resident_fraction": float(np.mean(resident)) if None not in resident else None,
+                "mean_ms": float(latencies.mean()),
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "p95_ms": float(np.percentile(latencies, 95)),
+                f"recall@{k}": float(np.mean(recalls)),
+            }
+            logger.info(f"{name} nprobe {nprobe}, warm {warm_fraction:.2f}: p50 {row['p50_ms']:.2f} ms")
+            rows.append(row)
+    return rows
+
+def add_cold_warm_ratios(rows: List[Dict[str, Any]]) -> None:
+    """Add each row's mean latency relative to the fully warm cache at the same nprobe."""
+    warm = {(row["source"], row["nprobe"]): row["mean_ms"] for row in rows if row["warm_fraction"] == 1.0}
+    for row in rows:
+        reference = warm.get((row["source"], row["nprobe"]))
+        row["slowdown_vs_warm"] = row["mean_ms"] / reference if reference else None
+
+def print_report(rows: List[Dict[str, Any]], k: int) -> None:
+    """Print the report rows as a tab-separated table."""
+    print(f"Source\tNprobe\tWarm\tResident\tMean (ms)\tP50 (ms)\tP95 (ms)\tvs Warm\tRecall@{k}")
+    for row in rows:
+        resident = f"{row['resident_fraction']:.2f}" if row["resident_fraction"] is not None else "-"
+        slowdown = f"{row['slowdown_vs_warm']:.1f}x" if row["slowdown_vs_warm"] is not None else "-"
+        print(f"{row['source']}\t{row['nprobe']}\t{row['warm_fraction']:.2f}\t{resident}\t{row['mean_ms']:.3f}\t"
+              f"{row['p50_ms']:.3f}\t{row['p95_ms']:.3f}\t{slowdown}\t{row[f'recall@{k}']:.3f}")
+
+def main():
+    """Main function to benchmark on-disk IVF indices."""
+    parser = argparse.ArgumentParser(description="Benchmark on-disk IVF search latency against the page cache state.")
+    parser.add_argument("--data", default=".", help="Directory holding the preprocess outputs")
+    parser.add_argument("--sources", nargs="+", choices=SOURCES, default=SOURCES)
+    parser.add_argument("--nprobe", nargs="+", type=int, default=[ondisk_index.DEFAULT_NPROBE])
+    parser.add_argument("--warm-fractions", nargs="+", type=float, default=[0.0, 0.25, 0.5, 0.75, 1.0],
+                        help="Shares of the inverted lists file in the page cache")
+    parser.add_argument("--num-queries", type=int, default=100, help="Timed searches per nprobe and warm fraction")
+    parser.add_argument("--k", type=int, default=5, help="Number of results per search")
+    parser.add_argument("--build", action="store_true", help="Build missing on-disk indices from the flat ones")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF clusters when building (default: 4 * sqrt(n))")
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "ondisk_benchmark.json"))
+    args = parser.parse_args()
+
+    bundles.activate(bundles.IndexBundle(args.data, "benchmark"))
+    rows = []
+    for name in args.sources:
+        rows.extend(benchmark_source(name, args.nprobe, args.warm_fractions, args.num_queries, args.k,
+                                     args.build, args.nlist))
+    add_cold_warm_ratios(rows)
+    print_report(rows, args.k)
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump({"data": args.data, "k": args.k, "block_size": BLOCK_SIZE, "rows": rows}, f, indent=2)
+    logger.info(f"Report saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
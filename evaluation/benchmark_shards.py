@@ -0,0 +1,144 @@
+"""
+Search latency against the number of shards.
+
+For each shard count, starts a ShardPool (see retreivers/sharding.py), loads
+the shards and times single searches of BGE structure 1, CLIP and BM25
+structure 1 (without stopwords). The row with shards "in-process" is the
+unsharded search of the full index in this process, as served without
+RETRIEVER_SHARDS. Query encoding is not sharded, so it is left out: the dense
+queries are random unit vectors and the BM25 queries are random words of the
+corpus vocabulary.
+
+Point --data at a directory holding the preprocess outputs (an index bundle or
+a corpus from preprocess/dataset/generate_synthetic.py) to benchmark corpora
+larger than the repository's.
+
+Usage:
+    python evaluation/benchmark_shards.py --data synthetic/1m --shards 1 2 4 8
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.abspath("."))
+
+from retreivers import bge_retreiver, bm25_retreiver, bundles, clip_retreiver, sharding
+from evaluation.run_evaluation import RESULTS_DIR
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants
+SOURCES = ["bge", "clip", "bm25"]
+STRUCTURE = 1
+BM25_VARIANT = "without_stopwords"
+QUERY_WORDS = 6
+
+def get_source(name: str) -> sharding.Source:
+    """Get the shard source of a benchmarked retriever, in the current bundle."""
+    if name == "bge":
+        return bge_retreiver.get_shard_source(STRUCTURE)
+    if name == "clip":
+        return clip_retreiver.get_shard_source()
+    return ("bm25", STRUCTURE, BM25_VARIANT)
+
+def make_queries(name: str, num_queries: int, rng: np.random.Generator) -> List[Any]:
+    """Draw random queries for a retriever: unit vectors for FAISS, vocabulary words for BM25."""
+    if name == "bm25":
+        vocabulary = list(bm25_retreiver.load_retriever(STRUCTURE, BM25_VARIANT).idf)
+        return [list(rng.choice(vocabulary, QUERY_WORDS)) for _ in range(num_queries)]
+    index = faiss.read_index(get_source(name)[1])
+    vectors = rng.standard_normal((num_queries, index.d)).astype(np.float32)
+    return list(vectors / np.linalg.norm(vectors, axis=1, keepdims=True))
+
+def in_process_search(name: str) -> Callable[[Any, int], Any]:
+    """Get the unsharded search of a retriever over its full index."""
+    if name == "bm25":
+        model = bm25_retreiver.load_retriever(STRUCTURE, BM25_VARIANT)
+        return lambda query, k: model.get_scores(query).argsort()[-k:][::-1]
+    index = faiss.read_index(get_source(name)[1])
+    return lambda query, k: index.search(query.reshape(1, -1), k)
+
+def time_searches(search: Callable[[Any, int], Any], queries: List[Any], k: int) -> Dict[str, float]:
+    """Time one search per query and summarise the latencies."""
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        search(query, k)
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+    return {
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+    }
+
+def benchmark(names: List[str], shard_counts: List[int], num_queries: int, k: int) -> List[Dict[str, Any]]:
+    """
+    Benchmark each retriever unsharded and with each shard count.
+
+    Returns:
+        List[Dict[str, Any]]: One report row per retriever and shard count
+    """
+    rng = np.random.default_rng(0)
+    queries = {name: make_queries(name, num_queries, rng) for name in names}
+
+    rows = []
+    for name in names:
+        row = {"source": name, "shards": "in-process", "load_s": None}
+        row.update(time_searches(in_process_search(name), queries[name], k))
+        rows.append(row)
+
+    for num_shards in shard_counts:
+        pool = sharding.ShardPool(num_shards)
+        try:
+            for name in names:
+                source = get_source(name)
+                start = time.perf_counter()
+                pool.search(source, queries[name][0], k)
+                row = {"source": name, "shards": num_shards, "load_s": time.perf_counter() - start}
+                row.update(time_searches(lambda query, k: pool.search(source, query, k), queries[name], k))
+                logger.info(f"{name} on {num_shards} shards: p50 {row['p50_ms']:.2f} ms")
+                rows.append(row)
+        finally:
+            pool.close()
+    return rows
+
+def print_report(rows: List[Dict[str, Any]]) -> None:
+    """Print the report rows as a tab-separated table."""
+    print("Source\tShards\tLoad (s)\tMean (ms)\tP50 (ms)\tP95 (ms)")
+    for row in sorted(rows, key=lambda row: row["source"]):
+        load = f"{row['load_s']:.2f}" if row["load_s"] is not None else "-"
+        print(f"{row['source']}\t{row['shards']}\t{load}\t{row['mean_ms']:.3f}\t{row['p50_ms']:.3f}\t{row['p95_ms']:.3f}")
+
+def main():
+    """Main function to benchmark sharded search."""
+    parser = argparse.ArgumentParser(description="Benchmark search latency against the number of shards.")
+    parser.add_argument("--data", default=".", help="Directory holding the preprocess outputs")
+    parser.add_argument("--sources", nargs="+", choices=SOURCES, default=SOURCES)
+    parser.add_argument("--shards", nargs="+", type=int, default=[1, 2, 4, 8], help="Shard counts")
+    parser.add_argument("--num-queries", type=int, default=200, help="Timed searches per source and shard count")
+    parser.add_argument("--k", type=int, default=5, help="Number of results per search")
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "shard_benchmark.json"))
+    args = parser.parse_args()
+
+    bundles.activate(bundles.IndexBundle(args.data, "benchmark"))
+    rows = benchmark(args.sources, args.shards, args.num_queries, args.k)
+    print_report(rows)
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump({"data": args.data, "cpu_count": os.cpu_count(), "k": args.k, "rows": rows}, f, indent=2)
+    logger.info(f"Report saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Thread-budget sweep for the /get-images fan-out.
+
+For each combination of torch, FAISS and BLAS thread counts, the evaluation
+questions are sent through the same concurrent fan-out as /get-images (every
+retriever in its own thread, several requests in flight) and the request
+latency and throughput are reported. The best budget can then be set with
+TORCH_NUM_THREADS, FAISS_NUM_THREADS and BLAS_NUM_THREADS (see
+retreivers/resources.py).
+
+Usage:
+    python evaluation/benchmark_threads.py --torch-threads 1 2 4 --faiss-threads 1 4 --concurrency 8
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath("."))
+
+from retreivers import registry
+from retreivers.resources import set_thread_budget
+from evaluation.run_evaluation import RESULTS_DIR, load_questions
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# The /get-images fan-out: retriever name -> (function, extra arguments after the query)
+RETRIEVERS: Dict[str, Tuple[Callable, Tuple]] = registry.get_retrievers(list(registry.RETRIEVERS))
+
+async def fan_out(query: str, methods: List[str], k: int) -> float:
+    """Run one /get-images style request and return its latency in seconds."""
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        asyncio.to_thread(RETRIEVERS[method][0], query, *RETRIEVERS[method][1], k) for method in methods
+    ])
+    return time.perf_counter() - start
+
+async def run_load(questions: List[str], methods: List[str], k: int, concurrency: int) -> Dict[str, float]:
+    """
+    Send every question through the fan-out with a fixed number of requests in flight.
+
+    Returns:
+        Dict[str, float]: Latency percentiles (ms) and throughput (requests per second)
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def request(query: str) -> float:
+        async with semaphore:
+            return await fan_out(query, methods, k)
+
+    start = time.perf_counter()
+    latencies = np.array(await asyncio.gather(*[request(query) for query in questions])) * 1000
+    elapsed = time.perf_counter() - start
+    return {
+        "latency_p50_ms": float(np.percentile(latencies, 50)),
+        "latency_p95_ms": float(np.percentile(latencies, 95)),
+        "latency_p99_ms": float(np.percentile(latencies, 99)),
+        "throughput_rps": len(questions) / elapsed,
+    }
+
+def sweep(
+    questions: List[str],
+    methods: List[str],
+    budgets: List[Tuple[int, int, int]],
+    k: int,
+    concurrency: int
+) -> List[Dict[str, Any]]:
+    """
+    Benchmark the fan-out under each thread budget.
+
+    Args:
+        questions (List[str]): Queries sent per budget
+        methods (List[str]): Retrievers in the fan-out
+        budgets (List[Tuple[int, int, int]]): (torch, faiss, blas) thread counts
+        k (int): Number of results per retriever
+        concurrency (int): Requests in flight
+
+    Returns:
+        List[Dict[str, Any]]: One report row per budget
+    """
+    # Warm up: load every model, index and pickle before timing anything
+    asyncio.run(fan_out(questions[0], methods, k))
+
+    rows = []
+    for torch_threads, faiss_threads, blas_threads in budgets:
+        set_thread_budget(torch_threads, faiss_threads, blas_threads)
+        row = {"torch_threads": torch_threads, "faiss_threads": faiss_threads, "blas_threads": blas_threads}
+        row.update(asyncio.run(run_load(questions, methods, k, concurrency)))
+        logger.info(f"Budget {torch_threads}/{faiss_threads}/{blas_threads}: p95 {row['latency_p95_ms']:.1f} ms")
+        rows.append(row)
+    return rows
+
+def print_report(rows: List[Dict[str, Any]]) -> None:
+    """Print the sweep rows as a tab-separated table, best p95 first."""
+    print("Torch\tFAISS\tBLAS\tP50 (ms)\tP95 (ms)\tP99 (ms)\tThroughput (req/s)")
+    for row in sorted(rows, key=lambda row: row["latency_p95_ms"]):
+        print(
+            f"{row['torch_threads']}\t{row['faiss_threads']}\t{row['blas_threads']}\t"
+            f"{row['latency_p50_ms']:.1f}\t{row['latency_p95_ms']:.1f}\t{row['latency_p99_ms']:.1f}\t"
+            f"{row['throughput_rps']:.2f}"
+        )
+
+def main():
+    """Main function to sweep the thread budgets."""
+    cores = os.cpu_count() or 1
+    default_threads = sorted({1, 2, max(1, cores // 2), cores})
+
+    parser = argparse.ArgumentParser(description="Sweep CPU thread budgets for the /get-images fan-out.")
+    parser.add_argument("--methods", nargs="+", choices=list(RETRIEVERS), default=list(RETRIEVERS))
+    parser.add_argument("--torch-threads", nargs="+", type=int, default=default_threads)
+    parser.add_argument("--faiss-threads", nargs="+", type=int, default=default_threads)
+    parser.add_argument("--blas-threads", nargs="+", type=int, default=[1],
+                        help="BLAS thread counts (numpy and scikit-learn)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight")
+    parser.add_argument("--num-queries", type=int, default=50, help="Evaluation questions sent per budget")
+    parser.add_argument("--k", type=int, default=1, help="Number of results per retriever")
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "thread_budget_report.json"))
+    args = parser.parse_args()
+
+    questions, _ = load_questions()
+    questions = questions[:args.num_queries]
+    budgets = list(itertools.product(args.torch_threads, args.faiss_threads, args.blas_threads))
+    logger.info(f"Sweeping {len(budgets)} budgets on {cores} cores with {len(questions)} queries each")
+
+    rows = sweep(questions, args.methods, budgets, args.k, args.concurrency)
+    print_report(rows)
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump({"cpu_count": cores, "concurrency": args.concurrency, "rows": rows}, f, indent=2)
+    logger.info(f"Report saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
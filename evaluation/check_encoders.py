@@ -0,0 +1,125 @@
+"""
+Equivalence check and latency benchmark for the query encoder backends.
+
+Encodes every evaluation question with the torch backend and each requested
+alternative backend, one query at a time, and reports:
+    - cosine agreement with the torch embeddings (mean and minimum)
+    - top-k overlap with the torch results on the float32 index
+    - per-query encode latency
+
+Usage:
+    python evaluation/check_encoders.py --backends torch onnx onnx_int8
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.abspath("."))
+
+from retreivers import bge_retreiver, clip_retreiver
+from retreivers.encoders import BACKENDS, load_bge_encoder, load_clip_text_encoder
+from evaluation.run_evaluation import RESULTS_DIR, load_questions
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def encode_timed(encoder: Any, questions: List[str]) -> Dict[str, Any]:
+    """Encode questions one at a time, returning the embeddings and per-query latencies."""
+    encoder.encode(questions[0], normalize_embeddings=True)  # warm up
+    embeddings, latencies = [], []
+    for question in questions:
+        start = time.perf_counter()
+        embeddings.append(encoder.encode(question, normalize_embeddings=True))
+        latencies.append(time.perf_counter() - start)
+    return {"embeddings": np.stack(embeddings).astype('float32'), "latencies_ms": np.array(latencies) * 1000}
+
+def compare_backends(
+    name: str,
+    encoders: Dict[str, Any],
+    questions: List[str],
+    index: faiss.Index,
+    k: int
+) -> List[Dict[str, Any]]:
+    """
+    Compare each backend of one model against its torch backend.
+
+    Args:
+        name (str): Report label such as "BGE" or "CLIP"
+        encoders (Dict[str, Any]): Encoder per backend, including "torch"
+        questions (List[str]): Evaluation questions
+        index (faiss.Index): Float32 index used for the top-k overlap
+        k (int): Number of results compared per query
+
+    Returns:
+        List[Dict[str, Any]]: One report row per backend
+    """
+    runs = {backend: encode_timed(encoder, questions) for backend, encoder in encoders.items()}
+    reference = runs["torch"]["embeddings"]
+    _, reference_ids = index.search(reference, k)
+
+    rows = []
+    for backend, run in runs.items():
+        cosines = (run["embeddings"] * reference).sum(axis=1)
+        _, ids = index.search(run["embeddings"], k)
+        overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(ids.tolist(), reference_ids.tolist())])
+        rows.append({
+            "encoder": name,
+            "backend": backend,
+            "cosine_mean": float(cosines.mean()),
+            "cosine_min": float(cosines.min()),
+            f"top_{k}_overlap": 100.0 * float(overlap),
+            "latency_mean_ms": float(run["latencies_ms"].mean()),
+            "latency_p95_ms": float(np.percentile(run["latencies_ms"], 95)),
+        })
+    return rows
+
+def print_report(rows: List[Dict[str, Any]], k: int) -> None:
+    """Print the comparison rows as a tab-separated table."""
+    print(f"Encoder\tBackend\tCosine Mean\tCosine Min\tTop-{k} Overlap (%)\tMean (ms)\tP95 (ms)")
+    for row in rows:
+        print(
+            f"{row['encoder']}\t{row['backend']}\t{row['cosine_mean']:.5f}\t{row['cosine_min']:.5f}\t"
+            f"{row[f'top_{k}_overlap']:.2f}\t{row['latency_mean_ms']:.2f}\t{row['latency_p95_ms']:.2f}"
+        )
+
+def main():
+    """Main function to compare the encoder backends."""
+    parser = argparse.ArgumentParser(description="Check and benchmark the query encoder backends.")
+    parser.add_argument("--models", nargs="+", choices=["bge", "clip"], default=["bge", "clip"])
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--structure", type=int, default=5, help="BGE structure used for the top-k overlap")
+    parser.add_argument("--k", type=int, default=5, help="Number of results compared per query")
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "encoder_backends_report.json"))
+    args = parser.parse_args()
+
+    backends = ["torch"] + [backend for backend in args.backends if backend != "torch"]
+    questions, _ = load_questions()
+
+    rows = []
+    if "bge" in args.models:
+        encoders = {backend: load_bge_encoder(bge_retreiver.MODEL_NAME, backend) for backend in backends}
+        index = faiss.read_index(bge_retreiver.get_index_path(args.structure, ""))
+        rows.extend(compare_backends("BGE", encoders, questions, index, args.k))
+    if "clip" in args.models:
+        encoders = {backend: load_clip_text_encoder(clip_retreiver.MODEL_NAME, backend) for backend in backends}
+        index = faiss.read_index(clip_retreiver.get_index_path(""))
+        rows.extend(compare_backends("CLIP", encoders, questions, index, args.k))
+
+    print_report(rows, args.k)
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(rows, f, indent=2)
+    logger.info(f"Report saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Load generator for a running backend.
+
+Replays the evaluation questions (or a captured query log) against
+/get-images, either closed-loop at a fixed concurrency or open-loop at a
+Poisson arrival rate, and reports throughput, latency percentiles, error
+rate and the server's CPU and resident memory over time (sampled from its
+/metrics endpoint). Every run is saved as JSON so that releases can be
+compared with --compare. Reports are named <label>_<timestamp>.json unless
+--output is given.
+
+Usage:
+    python evaluation/load_test.py --concurrency 8 --duration 60 --output evaluation_results/load_tests/baseline.json
+    python evaluation/load_test.py --rate 20 --duration 60 --compare evaluation_results/load_tests/baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+import numpy as np
+
+sys.path.insert(0, os.path.abspath("."))
+
+from evaluation.run_evaluation import RESULTS_DIR, load_questions
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants
+LOAD_TEST_DIR = os.path.join(RESULTS_DIR, "load_tests")
+SAMPLE_INTERVAL = 5.0
+
+def load_query_log(file_path: str) -> List[str]:
+    """Load queries from a log with one query per line, or JSON lines with a "query" field."""
+    queries = []
+    with open(file_path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                queries.append(json.loads(line)["query"])
+            else:
+                queries.append(line)
+    return queries
+
+def percentiles(latencies: List[float]) -> Dict[str, Optional[float]]:
+    """Get the p50, p95 and p99 of latencies in milliseconds."""
+    if not latencies:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+    return {"p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+
+async def scrape_process_metrics(client: httpx.AsyncClient) -> Dict[str, float]:
+    """Read the server's CPU seconds and resident memory from its Prometheus metrics."""
+    response = await client.get("/metrics")
+    values = {}
+    for line in response.text.splitlines():
+        if line.startswith(("process_cpu_seconds_total ", "process_resident_memory_bytes ")):
+            name, value = line.split()
+            values[name] = float(value)
+    return values
+
+class LoadTest:
+    """Sends queries to /get-images and records every request's outcome."""
+
+    def __init__(self, client: httpx.AsyncClient, queries: List[str], k: int, seed: int = 0):
+        self.client = client
+        self.queries = queries
+        self.k = k
+        self.random = random.Random(seed)
+        # (latency seconds, succeeded) per request
+        self.records: List[tuple] = []
+        self.samples: List[Dict[str, Any]] = []
+
+    async def request(self) -> None:
+        """Send one random query and record its latency and outcome."""
+        query = self.random.choice(self.queries)
+        start = time.perf_counter()
+        try:
+            response = await self.client.get("/get-images", params={"query": query, "k": self.k})
+            succeeded = response.status_code == 200
+        except httpx.HTTPError:
+            succeeded = False
+        self.records.append((time.perf_counter() - start, succeeded))
+
+    async def run_closed_loop(self, concurrency: int, deadline: float) -> None:
+        """Keep a fixed number of requests in flight until the deadline."""
+        async def user():
+            while time.perf_counter() < deadline:
+                await self.request()
+        await asyncio.gather(*[user() for _ in range(concurrency)])
+
+    async def run_open_loop(self, rate: float, deadline: float) -> None:
+        """Start requests with exponential inter-arrival times until the deadline."""
+        tasks = []
+        next_arrival = time.perf_counter()
+        while next_arrival < deadline:
+            await asyncio.sleep(max(0.0, next_arrival - time.perf_counter()))
+            tasks.append(asyncio.create_task(self.request()))
+            next_arrival += self.random.expovariate(rate)
+        await asyncio.gather(*tasks)
+
+    async def sample_server(self, start: float, stop: asyncio.Event, interval: float) -> None:
+        """Sample the server's CPU and memory, and the client-side throughput, every interval."""
+        previous_time, previous_cpu, previous_count = start, None, 0
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            now = time.perf_counter()
+            try:
+                process = await scrape_process_metrics(self.client)
+            except httpx.HTTPError:
+                process = {}
+            cpu = process.get("process_cpu_seconds_total")
+            window = self.records[previous_count:]
+            sample = {
+                "elapsed_s": now - start,
+                "throughput_rps": len(window) / (now - previous_time),
+                "errors": sum(not succeeded for _, succeeded in window),
+                "cpu_percent": None if cpu is None or previous_cpu is None
+                else 100 * (cpu - previous_cpu) / (now - previous_time),
+                "rss_bytes": process.get("process_resident_memory_bytes"),
+            }
+            sample.update(percentiles([latency for latency, succeeded in window if succeeded]))
+            self.samples.append(sample)
+            logger.info(
+                f"{sample['elapsed_s']:.0f}s: {sample['throughput_rps']:.1f} req/s, p95 {sample['p95_ms'] or 0:.0f} ms"
+            )
+            previous_time, previous_cpu, previous_count = now, cpu, len(self.records)
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        """Summarise the whole run."""
+        latencies = [latency for latency, succeeded in self.records if succeeded]
+        errors = sum(not succeeded for _, succeeded in self.records)
+        rss = [sample["rss_bytes"] for sample in self.samples if sample["rss_bytes"] is not None]
+        cpu = [sample["cpu_percent"] for sample in self.samples if sample["cpu_percent"] is not None]
+        summary = {
+            "requests": len(self.records),
+            "throughput_rps": len(self.records) / elapsed,
+            "error_rate": errors / len(self.records) if self.records else 0.0,
+            "cpu_percent_mean": float(np.mean(cpu)) if cpu else None,
+            "rss_bytes_max": max(rss) if rss else None,
+        }
+        summary.update(percentiles(latencies))
+        return summary
+
+def print_comparison(current: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    """Print the summary next to a baseline run's summary."""
+    print("Metric\tBaseline\tCurrent\tChange (%)")
+    for metric, value in current.items():
+        previous = baseline.get(metric)
+        if value is None or previous is None:
+            continue
+        change = 100 * (value - previous) / previous if previous else float("nan")
+        print(f"{metric}\t{previous:.2f}\t{value:.2f}\t{change:+.1f}")
+
+async def run(args: argparse.Namespace, queries: List[str]) -> Dict[str, Any]:
+    """Run the load test and return the saved report."""
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        load_test = LoadTest(client, queries, args.k, args.seed)
+
+        # Warm up connections and any lazily loaded retriever before measuring
+        for _ in range(args.warmup):
+            await load_test.request()
+        load_test.records.clear()
+
+        start = time.perf_counter()
+        deadline = start + args.duration
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(load_test.sample_server(start, stop, args.sample_interval))
+        if args.rate:
+            await load_test.run_open_loop(args.rate, deadline)
+        else:
+            await load_test.run_closed_loop(args.concurrency, deadline)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await sampler
+
+    return {
+        "label": args.label,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "url": args.url,
+            "mode": "open_loop" if args.rate else "closed_loop",
+            "rate": args.rate,
+            "concurrency": None if args.rate else args.concurrency,
+            "duration_s": args.duration,
+            "k": args.k,
+            "num_queries": len(queries),
+        },
+        "summary": load_test.summary(elapsed),
+        "timeseries": load_test.samples,
+    }
+
+def parse_args() -> argparse.Namespace:
+    """Parse the load test options."""
+    parser = argparse.ArgumentParser(description="Replay query traffic against a running backend.")
+    parser.add_argument("--url", default="http://localhost:8000", help="Backend base URL")
+    parser.add_argument("--query-log", help="Query log to replay instead of the evaluation questions")
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight (closed loop)")
+    parser.add_argument("--rate", type=float, help="Arrival rate in requests per second (open loop)")
+    parser.add_argument("--duration", type=float, default=60, help="Measured duration in seconds")
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured requests sent first")
+    parser.add_argument("--k", type=int, default=1, help="Number of results per method")
+    parser.add_argument("--timeout", type=float, default=60, help="Request timeout in seconds")
+    parser.add_argument("--sample-interval", type=float, default=SAMPLE_INTERVAL)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", default="run", help="Name of the saved report")
+    parser.add_argument("--output", help="Report path (default: <label>_<timestamp>.json in evaluation_results/load_tests)")
+    parser.add_argument("--compare", help="Saved report to compare against")
+    return parser.parse_args()
+
+def main():
+    """Main function to run a load test."""
+    args = parse_args()
+    queries = load_query_log(args.query_log) if args.query_log else load_questions()[0]
+
+    report = asyncio.run(run(args, queries))
+    print(json.dumps(report["summary"], indent=2))
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            print_comparison(report["summary"], json.load(f)["summary"])
+
+    output_path = args.output or os.path.join(LOAD_TEST_DIR, f"{args.label}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Report saved to {output_path}")
+
+if __name__ == "__main__":
+    main()
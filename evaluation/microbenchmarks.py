@@ -0,0 +1,288 @@
+"""
+Microbenchmarks for the retriever hot paths on synthetic corpora.
+
+Each benchmark times one retriever function in isolation, at every requested
+corpus size so that scaling curves are visible:
+    bge_search            BGE FAISS search of one structure (bge_retreiver._search_index)
+    bge_retrieve          BGE search plus metadata assembly with a fixed query embedding
+    clip_search           CLIP-sized flat FAISS search
+    bm25_with_stopwords   BM25 scoring and top-k (bm25_retreiver.get_multiple_images_metadata)
+    bm25_without_stopwords
+    tfidf                 TF-IDF scoring and top-k (tfidf_retreiver.get_multiple_images_metadata)
+    metadata_assembly     Row ids to metadata dicts
+    json_serialization    Rendering a full /get-images response
+    bge_encode, clip_encode
+                          Query encoding with the real models (--encoders, independent of size)
+
+The synthetic corpora are those of preprocess/dataset/generate_synthetic.py,
+generated in memory and injected into the retrievers' caches, so the measured
+code is the retrievers' own. Results are saved as JSON;
+--baseline compares against a saved run and exits non-zero on regressions.
+
+Usage:
+    python evaluation/microbenchmarks.py --sizes 1000 100000 1000000 --output baseline.json
+    python evaluation/microbenchmarks.py --sizes 1000 100000 --baseline baseline.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+import faiss
+import numpy as np
+from fastapi.responses import JSONResponse
+from langchain_community.retrievers import TFIDFRetriever
+from rank_bm25 import BM25Okapi
+
+sys.path.insert(0, os.path.abspath("."))
+
+from preprocess.dataset import generate_synthetic
+from retreivers import bge_retreiver, bm25_retreiver, bundles, clip_retreiver, tfidf_retreiver
+from evaluation.run_evaluation import RESULTS_DIR, load_questions
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants
+NUM_QUERIES = 64
+STOPWORDS = {"the", "of", "a", "an", "in", "and", "is", "are", "to", "with", "on", "for", "by", "as", "that", "this"}
+NUM_METHODS = 7
+NUM_STRUCTURES = 5
+BENCHMARKS = ["bge_search", "bge_retrieve", "clip_search", "bm25_with_stopwords", "bm25_without_stopwords",
+              "tfidf", "metadata_assembly", "json_serialization"]
+# The synthetic structure number the corpora are injected under
+STRUCTURE = 1
+
+class FixedEncoder:
+    """Encoder returning precomputed embeddings, to time retrieval without the model."""
+
+    def __init__(self, embeddings: np.ndarray):
+        self.embeddings = embeddings
+        self.calls = 0
+
+    def encode(self, texts, normalize_embeddings: bool = True, **kwargs) -> np.ndarray:
+        self.calls += 1
+        return self.embeddings[self.calls % len(self.embeddings)]
+
+class SyntheticCorpus:
+    """
+    A corpus from preprocess/dataset/generate_synthetic.py, generated in memory.
+
+    Items, texts and topic-clustered vectors come from the same fitted models as
+    the generated corpus files. NUM_QUERIES more items are held out as queries:
+    their captions are the text queries and their vectors the query embeddings.
+    """
+
+    def __init__(self, size: int, seed: int = 0):
+        self.size = size
+        rng = np.random.default_rng(seed)
+        with open(generate_synthetic.SOURCE_PATH, "r") as f:
+            source = json.load(f)
+        text_model, topic_model = generate_synthetic.fit_models(source, rng)
+
+        items, vectors = [], {"clip": [], STRUCTURE: []}
+        for chunk, chunk_vectors in generate_synthetic.generate_chunks(
+            size + NUM_QUERIES, text_model, topic_model, rng, [STRUCTURE]
+        ):
+            items.extend(chunk)
+            for name in vectors:
+                vectors[name].append(chunk_vectors[name])
+        bge_vectors, clip_vectors = np.concatenate(vectors[STRUCTURE]), np.concatenate(vectors["clip"])
+        items, query_items = items[:size], items[size:]
+
+        self.bge_vectors, self.bge_queries = bge_vectors[:size], bge_vectors[size:]
+        self.clip_vectors, self.clip_queries = clip_vectors[:size], clip_vectors[size:]
+        self.metadata = [{field: item[field] for field in generate_synthetic.BGE_METADATA_FIELDS} for item in items]
+
+        # BM25 and TF-IDF documents hold the text of the BGE structure, with or without stopwords
+        fields = generate_synthetic.STRUCTURE_FIELDS[STRUCTURE]
+        self.documents_with_stopwords = [
+            generate_synthetic.tokenize(" ".join(item[field] for field in fields)) for item in items
+        ]
+        self.documents = [remove_stopwords(document) for document in self.documents_with_stopwords]
+        self.queries_with_stopwords = [item["caption"].lower() for item in query_items]
+        self.queries = [" ".join(remove_stopwords(query.split())) for query in self.queries_with_stopwords]
+
+def remove_stopwords(words: List[str]) -> List[str]:
+    """Drop the common English stopwords from a list of words."""
+    return [word for word in words if word not in STOPWORDS]
+
+def measure(function: Callable[[int], Any], repeat: int, warmup: int = 3) -> Dict[str, float]:
+    """
+    Time a function called with the iteration number.
+
+    Returns:
+        Dict[str, float]: Mean, p50, p95 and minimum latency in milliseconds
+    """
+    for i in range(warmup):
+        function(i)
+    latencies = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function(i)
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+    return {
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "min_ms": float(latencies.min()),
+    }
+
+def build_benchmarks(corpus: SyntheticCorpus, k: int) -> Dict[str, Callable[[int], Any]]:
+    """Inject a corpus into the retrievers and return the benchmark functions for it."""
+    # A fresh in-memory bundle, so that no retriever loads the repository's indices
+    bundle = bundles.IndexBundle(".", "microbenchmark")
+    bundles.activate(bundle)
+
+    index = faiss.IndexFlatL2(generate_synthetic.BGE_DIMENSION)
+    index.add(corpus.bge_vectors)
+    bundle.cache("bge_indices")[STRUCTURE] = index
+    bundle.cache("bge_metadata")[STRUCTURE] = corpus.metadata
+    bge_retreiver._model = FixedEncoder(corpus.bge_queries)
+
+    clip_index = faiss.IndexFlatL2(generate_synthetic.CLIP_DIMENSION)
+    clip_index.add(corpus.clip_vectors)
+
+    for variant, documents in [("with_stopwords", corpus.documents_with_stopwords),
+                               ("without_stopwords", corpus.documents)]:
+        bm25 = BM25Okapi(documents, k1=1.5, b=0.75)
+        bm25.metadata = corpus.metadata
+        bundle.cache("bm25_retrievers")[(STRUCTURE, variant)] = bm25
+
+    bundle.cache("tfidf_retrievers")[STRUCTURE] = TFIDFRetriever.from_texts(
+        [" ".join(document) for document in corpus.documents], metadatas=corpus.metadata, k=k
+    )
+
+    queries = corpus.queries
+    row_ids = np.random.default_rng(1).integers(0, corpus.size, size=(NUM_QUERIES, k))
+    response = {
+        "query": queries[0],
+        "results": {
+            f"method_{method}": {structure: corpus.metadata[:k] for structure in range(1, NUM_STRUCTURES + 1)}
+            for method in range(NUM_METHODS)
+        }
+    }
+
+    return {
+        "bge_search": lambda i: bge_retreiver._search_index(STRUCTURE, corpus.bge_queries[i % NUM_QUERIES], k),
+        "bge_retrieve": lambda i: bge_retreiver.get_top_image_metadata(queries[i % NUM_QUERIES], STRUCTURE, k),
+        "clip_search": lambda i: clip_index.search(corpus.clip_queries[i % NUM_QUERIES].reshape(1, -1), k),
+        "bm25_with_stopwords": lambda i: bm25_retreiver.get_multiple_images_metadata(
+            corpus.queries_with_stopwords[i % NUM_QUERIES], STRUCTURE, "with_stopwords", k
+        ),
+        "bm25_without_stopwords": lambda i: bm25_retreiver.get_multiple_images_metadata(
+            queries[i % NUM_QUERIES], STRUCTURE, "without_stopwords", k
+        ),
+        "tfidf": lambda i: tfidf_retreiver.get_multiple_images_metadata(queries[i % NUM_QUERIES], STRUCTURE, k),
+        "metadata_assembly": lambda i: [corpus.metadata[idx] for idx in row_ids[i % NUM_QUERIES] if idx < corpus.size],
+        "json_serialization": lambda i: JSONResponse(content=response).body,
+    }
+
+def run_encoder_benchmarks(repeat: int) -> List[Dict[str, Any]]:
+    """Time single-query encoding with the real BGE and CLIP models."""
+    questions, _ = load_questions()
+    rows = []
+    for name, encode in [("bge_encode", bge_retreiver.get_query_embedding),
+                         ("clip_encode", clip_retreiver.get_query_embedding)]:
+        try:
+            row = {"benchmark": name, "size": None}
+            row.update(measure(lambda i: encode(questions[i % len(questions)]), repeat))
+            rows.append(row)
+        except Exception as e:
+            logger.warning(f"Skipping {name}: {str(e)}")
+    return rows
+
+def compare(rows: List[Dict[str, Any]], baseline: List[Dict[str, Any]], threshold: float) -> List[Dict[str, Any]]:
+    """
+    Compare p50 latencies with a baseline run.
+
+    Args:
+        rows (List[Dict[str, Any]]): Current results
+        baseline (List[Dict[str, Any]]): Saved results
+        threshold (float): Relative slowdown flagged as a regression, e.g. 0.1 for 10%
+
+    Returns:
+        List[Dict[str, Any]]: The rows that regressed
+    """
+    previous = {(row["benchmark"], row["size"]): row for row in baseline}
+    regressions = []
+    print("Benchmark\tSize\tBaseline p50 (ms)\tCurrent p50 (ms)\tChange (%)\tStatus")
+    for row in rows:
+        old = previous.get((row["benchmark"], row["size"]))
+        if old is None:
+            continue
+        change = (row["p50_ms"] - old["p50_ms"]) / old["p50_ms"]
+        status = "ok"
+        if change > threshold:
+            status = "REGRESSION"
+            regressions.append(row)
+        elif change < -threshold:
+            status = "improved"
+        print(f"{row['benchmark']}\t{row['size']}\t{old['p50_ms']:.3f}\t{row['p50_ms']:.3f}\t{100 * change:+.1f}\t{status}")
+    return regressions
+
+def print_report(rows: List[Dict[str, Any]]) -> None:
+    """Print the results as a tab-separated table."""
+    print("Benchmark\tSize\tMean (ms)\tP50 (ms)\tP95 (ms)\tMin (ms)")
+    for row in rows:
+        print(
+            f"{row['benchmark']}\t{row['size'] or '-'}\t{row['mean_ms']:.3f}\t{row['p50_ms']:.3f}\t"
+            f"{row['p95_ms']:.3f}\t{row['min_ms']:.3f}"
+        )
+
+def parse_args() -> argparse.Namespace:
+    """Parse the benchmark options."""
+    parser = argparse.ArgumentParser(description="Microbenchmark the retriever hot paths on synthetic corpora.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 100000], help="Synthetic corpus sizes")
+    parser.add_argument("--benchmarks", nargs="+", choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument("--encoders", action="store_true", help="Also time the real BGE and CLIP encoders")
+    parser.add_argument("--repeat", type=int, default=50, help="Timed iterations per benchmark")
+    parser.add_argument("--k", type=int, default=5, help="Number of results per query")
+    parser.add_argument("--baseline", help="Saved results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative p50 slowdown flagged as a regression")
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "microbenchmarks.json"))
+    return parser.parse_args()
+
+def main() -> int:
+    """Main function to run the microbenchmarks."""
+    args = parse_args()
+
+    rows = []
+    if args.encoders:
+        rows.extend(run_encoder_benchmarks(args.repeat))
+    for size in args.sizes:
+        logger.info(f"Building a synthetic corpus of {size} documents")
+        benchmarks = build_benchmarks(SyntheticCorpus(size), args.k)
+        for name in args.benchmarks:
+            row = {"benchmark": name, "size": size}
+            try:
+                row.update(measure(benchmarks[name], args.repeat))
+            except Exception as e:
+                logger.warning(f"Skipping {name} at {size}: {str(e)}")
+                continue
+            logger.info(f"{name} at {size}: p50 {row['p50_ms']:.3f} ms")
+            rows.append(row)
+
+    print_report(rows)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(rows, f, indent=2)
+    logger.info(f"Results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            regressions = compare(rows, json.load(f), args.threshold)
+        if regressions:
+            logger.error(f"{len(regressions)} benchmark(s) regressed by more than {100 * args.threshold:.0f}%")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,306 @@
+"""
+Evaluation runner for the dense retriever index variants.
+
+Every question in the evaluation questionnaire is encoded once, then each index
+variant is searched one query at a time. For each variant the runner reports
+index memory, search latency, topic accuracy of the top result and recall of
+the top k against the float32 index.
+
+Usage:
+    python evaluation/run_evaluation.py --methods bge clip --variants fp16 int8 pq_rerank
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.abspath("."))
+
+from retreivers import bge_retreiver, clip_retreiver, ondisk_index
+from retreivers.binary_index import BINARY_CANDIDATES, search_binary_rerank
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants
+QUESTIONNAIRE_PATH = "evaluation_dataset/evaluation_questionnaire.json"
+DATASET_PATH = "preprocess/dataset/image_metadata.json"
+RESULTS_DIR = "evaluation_results"
+DEFAULT_VARIANTS = ["float32", "fp16", "int8", "pq", "fp16_rerank", "int8_rerank", "pq_rerank", "binary",
+                    "pca64", "pca128", "pca256", "ivf_ondisk"]
+
+# Questionnaire keys mapped to the dataset topics
+QUESTION_TOPICS = {
+    "astronomy": "Astronomy",
+    "current_electricity": "Current Electricity",
+    "electromagnetism": "Electromagnetic Induction & Alternating Current",
+    "geometric_optics": "Geometrical Optics",
+    "gravity": "Gravity",
+    "harmonic_motion": "Harmonic Motion",
+    "ideal_gas": "Ideal Gas and Gas Kinetics",
+    "kinematics": "Kinematics",
+    "magnetism": "Magnetism",
+    "modern_physics": "Introduction to Modern Physics",
+    "newtonian_force": "Newtonian Force",
+    "nuclear_physics": "Atom's Model & Nuclear Physics",
+    "physical_optics": "Physical Optics",
+    "semiconductor": "Semiconductor & Electronics",
+    "static_electricity": "Statical Electricity",
+    "structure_matter": "Structure of Matter",
+    "thermodynamics": "Thermodynamics",
+    "vector": "Vector",
+    "wave": "Waves",
+    "work": "Work, Energy, and Power",
+}
+
+SearchFn = Callable[[np.ndarray, int], np.ndarray]
+
+def load_questions(file_path: str = QUESTIONNAIRE_PATH) -> Tuple[List[str], List[str]]:
+    """
+    Load the evaluation questions and their expected topics.
+
+    Args:
+        file_path (str): Path to the evaluation questionnaire
+
+    Returns:
+        Tuple[List[str], List[str]]: Questions and the dataset topic of each question
+    """
+    with open(file_path, "r") as f:
+        questionnaire = json.load(f)
+
+    questions, topics = [], []
+    for key, key_questions in questionnaire.items():
+        for question in key_questions:
+            questions.append(question)
+            topics.append(QUESTION_TOPICS.get(key, key))
+    return questions, topics
+
+def load_image_topics(file_path: str = DATASET_PATH) -> Dict[str, str]:
+    """Map each image URL in the dataset to its topic."""
+    with open(file_path, "r") as f:
+        return {item.get("image_url"): item.get("topic") for item in json.load(f)}
+
+def index_memory_bytes(index: faiss.Index) -> int:
+    """Approximate the in-memory size of an index by its serialized size (on-disk inverted lists are not counted)."""
+    return int(faiss.serialize_index(index).nbytes)
+
+def index_search(index: faiss.Index) -> SearchFn:
+    """Wrap a FAISS index as a search function returning row ids."""
+    def search(query_embedding: np.ndarray, k: int) -> np.ndarray:
+        _, indices = index.search(query_embedding.reshape(1, -1), k)
+        return indices[0]
+    return search
+
+def binary_search(binary_index: faiss.IndexBinary, vectors: np.ndarray, num_candidates: int) -> SearchFn:
+    """Wrap a binary index and its float vectors as a Hamming-then-re-rank search function."""
+    def search(query_embedding: np.ndarray, k: int) -> np.ndarray:
+        return search_binary_rerank(binary_index, vectors, query_embedding, k, num_candidates)
+    return search
+
+def evaluate_search(
+    search: SearchFn,
+    query_embeddings: np.ndarray,
+    metadata: List[Dict[str, Any]],
+    topics: List[str],
+    image_topics: Dict[str, str],
+    k: int,
+    reference: Optional[List[np.ndarray]] = None
+) -> Tuple[Dict[str, float], List[np.ndarray]]:
+    """
+    Run every query through a search function and score the results.
+
+    Args:
+        search (SearchFn): Function mapping a query embedding and k to row ids
+        query_embeddings (np.ndarray): One embedding per question
+        metadata (List[Dict[str, Any]]): Metadata of the indexed rows
+        topics (List[str]): Expected topic of each question
+        image_topics (Dict[str, str]): Topic of each image URL
+        k (int): Number of results per query
+        reference (Optional[List[np.ndarray]]): Row ids returned by the exact index
+
+    Returns:
+        Tuple[Dict[str, float], List[np.ndarray]]: Summary metrics and the row ids per query
+    """
+    latencies, retrieved = [], []
+    correct = 0
+    for query_embedding, topic in zip(query_embeddings, topics):
+        start = time.perf_counter()
+        ids = search(query_embedding, k)
+        latencies.append(time.perf_counter() - start)
+        retrieved.append(ids)
+
+        if len(ids) and 0 <= ids[0] < len(metadata):
+            if image_topics.get(metadata[ids[0]].get("image_url")) == topic:
+                correct += 1
+
+    latencies_ms = np.array(latencies) * 1000
+    summary = {
+        "queries": len(topics),
+        "topic_accuracy": 100.0 * correct / max(len(topics), 1),
+        "latency_mean_ms": float(latencies_ms.mean()),
+        "latency_p95_ms": float(np.percentile(latencies_ms, 95)),
+    }
+    if reference is not None:
+        overlaps = [
+            len(set(ids[ids >= 0].tolist()) & set(ref[ref >= 0].tolist())) / max(len(ref[ref >= 0]), 1)
+            for ids, ref in zip(retrieved, reference)
+        ]
+        summary[f"recall_at_{k}"] = 100.0 * float(np.mean(overlaps))
+    return summary, retrieved
+
+def evaluate_variants(
+    name: str,
+    exact_path: str,
+    index_paths: Dict[str, str],
+    query_embeddings: np.ndarray,
+    metadata: List[Dict[str, Any]],
+    topics: List[str],
+    image_topics: Dict[str, str],
+    k: int,
+    binary_candidates: int = BINARY_CANDIDATES
+) -> List[Dict[str, Any]]:
+    """
+    Evaluate every available index variant of one retriever structure.
+
+    The "binary" variant is a Hamming first pass re-ranked with the float32
+    vectors; its memory column counts the binary codes only.
+
+    Args:
+        name (str): Report label such as "BGE 5" or "CLIP"
+        exact_path (str): Path of the float32 index used as the recall reference
+        index_paths (Dict[str, str]): Index path per variant, "" being the float32 index
+        query_embeddings (np.ndarray): One embedding per question
+        metadata (List[Dict[str, Any]]): Metadata of the indexed rows
+        topics (List[str]): Expected topic of each question
+        image_topics (Dict[str, str]): Topic of each image URL
+        k (int): Number of results per query
+        binary_candidates (int): Hamming candidates re-ranked by the binary variant
+
+    Returns:
+        List[Dict[str, Any]]: One report row per evaluated variant
+    """
+    rows = []
+    reference = None
+    vectors = None
+    if os.path.exists(exact_path):
+        exact_index = faiss.read_index(exact_path)
+        vectors = exact_index.reconstruct_n(0, exact_index.ntotal)
+        _, reference = evaluate_search(
+            index_search(exact_index), query_embeddings, metadata, topics, image_topics, k
+        )
+
+    for variant, index_path in index_paths.items():
+        if not os.path.exists(index_path):
+            logger.warning(f"Skipping {name} variant '{variant or 'float32'}': {index_path} not found")
+            continue
+        if variant == "binary":
+            if vectors is None:
+                logger.warning(f"Skipping {name} variant 'binary': float32 index needed for re-ranking")
+                continue
+            index = faiss.read_index_binary(index_path)
+            search = binary_search(index, vectors, binary_candidates)
+            memory_bytes = int(faiss.serialize_index_binary(index).nbytes)
+        else:
+            index = ondisk_index.read_index(index_path)
+            search = index_search(index)
+            memory_bytes = index_memory_bytes(index)
+
+        summary, _ = evaluate_search(search, query_embeddings, metadata, topics, image_topics, k, reference)
+        rows.append({
+            "retriever": name,
+            "variant": variant or "float32",
+            "memory_bytes": memory_bytes,
+            **summary,
+        })
+    return rows
+
+def evaluate_bge(variants: List[str], questions: List[str], topics: List[str],
+                 image_topics: Dict[str, str], k: int,
+                 binary_candidates: int = BINARY_CANDIDATES) -> List[Dict[str, Any]]:
+    """Evaluate the requested index variants of every BGE structure."""
+    query_embeddings = bge_retreiver.get_text_embeddings(questions)
+    rows = []
+    for structure_num in range(1, 6):
+        _, metadata = bge_retreiver.get_structure_index_and_metadata(structure_num)
+        index_paths = {
+            variant: bge_retreiver.get_binary_index_path(structure_num) if variant == "binary"
+            else bge_retreiver.get_index_path(structure_num, variant)
+            for variant in variants
+        }
+        rows.extend(evaluate_variants(
+            f"BGE {structure_num}", bge_retreiver.get_index_path(structure_num, ""), index_paths,
+            query_embeddings, metadata, topics, image_topics, k, binary_candidates
+        ))
+    return rows
+
+def evaluate_clip(variants: List[str], questions: List[str], topics: List[str],
+                  image_topics: Dict[str, str], k: int,
+                  binary_candidates: int = BINARY_CANDIDATES) -> List[Dict[str, Any]]:
+    """Evaluate the requested index variants of the CLIP index."""
+    query_embeddings = np.stack([clip_retreiver.get_query_embedding(question) for question in questions])
+    metadata = clip_retreiver.get_retriever().metadata
+    index_paths = {
+        variant: clip_retreiver.CLIP_BINARY_INDEX_PATH if variant == "binary"
+        else clip_retreiver.get_index_path(variant)
+        for variant in variants
+    }
+    return evaluate_variants(
+        "CLIP", clip_retreiver.get_index_path(""), index_paths,
+        query_embeddings, metadata, topics, image_topics, k, binary_candidates
+    )
+
+def print_report(rows: List[Dict[str, Any]], k: int) -> None:
+    """Print the evaluation rows as a tab-separated table."""
+    print(f"Retriever\tVariant\tMemory (KB)\tMean (ms)\tP95 (ms)\tTopic Acc (%)\tRecall@{k} (%)")
+    for row in rows:
+        recall = row.get(f"recall_at_{k}")
+        print(
+            f"{row['retriever']}\t{row['variant']}\t{row['memory_bytes'] / 1024:.1f}\t"
+            f"{row['latency_mean_ms']:.3f}\t{row['latency_p95_ms']:.3f}\t"
+            f"{row['topic_accuracy']:.2f}\t{'-' if recall is None else f'{recall:.2f}'}"
+        )
+
+def parse_args() -> argparse.Namespace:
+    """Parse the evaluation options."""
+    parser = argparse.ArgumentParser(description="Report memory, latency and accuracy of dense index variants.")
+    parser.add_argument("--methods", nargs="+", choices=["bge", "clip"], default=["bge", "clip"])
+    parser.add_argument("--variants", nargs="+", default=DEFAULT_VARIANTS,
+                        help='Index variants to evaluate, "float32" for the exact index')
+    parser.add_argument("--k", type=int, default=5, help="Number of results per query")
+    parser.add_argument("--binary-candidates", type=int, default=BINARY_CANDIDATES,
+                        help="Hamming candidates re-ranked by the binary variant")
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "index_variants_report.json"))
+    return parser.parse_args()
+
+def main():
+    """Main function to evaluate the requested index variants."""
+    args = parse_args()
+    variants = ["" if variant == "float32" else variant for variant in args.variants]
+
+    questions, topics = load_questions()
+    image_topics = load_image_topics()
+    logger.info(f"Evaluating {len(questions)} questions")
+
+    rows = []
+    if "bge" in args.methods:
+        rows.extend(evaluate_bge(variants, questions, topics, image_topics, args.k, args.binary_candidates))
+    if "clip" in args.methods:
+        rows.extend(evaluate_clip(variants, questions, topics, image_topics, args.k, args.binary_candidates))
+
+    print_report(rows, args.k)
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(rows, f, indent=2)
+    logger.info(f"Report saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
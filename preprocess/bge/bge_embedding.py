@@ -1,13 +1,51 @@
+import argparse
 import json
 import numpy as np
 import faiss
 import os
+import sys
 from tqdm import tqdm
 from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
 
+sys.path.insert(0, os.path.abspath("."))
+
+from retreivers.binary_index import build_binary_index
+from retreivers.ondisk_index import DEFAULT_NPROBE, ONDISK_VARIANT, build_ondisk_ivf_index
+from retreivers.quantized_index import QUANTIZATIONS, build_index, get_index_variant, get_pq_m
+
 load_dotenv()
 
+# Dimension of the BGE-small-en-v1.5 embeddings
+EMBEDDING_DIMENSION = 384
+
+# Build options
+parser = argparse.ArgumentParser(description="Build BGE FAISS indices for each text structure.")
+parser.add_argument("--quantization", choices=QUANTIZATIONS, default="none",
+                    help="Also build a quantised index next to the float32 one")
+parser.add_argument("--pq-m", type=int, default=None,
+                    help="Number of PQ sub-quantisers, dividing 384 or --pca-dim (default: one per 8 dimensions)")
+parser.add_argument("--pq-nbits", type=int, default=8, help="Bits per PQ sub-quantiser code")
+parser.add_argument("--rerank", action="store_true",
+                    help="Keep float32 vectors next to the quantised codes to re-rank the top candidates exactly")
+parser.add_argument("--rerank-k-factor", type=int, default=4,
+                    help="Candidates fetched from the quantised index per requested result when re-ranking")
+parser.add_argument("--binary", action="store_true",
+                    help="Also build a sign-quantised IndexBinaryFlat for a Hamming first pass")
+parser.add_argument("--pca-dim", type=int, default=None,
+                    help="Reduce embeddings to this many dimensions with a PCA stored in the index (e.g. 64/128/256)")
+parser.add_argument("--pca-whiten", action="store_true", help="Whiten the PCA output")
+parser.add_argument("--ondisk-ivf", action="store_true",
+                    help="Also build an IVF index whose inverted lists live in an on-disk .ivfdata file")
+parser.add_argument("--ivf-nlist", type=int, default=None, help="Number of IVF clusters (default: 4 * sqrt(n))")
+parser.add_argument("--ivf-nprobe", type=int, default=DEFAULT_NPROBE, help="IVF clusters scanned per query")
+args = parser.parse_args()
+if args.quantization == "pq":
+    try:
+        get_pq_m(args.pca_dim or EMBEDDING_DIMENSION, args.pq_m)
+    except ValueError as e:
+        parser.error(str(e))
+
 # Load the BGE embedding model
 model = SentenceTransformer('BAAI/bge-small-en-v1.5')
 
@@ -144,8 +182,7 @@ for structure_num in range(1, 6):
         print(f"Length of embeddings: {length}")
         print(f"Dimension of embeddings: {dimension}")
         
-        index = faiss.IndexFlatL2(dimension)
-        index.add(embeddings)
+        index = build_index(embeddings, "none")
         
         # Save the index and metadata
         faiss.write_index(index, index_file_paths[structure_num - 1])
@@ -154,5 +191,28 @@ for structure_num in range(1, 6):
         
         print(f"FAISS index saved to {index_file_paths[structure_num - 1]}")
         print(f"Metadata saved to {metadata_file_paths[structure_num - 1]}")
+        
+        # Save the quantised and/or PCA-reduced variant alongside the float32 index
+        variant = get_index_variant(args.quantization, args.rerank, args.pca_dim, args.pca_whiten)
+        if variant:
+            variant_index = build_index(
+                embeddings, args.quantization, args.pq_m, args.pq_nbits,
+                args.rerank, args.rerank_k_factor, args.pca_dim, args.pca_whiten
+            )
+            variant_path = os.path.join(text_embedding_dir, f"text_index_structure_{structure_num}{variant}.faiss")
+            faiss.write_index(variant_index, variant_path)
+            print(f"FAISS index variant saved to {variant_path}")
+        
+        # Save the binary index alongside the float32 index
+        if args.binary:
+            binary_path = os.path.join(text_embedding_dir, f"text_binary_index_structure_{structure_num}.faiss")
+            faiss.write_index_binary(build_binary_index(embeddings), binary_path)
+            print(f"Binary FAISS index saved to {binary_path}")
+        
+        # Save the on-disk IVF index alongside the float32 index
+        if args.ondisk_ivf:
+            ondisk_path = os.path.join(text_embedding_dir, f"text_index_structure_{structure_num}_{ONDISK_VARIANT}.faiss")
+            faiss.write_index(build_ondisk_ivf_index(embeddings, ondisk_path, args.ivf_nlist, args.ivf_nprobe), ondisk_path)
+            print(f"On-disk IVF FAISS index saved to {ondisk_path}")
     else:
         print(f"No successful embeddings for structure {structure_num}") 
\ No newline at end of file
@@ -0,0 +1,137 @@
+"""
+Package the preprocess outputs into a versioned index bundle.
+
+Copies the metadata, FAISS indices and BM25/TF-IDF pickles (see
+retreivers/bundles.py) from a source tree into bundles/<version>/ and writes
+its manifest.json:
+
+    version     bundle name
+    created     build time
+    models      query encoder of each dense index, checked by the backend before serving it
+    build       free-form build parameters (--param key=value)
+    items       item counts of the dataset and of each metadata file
+    files       size and SHA-256 of every file, checked when the bundle is loaded
+
+The bundle is written to a temporary directory and renamed into place, so a
+backend never sees a half-written bundle. Activate it without a restart with
+POST /admin/bundles/<version>/activate.
+
+Usage:
+    python preprocess/bundle/build_bundle.py --version 2026-10-19 --param nlist=1024
+    python preprocess/bundle/build_bundle.py --source synthetic/1m --version synthetic-1m --activate
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.abspath("."))
+
+from retreivers import bundles
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants (kept in sync with retreivers/bge_retreiver.py and retreivers/clip_retreiver.py, which
+# are not imported so that packaging does not load torch)
+MODELS = {
+    "bge": "BAAI/bge-small-en-v1.5",
+    "clip": "ViT-B/32",
+}
+MODEL_DIRS = {
+    "bge": "preprocess/bge/text_embedding",
+    "clip": "preprocess/clip/image_embedding",
+}
+
+def count_items(root: str, files: List[str]) -> Dict[str, int]:
+    """Count the entries of every JSON metadata file of a bundle."""
+    items = {}
+    for path in files:
+        if path.endswith(".json"):
+            with open(os.path.join(root, path), "r") as f:
+                data = json.load(f)
+            if isinstance(data, list):
+                items[path] = len(data)
+    return items
+
+def parse_params(params: List[str]) -> Dict[str, str]:
+    """Parse key=value build parameters."""
+    parsed = {}
+    for param in params:
+        key, separator, value = param.partition("=")
+        if not separator:
+            raise ValueError(f"Build parameter {param} is not key=value")
+        parsed[key] = value
+    return parsed
+
+def build_bundle(source: str, version: str, bundle_dir: str, params: Dict[str, str]) -> str:
+    """
+    Copy the preprocess outputs of a source tree into a new bundle.
+
+    Args:
+        source (str): Tree holding the preprocess outputs, e.g. "." or a synthetic corpus
+        version (str): Bundle version, the name of its directory
+        bundle_dir (str): Directory of the versioned bundles
+        params (Dict[str, str]): Build parameters to record
+
+    Returns:
+        str: The bundle directory
+    """
+    root = os.path.join(bundle_dir, version)
+    if os.path.exists(root):
+        raise FileExistsError(f"Bundle {version} already exists at {root}")
+    files = bundles.list_files(source)
+    if not files:
+        raise FileNotFoundError(f"No preprocess outputs found under {source}")
+
+    temporary_root = os.path.join(bundle_dir, f".{version}.tmp")
+    shutil.rmtree(temporary_root, ignore_errors=True)
+    manifest_files = {}
+    for path in files:
+        destination = os.path.join(temporary_root, path)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.copy2(os.path.join(source, path), destination)
+        manifest_files[path] = {"bytes": os.path.getsize(destination), "sha256": bundles.file_sha256(destination)}
+
+    manifest = {
+        "version": version,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "models": {
+            key: model_name for key, model_name in MODELS.items()
+            if any(path.startswith(MODEL_DIRS[key]) for path in files)
+        },
+        "build": {"source": os.path.abspath(source), **params},
+        "items": count_items(temporary_root, files),
+        "files": manifest_files,
+    }
+    with open(os.path.join(temporary_root, bundles.MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    os.rename(temporary_root, root)
+    logger.info(f"Bundle {version} written to {root} ({len(files)} files)")
+    return root
+
+def main():
+    """Main function to build an index bundle."""
+    parser = argparse.ArgumentParser(description="Package the preprocess outputs into a versioned index bundle.")
+    parser.add_argument("--version", default=time.strftime("%Y-%m-%dT%H%M%S"), help="Bundle version (default: now)")
+    parser.add_argument("--source", default=".", help="Tree holding the preprocess outputs")
+    parser.add_argument("--output", default=bundles.BUNDLE_DIR, help="Directory of the versioned bundles")
+    parser.add_argument("--param", action="append", default=[], help="Build parameter key=value to record")
+    parser.add_argument("--activate", action="store_true", help="Serve this bundle on the next backend startup")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    build_bundle(args.source, args.version, args.output, parse_params(args.param))
+    if args.activate:
+        bundles.write_current_version(args.version, args.output)
+        logger.info(f"Bundle {args.version} will be served on the next startup")
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
+import argparse
 import torch
 import clip
 import faiss
 import requests
 import json
 import os
+import sys
 from PIL import Image
 from io import BytesIO
 import numpy as np
@@ -11,10 +13,19 @@ from typing import List, Dict, Any
 import logging
 from tqdm import tqdm
 
+sys.path.insert(0, os.path.abspath("."))
+
+from retreivers.binary_index import build_binary_index
+from retreivers.ondisk_index import DEFAULT_NPROBE, ONDISK_VARIANT, build_ondisk_ivf_index
+from retreivers.quantized_index import QUANTIZATIONS, build_index, get_index_variant, get_pq_m
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Dimension of the CLIP ViT-B/32 image embeddings
+EMBEDDING_DIMENSION = 512
+
 def setup_clip_model() -> tuple:
     """
     Initialize and load the CLIP model and preprocessor.
@@ -90,8 +101,7 @@ def create_and_save_index(image_embeddings: np.ndarray, metadata: List[Dict[str,
         index_path (str): Path to save the FAISS index
         metadata_path (str): Path to save the metadata JSON
     """
-    index = faiss.IndexFlatL2(image_embeddings.shape[1])
-    index.add(image_embeddings)
+    index = build_index(image_embeddings)
     
     faiss.write_index(index, index_path)
     
@@ -100,8 +110,36 @@ def create_and_save_index(image_embeddings: np.ndarray, metadata: List[Dict[str,
     
     logger.info("Image embeddings and metadata stored successfully!")
 
+def parse_args() -> argparse.Namespace:
+    """Parse the index build options."""
+    parser = argparse.ArgumentParser(description="Build the CLIP image FAISS index.")
+    parser.add_argument("--quantization", choices=QUANTIZATIONS, default="none",
+                        help="Also build a quantised index next to the float32 one")
+    parser.add_argument("--pq-m", type=int, default=None,
+                        help="Number of PQ sub-quantisers, dividing 512 (default: one per 8 dimensions)")
+    parser.add_argument("--pq-nbits", type=int, default=8, help="Bits per PQ sub-quantiser code")
+    parser.add_argument("--rerank", action="store_true",
+                        help="Keep float32 vectors next to the quantised codes to re-rank the top candidates exactly")
+    parser.add_argument("--rerank-k-factor", type=int, default=4,
+                        help="Candidates fetched from the quantised index per requested result when re-ranking")
+    parser.add_argument("--binary", action="store_true",
+                        help="Also build a sign-quantised IndexBinaryFlat for a Hamming first pass")
+    parser.add_argument("--ondisk-ivf", action="store_true",
+                        help="Also build an IVF index whose inverted lists live in an on-disk .ivfdata file")
+    parser.add_argument("--ivf-nlist", type=int, default=None, help="Number of IVF clusters (default: 4 * sqrt(n))")
+    parser.add_argument("--ivf-nprobe", type=int, default=DEFAULT_NPROBE, help="IVF clusters scanned per query")
+    args = parser.parse_args()
+    if args.quantization == "pq":
+        try:
+            get_pq_m(EMBEDDING_DIMENSION, args.pq_m)
+        except ValueError as e:
+            parser.error(str(e))
+    return args
+
 def main():
     """Main function to orchestrate the image embedding process."""
+    args = parse_args()
+    
     # Setup
     model, preprocess = setup_clip_model()
     device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -124,6 +162,29 @@ def main():
         "preprocess/clip/image_embedding/clip_index.faiss",
         "preprocess/clip/image_embedding/clip_metadata.json"
     )
+    
+    # Save the quantised variant alongside the float32 index
+    if args.quantization != "none":
+        variant = get_index_variant(args.quantization, args.rerank)
+        quantized_index = build_index(
+            image_embeddings, args.quantization, args.pq_m, args.pq_nbits,
+            args.rerank, args.rerank_k_factor
+        )
+        quantized_path = f"preprocess/clip/image_embedding/clip_index{variant}.faiss"
+        faiss.write_index(quantized_index, quantized_path)
+        logger.info(f"Quantised FAISS index saved to {quantized_path}")
+    
+    # Save the binary index alongside the float32 index
+    if args.binary:
+        binary_path = "preprocess/clip/image_embedding/clip_binary_index.faiss"
+        faiss.write_index_binary(build_binary_index(image_embeddings), binary_path)
+        logger.info(f"Binary FAISS index saved to {binary_path}")
+    
+    # Save the on-disk IVF index alongside the float32 index
+    if args.ondisk_ivf:
+        ondisk_path = f"preprocess/clip/image_embedding/clip_index_{ONDISK_VARIANT}.faiss"
+        faiss.write_index(build_ondisk_ivf_index(image_embeddings, ondisk_path, args.ivf_nlist, args.ivf_nprobe), ondisk_path)
+        logger.info(f"On-disk IVF FAISS index saved to {ondisk_path}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,347 @@
+"""
+Synthetic corpus generator for scaling tests.
+
+Writes a corpus of any size in the same layout and schema as the real one, so
+every preprocessing script and retriever can run against it offline:
+
+    <output>/preprocess/dataset/image_metadata.json
+    <output>/preprocess/bge/text_embedding/text_index_structure_N.faiss
+    <output>/preprocess/bge/text_embedding/text_metadata_structure_N.json
+    <output>/preprocess/clip/image_embedding/clip_index.faiss
+    <output>/preprocess/clip/image_embedding/clip_metadata.json
+
+The text statistics are fitted on preprocess/dataset/image_metadata.json:
+  - Words are drawn from the real unigram distribution. A fraction of them
+    equal to the real share of words seen only once is replaced by new
+    Zipf-distributed rare words. The vocabulary therefore keeps growing with
+    corpus size, as it would in real text.
+  - Each field's word count is drawn from that field's real length distribution.
+  - Topics keep the real 20 topics, their definitions and their frequencies.
+    Each topic keeps its real subtopics, and --subtopics-per-topic can add more.
+Embeddings are random unit vectors scattered around one random center per
+topic, so nearest neighbours are mostly in the query's topic, as with the
+real encoders. No model is loaded, and the data is written in chunks.
+
+Run the preprocessing scripts or the backend from the output directory
+(with this repository on PYTHONPATH) to use the synthetic corpus:
+
+    python preprocess/dataset/generate_synthetic.py --size 1000000 --output synthetic/1m
+    cd synthetic/1m && PYTHONPATH=../.. python ../../preprocess/bm25/bm_25_tokenizer.py
+"""
+
+import argparse
+import json
+import logging
+import os
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from tqdm import tqdm
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants
+SOURCE_PATH = "preprocess/dataset/image_metadata.json"
+METADATA_PATH = "preprocess/dataset/image_metadata.json"
+BGE_DIR = "preprocess/bge/text_embedding"
+CLIP_DIR = "preprocess/clip/image_embedding"
+BGE_DIMENSION = 384
+CLIP_DIMENSION = 512
+CHUNK_SIZE = 10000
+TEXT_FIELDS = ["caption", "topic_mapped_image_description", "context_free_description"]
+URL_PREFIX = "https://synthetic.invalid/images"
+SENTENCE_LENGTH = 18
+RARE_WORD_EXPONENT = 1.3
+PUNCTUATION = ".,;:!?()[]\"'"
+
+# Text of each BGE structure, as built by preprocess/bge/bge_embedding.py
+STRUCTURE_FIELDS = {
+    1: ["context_free_description"],
+    2: ["topic_mapped_image_description"],
+    3: ["topic_definition", "subtopic_definition"],
+    4: ["topic_definition", "subtopic_definition", "context_free_description"],
+    5: ["topic_definition", "subtopic_definition", "topic_mapped_image_description"],
+}
+BGE_METADATA_FIELDS = [
+    "image_url", "topic_mapped_image_description", "context_free_description",
+    "topic_definition", "subtopic_definition"
+]
+CLIP_METADATA_FIELDS = ["topic", "subtopic", "image_url", "caption", "image_id"]
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase words without their surrounding punctuation."""
+    words = (word.strip(PUNCTUATION) for word in text.lower().split())
+    return [word for word in words if word]
+
+class TextModel:
+    """Unigram word model and per-field length distributions fitted on the real corpus."""
+
+    def __init__(self, items: List[Dict[str, Any]], fields: List[str]):
+        counts = Counter(
+            word for item in items for field in fields for word in tokenize(item.get(field) or "")
+        )
+        self.words = np.array(list(counts))
+        frequencies = np.array([counts[word] for word in self.words], dtype=np.float64)
+        self.probabilities = frequencies / frequencies.sum()
+        # Share of running words seen only once: the rate at which new words appear
+        self.rare_rate = float(np.sum(frequencies == 1) / frequencies.sum())
+        self.lengths = {
+            field: np.array([len((item.get(field) or "").split()) for item in items]) for field in fields
+        }
+
+    def sample(self, field: str, count: int, rng: np.random.Generator) -> List[str]:
+        """Generate count texts with the word and length statistics of a field."""
+        lengths = np.maximum(1, rng.choice(self.lengths[field], size=count))
+        word_ids = rng.choice(len(self.words), size=int(lengths.sum()), p=self.probabilities)
+        words = self.words[word_ids].astype(object)
+        rare = rng.random(len(words)) < self.rare_rate
+        words[rare] = [f"w{n}" for n in rng.zipf(RARE_WORD_EXPONENT, size=int(rare.sum()))]
+
+        texts = []
+        offset = 0
+        for length in lengths:
+            texts.append(to_sentences(words[offset:offset + length]))
+            offset += length
+        return texts
+
+def to_sentences(words: np.ndarray) -> str:
+    """Join words into capitalised, full-stopped sentences of about SENTENCE_LENGTH words."""
+    sentences = []
+    for start in range(0, len(words), SENTENCE_LENGTH):
+        sentence = " ".join(words[start:start + SENTENCE_LENGTH])
+        sentences.append(sentence[:1].upper() + sentence[1:] + ".")
+    return " ".join(sentences)
+
+class TopicModel:
+    """Topics with their real frequencies and definitions, each with a pool of subtopics."""
+
+    def __init__(self, items: List[Dict[str, Any]], text_model: TextModel, rng: np.random.Generator,
+                 subtopics_per_topic: Optional[int] = None):
+        topic_counts = Counter(item["topic"] for item in items)
+        self.topics = sorted(topic_counts)
+        counts = np.array([topic_counts[topic] for topic in self.topics], dtype=np.float64)
+        self.probabilities = counts / counts.sum()
+        self.definitions = {item["topic"]: item["topic_definition"] for item in items}
+
+        # topic -> [(subtopic, definition)], the real ones first
+        self.subtopics: Dict[str, List[tuple]] = {topic: [] for topic in self.topics}
+        seen = set()
+        for item in items:
+            key = (item["topic"], item["subtopic"])
+            if key not in seen:
+                seen.add(key)
+                self.subtopics[item["topic"]].append((item["subtopic"], item["subtopic_definition"]))
+
+        if subtopics_per_topic:
+            for topic, pool in self.subtopics.items():
+                missing = subtopics_per_topic - len(pool)
+                if missing <= 0:
+                    del pool[subtopics_per_topic:]
+                    continue
+                names = text_model.sample("caption", missing, rng)
+                definitions = text_model.sample("subtopic_definition", missing, rng)
+                pool.extend(
+                    (f"{name.rstrip('.')} {len(pool) + i}", definition)
+                    for i, (name, definition) in enumerate(zip(names, definitions))
+                )
+
+    def num_subtopics(self) -> int:
+        """Get the number of distinct subtopics over all topics."""
+        return sum(len(pool) for pool in self.subtopics.values())
+
+def generate_items(size: int, text_model: TextModel, topic_model: TopicModel, rng: np.random.Generator,
+                   chunk_size: int = CHUNK_SIZE) -> Iterator[List[Dict[str, Any]]]:
+    """Generate image metadata items in chunks, in the schema of image_metadata.json."""
+    for start in range(0, size, chunk_size):
+        count = min(chunk_size, size - start)
+        topic_ids = rng.choice(len(topic_model.topics), size=count, p=topic_model.probabilities)
+        texts = {field: text_model.sample(field, count, rng) for field in TEXT_FIELDS}
+
+        chunk = []
+        for i, topic_id in enumerate(topic_ids):
+            topic = topic_model.topics[topic_id]
+            pool = topic_model.subtopics[topic]
+            subtopic, subtopic_definition = pool[rng.integers(len(pool))]
+            chunk.append({
+                "topic": topic,
+                "subtopic": subtopic,
+                "caption": texts["caption"][i].rstrip("."),
+                "topic_mapped_image_description": texts["topic_mapped_image_description"][i],
+                "context_free_description": texts["context_free_description"][i],
+                "topic_definition": topic_model.definitions[topic],
+                "subtopic_definition": subtopic_definition,
+                "image_url": f"{URL_PREFIX}/{topic.replace(' ', '_')}/{start + i}.png",
+                "topic_id": int(topic_id),
+            })
+        yield chunk
+
+def random_centers(count: int, dimension: int, rng: np.random.Generator) -> np.ndarray:
+    """Draw one uniformly random unit vector per topic."""
+    centers = rng.standard_normal((count, dimension)).astype(np.float32)
+    faiss.normalize_L2(centers)
+    return centers
+
+def random_unit_vectors(topic_ids: np.ndarray, centers: np.ndarray, noise: float,
+                        rng: np.random.Generator) -> np.ndarray:
+    """Draw unit vectors around the center of each item's topic."""
+    dimension = centers.shape[1]
+    vectors = centers[topic_ids] + noise * rng.standard_normal((len(topic_ids), dimension)) / np.sqrt(dimension)
+    vectors = vectors.astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+class JsonArrayWriter:
+    """Writes a JSON array one chunk at a time, without holding it in memory."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(path, "w")
+        self.file.write("[")
+        self.empty = True
+
+    def write(self, items: List[Dict[str, Any]]) -> None:
+        for item in items:
+            self.file.write(("" if self.empty else ", ") + json.dumps(item))
+            self.empty = False
+
+    def close(self) -> None:
+        self.file.write("]")
+        self.file.close()
+
+def fit_models(source: List[Dict[str, Any]], rng: np.random.Generator,
+               subtopics_per_topic: Optional[int] = None) -> Tuple[TextModel, TopicModel]:
+    """Fit the text and topic models on the real items."""
+    text_model = TextModel(source, TEXT_FIELDS + ["subtopic_definition"])
+    topic_model = TopicModel(source, text_model, rng, subtopics_per_topic)
+    logger.info(
+        f"Fitted on {len(source)} items: {len(text_model.words)} words, rare word rate "
+        f"{text_model.rare_rate:.3f}, {len(topic_model.topics)} topics, {topic_model.num_subtopics()} subtopics"
+    )
+    return text_model, topic_model
+
+def generate_chunks(size: int, text_model: TextModel, topic_model: TopicModel, rng: np.random.Generator,
+                    structures: List[int], vectors: bool = True, noise: float = 1.0,
+                    chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[List[Dict[str, Any]], Dict[Any, np.ndarray]]]:
+    """
+    Generate items in chunks, with their vectors.
+
+    Yields:
+        Tuple[List[Dict[str, Any]], Dict[Any, np.ndarray]]: The items of a chunk, and their CLIP ("clip")
+            and BGE (by structure number) vectors, empty without vectors
+    """
+    bge_centers = random_centers(len(topic_model.topics), BGE_DIMENSION, rng)
+    clip_centers = random_centers(len(topic_model.topics), CLIP_DIMENSION, rng)
+    for chunk in generate_items(size, text_model, topic_model, rng, chunk_size):
+        topic_ids = np.array([item.pop("topic_id") for item in chunk])
+        chunk_vectors = {}
+        if vectors:
+            chunk_vectors["clip"] = random_unit_vectors(topic_ids, clip_centers, noise, rng)
+            for structure_num in structures:
+                chunk_vectors[structure_num] = random_unit_vectors(topic_ids, bge_centers, noise, rng)
+        yield chunk, chunk_vectors
+
+def generate_corpus(size: int, output_dir: str, source_path: str = SOURCE_PATH, seed: int = 0,
+                    structures: Optional[List[int]] = None, subtopics_per_topic: Optional[int] = None,
+                    vectors: bool = True, noise: float = 1.0, chunk_size: int = CHUNK_SIZE) -> Dict[str, Any]:
+    """
+    Generate a synthetic corpus and its indices under output_dir.
+
+    Args:
+        size (int): Number of images
+        output_dir (str): Root of the generated tree
+        source_path (str): Real image_metadata.json to fit the text and topic statistics on
+        seed (int): Random seed
+        structures (Optional[List[int]]): BGE structures to build, all by default
+        subtopics_per_topic (Optional[int]): Subtopics per topic, the real pools by default
+        vectors (bool): Whether to build the BGE and CLIP indices and their metadata
+        noise (float): Spread of the vectors around their topic center (larger is closer to uniform)
+        chunk_size (int): Items generated and written at a time
+
+    Returns:
+        Dict[str, Any]: Statistics of the generated corpus
+    """
+    structures = structures or list(STRUCTURE_FIELDS)
+    with open(source_path, "r") as f:
+        source = json.load(f)
+
+    rng = np.random.default_rng(seed)
+    text_model, topic_model = fit_models(source, rng, subtopics_per_topic)
+
+    writers = {"metadata": JsonArrayWriter(os.path.join(output_dir, METADATA_PATH))}
+    indices = {}
+    if vectors:
+        writers["clip"] = JsonArrayWriter(os.path.join(output_dir, CLIP_DIR, "clip_metadata.json"))
+        indices["clip"] = faiss.IndexFlatL2(CLIP_DIMENSION)
+        for structure_num in structures:
+            writers[structure_num] = JsonArrayWriter(
+                os.path.join(output_dir, BGE_DIR, f"text_metadata_structure_{structure_num}.json")
+            )
+            indices[structure_num] = faiss.IndexFlatL2(BGE_DIMENSION)
+
+    chunks = generate_chunks(size, text_model, topic_model, rng, structures, vectors, noise, chunk_size)
+    for chunk, chunk_vectors in tqdm(chunks, total=-(-size // chunk_size), desc="Generating chunks"):
+        writers["metadata"].write(chunk)
+        if not vectors:
+            continue
+        writers["clip"].write([{field: item.get(field) for field in CLIP_METADATA_FIELDS} for item in chunk])
+        indices["clip"].add(chunk_vectors["clip"])
+        bge_metadata = [{field: item[field] for field in BGE_METADATA_FIELDS} for item in chunk]
+        for structure_num in structures:
+            writers[structure_num].write(bge_metadata)
+            indices[structure_num].add(chunk_vectors[structure_num])
+
+    for writer in writers.values():
+        writer.close()
+    if vectors:
+        faiss.write_index(indices.pop("clip"), os.path.join(output_dir, CLIP_DIR, "clip_index.faiss"))
+        for structure_num, index in indices.items():
+            faiss.write_index(index, os.path.join(output_dir, BGE_DIR, f"text_index_structure_{structure_num}.faiss"))
+
+    stats = {
+        "size": size,
+        "seed": seed,
+        "source_items": len(source),
+        "topics": len(topic_model.topics),
+        "subtopics": topic_model.num_subtopics(),
+        "source_vocabulary": len(text_model.words),
+        "rare_word_rate": text_model.rare_rate,
+        "structures": structures if vectors else [],
+        "noise": noise,
+    }
+    with open(os.path.join(output_dir, "synthetic_corpus.json"), "w") as f:
+        json.dump(stats, f, indent=2)
+    logger.info(f"Synthetic corpus of {size} items written to {output_dir}")
+    return stats
+
+def parse_args() -> argparse.Namespace:
+    """Parse the generator options."""
+    parser = argparse.ArgumentParser(description="Generate a schema-compatible synthetic corpus for scaling tests.")
+    parser.add_argument("--size", type=int, required=True, help="Number of images to generate")
+    parser.add_argument("--output", required=True, help="Directory to write the corpus tree into")
+    parser.add_argument("--source", default=SOURCE_PATH, help="Real metadata to fit the statistics on")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--structures", type=int, nargs="+", choices=list(STRUCTURE_FIELDS),
+                        help="BGE structures to build indices for (default: all)")
+    parser.add_argument("--subtopics-per-topic", type=int,
+                        help="Subtopics per topic, padded with generated ones (default: the real pools)")
+    parser.add_argument("--noise", type=float, default=1.0,
+                        help="Spread of the vectors around their topic center (larger is closer to uniform)")
+    parser.add_argument("--no-vectors", action="store_true",
+                        help="Only write image_metadata.json, e.g. to run the real embedding scripts on it")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Items generated and written at a time")
+    return parser.parse_args()
+
+def main():
+    """Main function to generate a synthetic corpus."""
+    args = parse_args()
+    generate_corpus(
+        args.size, args.output, args.source, args.seed, args.structures, args.subtopics_per_topic,
+        not args.no_vectors, args.noise, args.chunk_size
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Save the BGE and CLIP encoders as pinned local model artifacts.
+
+The torch encoder backend otherwise resolves its weights through the Hugging
+Face hub and CLIP download caches on every cold start. That needs network
+access on first use and builds full model objects. This script writes
+everything needed to load the encoders into one directory:
+
+    bge/            the SentenceTransformer model (safetensors weights, tokenizer, pooling config)
+    clip_text.pt    the CLIP text tower only, float32, loaded memory-mapped by retreivers/clip_text.py
+    clip_image.pt   the CLIP vision tower only, float32, for live ingestion (see retreivers/clip_image.py)
+    manifest.json   model names, revisions, checksums and library versions
+
+Ship the directory with the deployment and set MODELS_OFFLINE=true so that the
+retrievers load exclusively from it (see retreivers/encoders.py).
+
+Usage:
+    python preprocess/models/save_artifacts.py
+    python preprocess/models/save_artifacts.py --models clip --output /srv/models
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+from typing import Any, Dict, Optional
+
+import clip
+import sentence_transformers
+import torch
+from sentence_transformers import SentenceTransformer
+
+sys.path.insert(0, os.path.abspath("."))
+
+from retreivers.clip_image import save_vision_tower
+from retreivers.clip_text import save_text_tower
+from retreivers.encoders import ARTIFACT_DIR, ARTIFACT_MANIFEST
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants
+BGE_MODEL_NAME = "BAAI/bge-small-en-v1.5"
+CLIP_MODEL_NAME = "ViT-B/32"
+
+def sha256(path: str) -> str:
+    """Get the SHA-256 of a file, or of every file under a directory in name order."""
+    digest = hashlib.sha256()
+    paths = [path] if os.path.isfile(path) else sorted(
+        os.path.join(root, name) for root, _, names in os.walk(path) for name in names
+    )
+    for file_path in paths:
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+def save_bge(output_dir: str, revision: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Save the BGE SentenceTransformer with safetensors weights.
+
+    Args:
+        output_dir (str): Artifact directory
+        revision (Optional[str]): Hub revision (commit, branch or tag) to pin
+
+    Returns:
+        Dict[str, Any]: Manifest entry
+    """
+    path = os.path.join(output_dir, "bge")
+    shutil.rmtree(path, ignore_errors=True)
+    model = SentenceTransformer(BGE_MODEL_NAME, device="cpu", revision=revision)
+    model.save(path, safe_serialization=True)
+    logger.info(f"BGE encoder saved to {path}")
+    return {"model_name": BGE_MODEL_NAME, "revision": revision, "path": "bge", "sha256": sha256(path)}
+
+def save_clip(output_dir: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Save the text and vision towers of CLIP as separate artifacts.
+
+    Args:
+        output_dir (str): Artifact directory
+
+    Returns:
+        Dict[str, Dict[str, Any]]: Manifest entries of "clip_text" and "clip_image"
+    """
+    model, _ = clip.load(CLIP_MODEL_NAME, device="cpu", jit=False)
+    entries = {}
+    for name, tower, save_tower in [("clip_text", "text", save_text_tower), ("clip_image", "vision", save_vision_tower)]:
+        path = os.path.join(output_dir, f"{name}.pt")
+        config = save_tower(model, path)
+        logger.info(f"CLIP {tower} tower saved to {path} ({os.path.getsize(path) / 1e6:.0f} MB)")
+        entries[name] = {"model_name": CLIP_MODEL_NAME, "path": f"{name}.pt", "config": config, "sha256": sha256(path)}
+    return entries
+
+def main():
+    """Main function to save the model artifacts."""
+    parser = argparse.ArgumentParser(description="Save the query encoders as local model artifacts.")
+    parser.add_argument("--models", nargs="+", choices=["bge", "clip"], default=["bge", "clip"])
+    parser.add_argument("--output", default=ARTIFACT_DIR, help="Artifact directory")
+    parser.add_argument("--bge-revision", help="Hub revision of the BGE model to pin")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    manifest_path = os.path.join(args.output, ARTIFACT_MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+
+    if "bge" in args.models:
+        manifest["bge"] = save_bge(args.output, args.bge_revision)
+    if "clip" in args.models:
+        manifest.update(save_clip(args.output))
+    manifest["created"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    manifest["versions"] = {
+        "torch": torch.__version__,
+        "sentence_transformers": sentence_transformers.__version__,
+    }
+
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    logger.info(f"Manifest written to {manifest_path}")
+
+if __name__ == "__main__":
+    main()
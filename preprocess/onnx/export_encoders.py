@@ -0,0 +1,151 @@
+"""
+Export the BGE and CLIP text encoders to ONNX for the onnx encoder backends.
+
+Writes bge.onnx and clip_text.onnx (plus the BGE tokenizer) to
+preprocess/onnx/models, and optionally dynamically int8-quantised copies
+(bge_int8.onnx, clip_text_int8.onnx).
+
+Usage:
+    python preprocess/onnx/export_encoders.py --quantize
+"""
+
+import argparse
+import logging
+import os
+
+import clip
+import torch
+from sentence_transformers import SentenceTransformer
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants
+ONNX_DIR = "preprocess/onnx/models"
+BGE_MODEL_NAME = "BAAI/bge-small-en-v1.5"
+CLIP_MODEL_NAME = "ViT-B/32"
+OPSET_VERSION = 17
+
+class BGEClsPooling(torch.nn.Module):
+    """BGE transformer returning the CLS token embedding, as SentenceTransformer pools it."""
+
+    def __init__(self, transformer: torch.nn.Module):
+        super().__init__()
+        self.transformer = transformer
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        outputs = self.transformer(
+            input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids
+        )
+        return outputs.last_hidden_state[:, 0]
+
+class CLIPTextTower(torch.nn.Module):
+    """CLIP text tower on its own, without the vision weights."""
+
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, tokens):
+        return self.model.encode_text(tokens)
+
+def export_bge(output_dir: str) -> str:
+    """
+    Export the BGE encoder and save its tokenizer next to it.
+
+    Args:
+        output_dir (str): Directory to write the ONNX graph and tokenizer to
+
+    Returns:
+        str: Path of the exported ONNX graph
+    """
+    model = SentenceTransformer(BGE_MODEL_NAME, device="cpu")
+    tokenizer = model.tokenizer
+    tokenizer.save_pretrained(os.path.join(output_dir, "bge_tokenizer"))
+
+    wrapper = BGEClsPooling(model[0].auto_model).eval()
+    # Trace with a batch of two so the batch axis is not folded into constants
+    sample = tokenizer(["a diagram of a physics concept", "a circuit"], padding=True, return_tensors="pt")
+
+    onnx_path = os.path.join(output_dir, "bge.onnx")
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in ["input_ids", "attention_mask", "token_type_ids"]}
+    dynamic_axes["sentence_embedding"] = {0: "batch"}
+    torch.onnx.export(
+        wrapper,
+        (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+        onnx_path,
+        input_names=["input_ids", "attention_mask", "token_type_ids"],
+        output_names=["sentence_embedding"],
+        dynamic_axes=dynamic_axes,
+        opset_version=OPSET_VERSION,
+    )
+    logger.info(f"BGE encoder exported to {onnx_path}")
+    return onnx_path
+
+def export_clip_text(output_dir: str) -> str:
+    """
+    Export the CLIP text tower.
+
+    Args:
+        output_dir (str): Directory to write the ONNX graph to
+
+    Returns:
+        str: Path of the exported ONNX graph
+    """
+    model, _ = clip.load(CLIP_MODEL_NAME, device="cpu", jit=False)
+    wrapper = CLIPTextTower(model.float()).eval()
+    # Trace with a batch of two so the batch axis is not folded into constants
+    sample = clip.tokenize(["a diagram of a physics concept", "a circuit"])
+
+    onnx_path = os.path.join(output_dir, "clip_text.onnx")
+    torch.onnx.export(
+        wrapper,
+        (sample,),
+        onnx_path,
+        input_names=["tokens"],
+        output_names=["text_features"],
+        dynamic_axes={"tokens": {0: "batch"}, "text_features": {0: "batch"}},
+        opset_version=OPSET_VERSION,
+    )
+    logger.info(f"CLIP text encoder exported to {onnx_path}")
+    return onnx_path
+
+def quantize(onnx_path: str) -> str:
+    """
+    Write a copy of an ONNX graph with dynamically int8-quantised weights.
+
+    Args:
+        onnx_path (str): Path of the float graph
+
+    Returns:
+        str: Path of the quantised graph
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantized_path = onnx_path.replace(".onnx", "_int8.onnx")
+    quantize_dynamic(onnx_path, quantized_path, weight_type=QuantType.QInt8)
+    logger.info(f"Int8 encoder saved to {quantized_path}")
+    return quantized_path
+
+def main():
+    """Main function to export the query encoders."""
+    parser = argparse.ArgumentParser(description="Export the query encoders to ONNX.")
+    parser.add_argument("--models", nargs="+", choices=["bge", "clip"], default=["bge", "clip"])
+    parser.add_argument("--quantize", action="store_true", help="Also write dynamically int8-quantised graphs")
+    args = parser.parse_args()
+
+    os.makedirs(ONNX_DIR, exist_ok=True)
+
+    exported = []
+    if "bge" in args.models:
+        exported.append(export_bge(ONNX_DIR))
+    if "clip" in args.models:
+        exported.append(export_clip_text(ONNX_DIR))
+
+    if args.quantize:
+        for onnx_path in exported:
+            quantize(onnx_path)
+
+if __name__ == "__main__":
+    main()
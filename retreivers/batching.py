@@ -0,0 +1,123 @@
+"""
+Micro-batching for concurrent query encoding.
+
+Retrievers run in separate worker threads, and each one used to call its
+encoder with a single query. A BatchingEncoder puts those calls on a queue and
+a single background thread gathers the queries arriving within a few
+milliseconds (up to a maximum batch size) into one encode call, handing each
+caller back its own vector.
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict
+
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_MAX_BATCH_SIZE = 32
+DEFAULT_MAX_WAIT_MS = 2.0
+
+class BatchingEncoder:
+    """Batches single-query encode calls from many threads into shared forward passes."""
+
+    def __init__(self, encoder: Any, max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+                 max_wait_ms: float = DEFAULT_MAX_WAIT_MS, name: str = "encoder"):
+        """
+        Start the batching thread for an encoder.
+
+        Args:
+            encoder: Encoder exposing encode(texts, normalize_embeddings=True)
+            max_batch_size (int): Maximum number of queries per encode call
+            max_wait_ms (float): How long the first query of a batch waits for more to arrive
+            name (str): Name used for the batching thread
+        """
+        self.encoder = encoder
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._queue = queue.Queue()
+
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._largest_batch = 0
+        self._total_delay = 0.0
+        self._max_delay = 0.0
+
+        self._thread = threading.Thread(target=self._run, name=f"{name}-batcher", daemon=True)
+        self._thread.start()
+
+    def encode(self, text: str) -> np.ndarray:
+        """
+        Encode one query, sharing the forward pass with concurrent callers.
+
+        Args:
+            text (str): The query to encode
+
+        Returns:
+            np.ndarray: Normalized embedding of shape (dimension,)
+        """
+        future = Future()
+        self._queue.put((text, time.perf_counter(), future))
+        return future.result()
+
+    def _collect_batch(self) -> list:
+        """Block for the first query, then gather more until the batch is full or the wait expires."""
+        items = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(items) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                items.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        """Encode batches forever on the background thread."""
+        while True:
+            items = self._collect_batch()
+            start = time.perf_counter()
+            try:
+                embeddings = self.encoder.encode([text for text, _, _ in items], normalize_embeddings=True)
+            except Exception as e:
+                logger.error(f"Error encoding batch of {len(items)} queries: {str(e)}")
+                for _, _, future in items:
+                    future.set_exception(e)
+                continue
+
+            delays = [start - enqueued for _, enqueued, _ in items]
+            with self._stats_lock:
+                self._batches += 1
+                self._requests += len(items)
+                self._largest_batch = max(self._largest_batch, len(items))
+                self._total_delay += sum(delays)
+                self._max_delay = max(self._max_delay, max(delays))
+
+            for (_, _, future), embedding in zip(items, embeddings):
+                future.set_result(np.asarray(embedding, dtype=np.float32))
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        Get batch-size and queue-delay metrics.
+
+        Returns:
+            Dict[str, float]: Counters and averages since the encoder started
+        """
+        with self._stats_lock:
+            return {
+                "batches": self._batches,
+                "requests": self._requests,
+                "queue_depth": self._queue.qsize(),
+                "mean_batch_size": self._requests / self._batches if self._batches else 0.0,
+                "largest_batch_size": self._largest_batch,
+                "mean_queue_delay_ms": 1000 * self._total_delay / self._requests if self._requests else 0.0,
+                "max_queue_delay_ms": 1000 * self._max_delay,
+            }
@@ -1,10 +1,18 @@
 import faiss
 import json
 import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import logging
+import threading
+
+from retreivers.batching import BatchingEncoder
+from retreivers import bundles, metrics, ondisk_index, sharding
+from retreivers.binary_index import search_binary_rerank
+from retreivers.encoders import load_bge_encoder
+from retreivers.quantized_index import read_raw_index
+from retreivers.resources import get_worker_cpu_sets
+from retreivers.workers import EncoderWorkerPool
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -13,41 +21,217 @@ logger = logging.getLogger(__name__)
 # Constants
 BGE_DIR = "preprocess/bge/text_embedding"
 MODEL_NAME = "BAAI/bge-small-en-v1.5"
+# Query encoder backend: "torch", "onnx" or "onnx_int8" (see retreivers/encoders.py)
+ENCODER_BACKEND = os.getenv("BGE_ENCODER_BACKEND", "torch")
+# Number of encoder worker processes (see retreivers/workers.py); 0 encodes in the API process
+NUM_ENCODER_WORKERS = int(os.getenv("BGE_ENCODER_WORKERS", "0"))
+# Micro-batching of concurrent single-query encodes (see retreivers/batching.py)
+USE_BATCHING = os.getenv("BGE_ENCODER_BATCHING", "false").lower() == "true"
+MAX_BATCH_SIZE = int(os.getenv("BGE_MAX_BATCH_SIZE", "32"))
+MAX_BATCH_WAIT_MS = float(os.getenv("BGE_MAX_BATCH_WAIT_MS", "2"))
+# Index variant built by preprocess/bge/bge_embedding.py, e.g. "int8", "pq_rerank", "pca128" or "ivf_ondisk"
+# (empty for float32).
+# PCA variants store the transform in the index, which applies it to each query before searching.
+INDEX_VARIANT = os.getenv("BGE_INDEX_VARIANT", "")
+# Hamming first pass over the binary index (built with --binary) followed by a float re-rank
+USE_BINARY_INDEX = os.getenv("BGE_USE_BINARY_INDEX", "false").lower() == "true"
+BINARY_CANDIDATES = int(os.getenv("BGE_BINARY_CANDIDATES", "100"))
+# Clusters scanned per query by an IVF index, e.g. the "ivf_ondisk" variant (0 keeps the value stored at build time)
+NPROBE = int(os.getenv("BGE_NPROBE", "0"))
 
-# Global variables for model and indices
+# Global variables for the model; the indices, metadata and vectors are cached per index bundle
+# (see retreivers/bundles.py) under "bge_indices", "bge_metadata", "bge_binary_indices", "bge_raw_indices"
+# (the float32 indices next to a served variant) and "bge_vectors"
 _model = None
-_indices = {}
-_metadata = {}
+_model_lock = threading.Lock()
+_batcher = None
+_batcher_lock = threading.Lock()
 
 def _load_model():
     """Load the BGE model if not already loaded."""
     global _model
     if _model is None:
-        _model = SentenceTransformer(MODEL_NAME)
+        # Concurrent first requests (bge, hybrid, topic_routed) load the model or start the worker pool once
+        with _model_lock:
+            if _model is None:
+                if NUM_ENCODER_WORKERS > 0:
+                    model = EncoderWorkerPool(
+                        "bge", MODEL_NAME, ENCODER_BACKEND, NUM_ENCODER_WORKERS, cpu_sets=get_worker_cpu_sets("bge")
+                    )
+                else:
+                    model = load_bge_encoder(MODEL_NAME, ENCODER_BACKEND)
+                _model = model
     return _model
 
-def _load_indices_and_metadata():
-    """Load FAISS indices and metadata for each structure if not already loaded."""
-    global _indices, _metadata
+def get_index_path(structure_num: int, variant: str = INDEX_VARIANT) -> str:
+    """Get the FAISS index path of a structure for an index variant, in the current index bundle."""
+    suffix = f"_{variant}" if variant else ""
+    return bundles.resolve(os.path.join(BGE_DIR, f"text_index_structure_{structure_num}{suffix}.faiss"))
+
+def get_binary_index_path(structure_num: int) -> str:
+    """Get the binary FAISS index path of a structure, in the current index bundle."""
+    return bundles.resolve(os.path.join(BGE_DIR, f"text_binary_index_structure_{structure_num}.faiss"))
+
+def get_metadata_path(structure_num: int) -> str:
+    """Get the metadata path of a structure, in the current index bundle."""
+    return bundles.resolve(os.path.join(BGE_DIR, f"text_metadata_structure_{structure_num}.json"))
+
+def get_shard_source(structure_num: int) -> sharding.Source:
+    """Get the shard source of a structure: its float32 index whatever variant is served, as shards copy vectors."""
+    return ("faiss", get_index_path(structure_num, ""), get_metadata_path(structure_num))
+
+def _load_indices_and_metadata() -> Tuple[Dict[int, faiss.Index], Dict[int, List[Dict[str, Any]]]]:
+    """Load FAISS indices and metadata for each structure of the current bundle if not already loaded."""
+    indices, metadata = bundles.cache("bge_indices"), bundles.cache("bge_metadata")
     
-    if not _indices:
+    metrics.record_cache("bge_indices", bool(indices))
+    if not indices:
+        binary_indices = bundles.cache("bge_binary_indices")
         for structure_num in range(1, 6):
-            index_path = os.path.join(BGE_DIR, f"text_index_structure_{structure_num}.faiss")
-            metadata_path = os.path.join(BGE_DIR, f"text_metadata_structure_{structure_num}.json")
+            index_path = get_index_path(structure_num)
+            metadata_path = get_metadata_path(structure_num)
             
             if os.path.exists(index_path) and os.path.exists(metadata_path):
-                _indices[structure_num] = faiss.read_index(index_path)
                 with open(metadata_path, 'r') as f:
-                    _metadata[structure_num] = json.load(f)
+                    metadata[structure_num] = json.load(f)
+                indices[structure_num] = ondisk_index.read_index(index_path, NPROBE)
             else:
                 logger.warning(f"Missing index or metadata for structure {structure_num}")
+            
+            if USE_BINARY_INDEX and structure_num in indices:
+                binary_index_path = get_binary_index_path(structure_num)
+                if os.path.exists(binary_index_path):
+                    binary_indices[structure_num] = faiss.read_index_binary(binary_index_path)
+                else:
+                    logger.warning(f"Missing binary index for structure {structure_num}, using exact search")
+    return indices, metadata
+
+def _search_index(structure_num: int, query_embedding: np.ndarray, k: int) -> np.ndarray:
+    """Search a structure's index, across the shard workers or through the binary first pass when enabled."""
+    if sharding.is_enabled():
+        return np.array(sharding.search(get_shard_source(structure_num), query_embedding, k), dtype=np.int64)
+    binary_indices = bundles.cache("bge_binary_indices")
+    if structure_num in binary_indices:
+        return search_binary_rerank(
+            binary_indices[structure_num], get_structure_vectors(structure_num),
+            query_embedding, k, BINARY_CANDIDATES
+        )
+    _, indices = bundles.cache("bge_indices")[structure_num].search(query_embedding.reshape(1, -1), k)
+    return indices[0]
+
+def _load_batcher() -> BatchingEncoder:
+    """Start the micro-batching encoder if not already started."""
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = BatchingEncoder(_load_model(), MAX_BATCH_SIZE, MAX_BATCH_WAIT_MS, name="bge")
+    return _batcher
+
+def get_batching_stats() -> Dict[str, float]:
+    """Get the micro-batching metrics of the BGE encoder (empty when batching is off or idle)."""
+    return _batcher.get_stats() if _batcher is not None else {}
 
 def _get_text_embedding(query: str) -> np.ndarray:
     """Get text embedding for the query using BGE."""
+    if USE_BATCHING:
+        return _load_batcher().encode(query)
     model = _load_model()
     embedding = model.encode(query, normalize_embeddings=True)
     return embedding.astype('float32')
 
+def get_query_embedding(query: str) -> np.ndarray:
+    """
+    Get the normalized BGE embedding for a query.
+    
+    Args:
+        query (str): The search query
+        
+    Returns:
+        np.ndarray: Query embedding of shape (dimension,)
+    """
+    return _get_text_embedding(query)
+
+def get_text_embeddings(texts: List[str]) -> np.ndarray:
+    """
+    Get normalized BGE embeddings for a batch of texts.
+    
+    Args:
+        texts (List[str]): The texts to embed
+        
+    Returns:
+        np.ndarray: Embeddings of shape (len(texts), dimension)
+    """
+    model = _load_model()
+    embeddings = model.encode(texts, normalize_embeddings=True)
+    return embeddings.astype('float32')
+
+def get_structure_index_and_metadata(structure_num: int) -> Tuple[Optional[faiss.Index], List[Dict[str, Any]]]:
+    """
+    Get the loaded FAISS index and metadata for a specific structure.
+    
+    Args:
+        structure_num (int): The structure number (1-5)
+        
+    Returns:
+        Tuple[Optional[faiss.Index], List[Dict[str, Any]]]: The index (None if missing) and its metadata
+    """
+    indices, metadata = _load_indices_and_metadata()
+    return indices.get(structure_num), metadata.get(structure_num, [])
+
+def get_loaded_indices() -> Dict[int, faiss.Index]:
+    """Get the FAISS indices of the current bundle loaded so far by structure, without loading any."""
+    return dict(bundles.cache("bge_indices"))
+
+def get_loaded_item_counts() -> Dict[str, Tuple[int, int]]:
+    """
+    Get the rows of each loaded index and the entries of its metadata, without loading any.
+
+    Returns:
+        Dict[str, Tuple[int, int]]: Repository-relative metadata path -> (index rows, metadata entries)
+    """
+    indices, metadata = bundles.cache("bge_indices"), bundles.cache("bge_metadata")
+    return {
+        os.path.join(BGE_DIR, f"text_metadata_structure_{structure_num}.json"):
+            (index.ntotal, len(metadata.get(structure_num, [])))
+        for structure_num, index in list(indices.items())
+    }
+
+def get_raw_index(structure_num: int) -> Optional[faiss.Index]:
+    """
+    Get the float32 index of a structure's raw vectors: the served index, or the one next to the served variant.
+    
+    Args:
+        structure_num (int): The structure number (1-5)
+        
+    Returns:
+        Optional[faiss.Index]: The float32 index, None if the structure is missing
+    """
+    indices, _ = _load_indices_and_metadata()
+    if structure_num not in indices or not INDEX_VARIANT:
+        return indices.get(structure_num)
+    raw_indices = bundles.cache("bge_raw_indices")
+    if structure_num not in raw_indices:
+        ondisk_index.check_in_memory(indices[structure_num], "Exact rescoring of stored vectors")
+        raw_indices[structure_num] = read_raw_index(get_index_path(structure_num, ""), indices[structure_num])
+    return raw_indices[structure_num]
+
+def get_structure_vectors(structure_num: int) -> Optional[np.ndarray]:
+    """
+    Get the raw float vectors of a structure, in metadata order (exact even when a variant is served).
+    
+    Args:
+        structure_num (int): The structure number (1-5)
+        
+    Returns:
+        Optional[np.ndarray]: Vectors of shape (ntotal, dimension), None if the structure is missing
+    """
+    vectors = bundles.cache("bge_vectors")
+    if structure_num not in vectors:
+        raw_index = get_raw_index(structure_num)
+        if raw_index is not None:
+            vectors[structure_num] = ondisk_index.reconstruct_all(raw_index)
+    return vectors.get(structure_num)
+
 def get_top_image_metadata(query: str, structure_num: int, k: int = 1) -> List[Dict[str, Any]]:
     """
     Get the metadata of the top k images for a given query using a specific structure.
@@ -61,29 +245,32 @@ def get_top_image_metadata(query: str, structure_num: int, k: int = 1) -> List[D
         List[Dict[str, Any]]: List of metadata for top k images
     """
     try:
-        _load_indices_and_metadata()
+        indices, metadata = _load_indices_and_metadata()
         
-        if structure_num not in _indices or structure_num not in _metadata:
+        if structure_num not in indices or structure_num not in metadata:
             logger.error(f"Structure {structure_num} not available")
+            metrics.record_error(f"Structure {structure_num} not available")
             return []
             
         # Get text embedding
-        query_embedding = _get_text_embedding(query)
+        with metrics.time_stage("bge", "encode"):
+            query_embedding = _get_text_embedding(query)
         
         # Search in FAISS index
-        distances, indices = _indices[structure_num].search(
-            query_embedding.reshape(1, -1), k
-        )
+        with metrics.time_stage("bge", "search"):
+            rows = _search_index(structure_num, query_embedding, k)
         
         # Get metadata for the retrieved indices
-        results = []
-        for idx in indices[0]:
-            if idx < len(_metadata[structure_num]):
-                results.append(_metadata[structure_num][idx])
+        with metrics.time_stage("bge", "metadata"):
+            results = []
+            for idx in rows:
+                if idx < len(metadata[structure_num]):
+                    results.append(metadata[structure_num][idx])
                 
         return results
     except Exception as e:
         logger.error(f"Error retrieving images for query '{query}' with structure {structure_num}: {str(e)}")
+        metrics.record_error(f"structure {structure_num}: {str(e)}")
         return []
 
 def get_top_image_metadata_all_structures(query: str, k: int = 1) -> Dict[int, List[Dict[str, Any]]]:
@@ -99,7 +286,8 @@ def get_top_image_metadata_all_structures(query: str, k: int = 1) -> Dict[int, L
     """
     results = {}
     for structure_num in range(1, 6):
-        results[structure_num] = get_top_image_metadata(query, structure_num, k)
+        with metrics.time_structure("bge", structure_num):
+            results[structure_num] = get_top_image_metadata(query, structure_num, k)
     return results
 
 def get_multiple_images_metadata(query: str, structure_num: int, k: int = 5) -> List[Dict[str, Any]]:
@@ -0,0 +1,67 @@
+"""
+Binary-hash first pass for dense search.
+
+Normalized embeddings are sign-quantised into packed bits and stored in a
+faiss.IndexBinaryFlat. A query first takes the top candidates by Hamming
+distance, which are then re-ranked exactly with the float vectors.
+"""
+
+import faiss
+import numpy as np
+
+# Constants
+BINARY_CANDIDATES = 100
+
+def encode_binary(embeddings: np.ndarray) -> np.ndarray:
+    """
+    Sign-quantise embeddings into packed bits.
+
+    Args:
+        embeddings (np.ndarray): Float embeddings of shape (n, dimension)
+
+    Returns:
+        np.ndarray: Packed codes of shape (n, dimension / 8)
+    """
+    return np.packbits(np.asarray(embeddings).reshape(len(embeddings), -1) > 0, axis=1)
+
+def build_binary_index(embeddings: np.ndarray) -> faiss.IndexBinaryFlat:
+    """
+    Build a Hamming index over sign-quantised embeddings.
+
+    Args:
+        embeddings (np.ndarray): Float embeddings of shape (n, dimension)
+
+    Returns:
+        faiss.IndexBinaryFlat: The populated binary index
+    """
+    index = faiss.IndexBinaryFlat(embeddings.shape[1])
+    index.add(encode_binary(embeddings))
+    return index
+
+def search_binary_rerank(
+    binary_index: faiss.IndexBinary,
+    vectors: np.ndarray,
+    query_embedding: np.ndarray,
+    k: int,
+    num_candidates: int = BINARY_CANDIDATES
+) -> np.ndarray:
+    """
+    Search the Hamming index, then re-rank the candidates with the float vectors.
+
+    Args:
+        binary_index (faiss.IndexBinary): Index built by build_binary_index
+        vectors (np.ndarray): Float vectors in the same row order as the binary index
+        query_embedding (np.ndarray): Normalized query embedding
+        k (int): Number of results to return
+        num_candidates (int): Number of Hamming candidates to re-rank
+
+    Returns:
+        np.ndarray: Row ids of the top k results, closest first
+    """
+    query_embedding = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+    _, candidates = binary_index.search(encode_binary(query_embedding.reshape(1, -1)), max(k, num_candidates))
+    candidates = candidates[0][candidates[0] >= 0]
+
+    # Exact L2 distance on the candidates only
+    distances = ((vectors[candidates] - query_embedding) ** 2).sum(axis=1)
+    return candidates[np.argsort(distances)[:k]]
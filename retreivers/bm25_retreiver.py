@@ -3,6 +3,8 @@ from rank_bm25 import BM25Okapi
 import os
 from typing import List, Dict, Any, Literal
 
+from retreivers import bundles, metrics, sharding
+
 # Constants
 PICKLE_DIR = "preprocess/bm25/pickle_files"
 VARIANT_DIRS = {
@@ -11,8 +13,16 @@ VARIANT_DIRS = {
 }
 
 def load_retriever(structure_num: int, variant: Literal["with_stopwords", "without_stopwords"] = "with_stopwords") -> BM25Okapi:
+    """Load a BM25 retriever of the current index bundle for a structure number and variant if not already loaded."""
+    retrievers = bundles.cache("bm25_retrievers")
+    metrics.record_cache("bm25_retrievers", (structure_num, variant) in retrievers)
+    if (structure_num, variant) not in retrievers:
+        retrievers[(structure_num, variant)] = _read_retriever(structure_num, variant)
+    return retrievers[(structure_num, variant)]
+
+def _read_retriever(structure_num: int, variant: Literal["with_stopwords", "without_stopwords"] = "with_stopwords") -> BM25Okapi:
     """
-    Load a BM25 retriever for a specific structure number and variant.
+    Read a BM25 retriever for a specific structure number and variant from disk.
     
     Args:
         structure_num (int): The structure number (1-5)
@@ -22,12 +32,12 @@ def load_retriever(structure_num: int, variant: Literal["with_stopwords", "witho
         BM25Okapi: The loaded BM25 retriever
     """
     variant_dir = VARIANT_DIRS[variant]
-    pickle_path = os.path.join(PICKLE_DIR, variant_dir, f"{variant}_structure_{structure_num}.pkl")
+    pickle_path = bundles.resolve(os.path.join(PICKLE_DIR, variant_dir, f"{variant}_structure_{structure_num}.pkl"))
     
     # Check if structure-specific file exists
     if not os.path.exists(pickle_path):
         # If the file is not found, try the variant-only file as a fallback
-        fallback_path = os.path.join(PICKLE_DIR, variant_dir, f"{variant}.pkl")
+        fallback_path = bundles.resolve(os.path.join(PICKLE_DIR, variant_dir, f"{variant}.pkl"))
         if not os.path.exists(fallback_path):
             raise FileNotFoundError(f"BM25 pickle files not found: {pickle_path} or {fallback_path}")
         pickle_path = fallback_path
@@ -187,15 +197,20 @@ def get_multiple_images_metadata(
     tokenized_query = query.lower().split()
     
     if hasattr(bm25_model, 'metadata'):
-        doc_scores = bm25_model.get_scores(tokenized_query)
-        
-        # Get the top k indices
-        top_indices = doc_scores.argsort()[-k:][::-1]
+        if sharding.is_enabled():
+            # Score each shard of the documents in its own worker process
+            top_indices = sharding.search(("bm25", structure_num, variant), tokenized_query, k)
+        else:
+            doc_scores = bm25_model.get_scores(tokenized_query)
+            
+            # Get the top k indices
+            top_indices = doc_scores.argsort()[-k:][::-1]
         
         # Return metadata for the top k documents
         return [bm25_model.metadata[idx] for idx in top_indices if idx < len(bm25_model.metadata)]
     else:
         print("Warning: BM25 model doesn't have metadata attribute. Check your pickle structure.")
+        metrics.record_error(f"BM25 model of structure {structure_num} has no metadata")
         return []
 
 def get_multiple_images_metadata_all_structures(
@@ -216,7 +231,8 @@ def get_multiple_images_metadata_all_structures(
     """
     results = {}
     for structure_num in range(1, 6):
-        results[structure_num] = get_multiple_images_metadata(query, structure_num, variant, k)
+        with metrics.time_structure(f"bm25_{variant}", structure_num):
+            results[structure_num] = get_multiple_images_metadata(query, structure_num, variant, k)
     return results
 
 def get_top_image_metadata_all_variants(query: str, structure_num: int) -> Dict[str, Dict[str, Any]]:
@@ -0,0 +1,203 @@
+"""
+Versioned index bundles, swappable while the backend serves queries.
+
+A bundle is a directory holding every index, metadata file and pickle the
+retrievers read, under the same relative paths as the repository
+(preprocess/bge/text_embedding/..., preprocess/bm25/pickle_files/... and so
+on), plus a manifest.json of checksums, model names, build parameters and
+item counts. Bundles live side by side under INDEX_BUNDLE_DIR:
+
+    bundles/
+        CURRENT                   name of the bundle to serve on startup
+        2026-10-19T0300/
+            manifest.json
+            preprocess/...
+
+The retrievers resolve their paths and keep their loaded indices and pickles in
+the bundle that serves the current request (see resolve() and cache()). A
+request pins the active bundle when it starts, and asyncio.to_thread carries
+the pin into the retriever threads. Every retriever therefore sees one
+consistent version for the whole request. Swapping the active bundle is a
+single reference assignment. Requests already running finish on the old
+bundle, and its memory is released when the last of them drops its reference.
+
+Without a bundle directory the retrievers read the repository's own preprocess
+outputs, as before.
+
+Configuration:
+    INDEX_BUNDLE_DIR     directory of the versioned bundles (default "bundles")
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants
+BUNDLE_DIR = os.getenv("INDEX_BUNDLE_DIR", "bundles")
+MANIFEST = "manifest.json"
+CURRENT = "CURRENT"
+# Preprocess outputs that make up a bundle, relative to the repository (or bundle) root
+BUNDLE_PATHS = [
+    "preprocess/dataset/image_metadata.json",
+    "preprocess/bge/text_embedding",
+    "preprocess/clip/image_embedding",
+    "preprocess/bm25/pickle_files",
+    "preprocess/tfidf/pickle_files",
+]
+
+class IndexBundle:
+    """One version of the retrieval data and the retrievers' caches loaded from it."""
+
+    def __init__(self, root: str, version: str, manifest: Optional[Dict[str, Any]] = None):
+        self.root = root
+        self.version = version
+        self.manifest = manifest or {}
+        self.loaded_at = time.time()
+        self._caches: Dict[str, Dict[Any, Any]] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, path: str) -> str:
+        """Get the path of a repository-relative data file inside this bundle."""
+        return path if self.root == "." else os.path.join(self.root, path)
+
+    def cache(self, name: str) -> Dict[Any, Any]:
+        """Get a named cache of loaded data, created empty on first use."""
+        cache = self._caches.get(name)
+        if cache is None:
+            with self._lock:
+                cache = self._caches.setdefault(name, {})
+        return cache
+
+    def summary(self) -> Dict[str, Any]:
+        """Get the version, location and manifest highlights of this bundle."""
+        return {
+            "version": self.version,
+            "root": self.root,
+            "loaded_at": self.loaded_at,
+            "models": self.manifest.get("models", {}),
+            "items": self.manifest.get("items", {}),
+            "build": self.manifest.get("build", {}),
+        }
+
+# The bundle new requests are served from, and the bundle pinned by the current request
+_active = IndexBundle(".", "repository")
+_pinned: ContextVar[Optional[IndexBundle]] = ContextVar("pinned_bundle", default=None)
+
+def get_active() -> IndexBundle:
+    """Get the bundle that new requests are served from."""
+    return _active
+
+def current() -> IndexBundle:
+    """Get the bundle pinned by the current request, or the active bundle outside a request."""
+    return _pinned.get() or _active
+
+def resolve(path: str) -> str:
+    """Get the path of a repository-relative data file in the current bundle."""
+    return current().resolve(path)
+
+def cache(name: str) -> Dict[Any, Any]:
+    """Get a named cache of the current bundle."""
+    return current().cache(name)
+
+def pin() -> IndexBundle:
+    """Pin the active bundle for the rest of the current request (call before fanning out to threads)."""
+    bundle = _active
+    _pinned.set(bundle)
+    return bundle
+
+@contextmanager
+def pinned(bundle: IndexBundle) -> Iterator[IndexBundle]:
+    """Serve the calls in the block from a given bundle, e.g. to warm it up before activating it."""
+    token = _pinned.set(bundle)
+    try:
+        yield bundle
+    finally:
+        _pinned.reset(token)
+
+def activate(bundle: IndexBundle) -> IndexBundle:
+    """Make a bundle the one new requests are served from, and return the previous one."""
+    global _active
+    previous, _active = _active, bundle
+    logger.info(f"Activated index bundle {bundle.version} (was {previous.version})")
+    return previous
+
+def file_sha256(path: str) -> str:
+    """Get the SHA-256 of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def list_files(root: str) -> List[str]:
+    """List the bundle files under a root, relative to it."""
+    files = []
+    for path in BUNDLE_PATHS:
+        full_path = os.path.join(root, path)
+        if os.path.isfile(full_path):
+            files.append(path)
+        for directory, _, names in os.walk(full_path):
+            files.extend(os.path.relpath(os.path.join(directory, name), root) for name in names)
+    return sorted(files)
+
+def load_bundle(version: str, bundle_dir: str = BUNDLE_DIR, verify: bool = True) -> IndexBundle:
+    """
+    Open a bundle version, optionally checking its files against the manifest checksums.
+
+    Nothing is loaded into memory yet: the retrievers fill the bundle's caches on
+    first use, or when it is warmed up.
+
+    Raises:
+        FileNotFoundError: If the bundle or its manifest does not exist
+        ValueError: If a file is missing or does not match its checksum
+    """
+    root = os.path.join(bundle_dir, version)
+    manifest_path = os.path.join(root, MANIFEST)
+    if not os.path.exists(manifest_path):
+        raise FileNotFoundError(f"No index bundle manifest at {manifest_path}")
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+
+    if verify:
+        for path, entry in manifest.get("files", {}).items():
+            full_path = os.path.join(root, path)
+            if not os.path.exists(full_path):
+                raise ValueError(f"Bundle {version} is missing {path}")
+            if file_sha256(full_path) != entry["sha256"]:
+                raise ValueError(f"Checksum mismatch for {path} in bundle {version}")
+    return IndexBundle(root, version, manifest)
+
+def list_versions(bundle_dir: str = BUNDLE_DIR) -> List[str]:
+    """List the complete bundle versions (those with a manifest), oldest name first."""
+    if not os.path.isdir(bundle_dir):
+        return []
+    return sorted(
+        name for name in os.listdir(bundle_dir)
+        if os.path.exists(os.path.join(bundle_dir, name, MANIFEST))
+    )
+
+def read_current_version(bundle_dir: str = BUNDLE_DIR) -> Optional[str]:
+    """Get the version named in the CURRENT file, if any."""
+    path = os.path.join(bundle_dir, CURRENT)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return f.read().strip() or None
+
+def write_current_version(version: str, bundle_dir: str = BUNDLE_DIR) -> None:
+    """Record the version to serve on the next startup, atomically."""
+    path = os.path.join(bundle_dir, CURRENT)
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as f:
+        f.write(version)
+    os.replace(temporary_path, path)
@@ -0,0 +1,100 @@
+"""
+The CLIP vision tower as a standalone module.
+
+Live ingestion (see retreivers/ingestion.py) embeds added images with CLIP's
+vision tower only. The model artifacts built by
+preprocess/models/save_artifacts.py keep its weights next to the text tower
+(see retreivers/clip_text.py), so that images can be encoded offline without
+loading the full model. This module rebuilds the vision tower from them, as
+clip.model.build_model does, and gives the image preprocessing of clip.load.
+"""
+
+from typing import Any, Callable, Dict
+
+import torch
+from clip.clip import _transform
+from clip.model import ModifiedResNet, VisionTransformer
+
+# State dict entries of the vision tower in a full CLIP model
+VISION_TOWER_PREFIX = "visual."
+
+def get_vision_tower_state_dict(model: torch.nn.Module) -> Dict[str, torch.Tensor]:
+    """Get the vision tower weights of a full CLIP model, without the "visual." prefix."""
+    return {
+        name[len(VISION_TOWER_PREFIX):]: tensor
+        for name, tensor in model.state_dict().items() if name.startswith(VISION_TOWER_PREFIX)
+    }
+
+def get_vision_tower_config(state_dict: Dict[str, torch.Tensor]) -> Dict[str, Any]:
+    """Infer the vision tower hyperparameters from its weights, as clip.model.build_model does."""
+    if "proj" in state_dict:
+        width = state_dict["conv1.weight"].shape[0]
+        patch_size = state_dict["conv1.weight"].shape[-1]
+        grid_size = round((state_dict["positional_embedding"].shape[0] - 1) ** 0.5)
+        return {
+            "architecture": "vit",
+            "input_resolution": patch_size * grid_size,
+            "patch_size": patch_size,
+            "width": width,
+            "layers": len([name for name in state_dict if name.endswith(".attn.in_proj_weight")]),
+            "heads": width // 64,
+            "output_dim": state_dict["proj"].shape[1],
+        }
+    width = state_dict["layer1.0.conv1.weight"].shape[0]
+    output_width = round((state_dict["attnpool.positional_embedding"].shape[0] - 1) ** 0.5)
+    return {
+        "architecture": "resnet",
+        "layers": [len({name.split(".")[1] for name in state_dict if name.startswith(f"layer{block}.")})
+                   for block in range(1, 5)],
+        "output_dim": state_dict["attnpool.c_proj.weight"].shape[0],
+        "heads": width * 32 // 64,
+        "input_resolution": output_width * 32,
+        "width": width,
+    }
+
+def build_vision_tower(config: Dict[str, Any]) -> torch.nn.Module:
+    """Build an uninitialised vision tower from its config."""
+    config = dict(config)
+    if config.pop("architecture") == "vit":
+        return VisionTransformer(**config)
+    return ModifiedResNet(**config)
+
+def get_preprocess(vision_tower: torch.nn.Module) -> Callable:
+    """Get the image preprocessing of a vision tower, as returned by clip.load."""
+    return _transform(vision_tower.input_resolution)
+
+def save_vision_tower(model: torch.nn.Module, path: str) -> Dict[str, Any]:
+    """
+    Save the vision tower of a full CLIP model in float32.
+
+    Args:
+        model (torch.nn.Module): CLIP model, e.g. from clip.load
+        path (str): File to write
+
+    Returns:
+        Dict[str, Any]: The vision tower config
+    """
+    state_dict = {name: tensor.float().cpu() for name, tensor in get_vision_tower_state_dict(model).items()}
+    config = get_vision_tower_config(state_dict)
+    torch.save({"config": config, "state_dict": state_dict}, path)
+    return config
+
+def load_vision_tower(path: str, device: str = "cpu") -> torch.nn.Module:
+    """
+    Load a vision tower saved by save_vision_tower.
+
+    The file is memory-mapped and the module is built on the meta device, so the
+    weights are neither randomly initialised nor copied before use.
+
+    Args:
+        path (str): File written by save_vision_tower
+        device (str): Device to move the tower to
+
+    Returns:
+        torch.nn.Module: The tower in eval mode; calling it on preprocessed images gives CLIP.encode_image
+    """
+    checkpoint = torch.load(path, map_location="cpu", weights_only=True, mmap=True)
+    with torch.device("meta"):
+        tower = build_vision_tower(checkpoint["config"])
+    tower.load_state_dict(checkpoint["state_dict"], assign=True)
+    return tower.to(device).eval()
@@ -1,12 +1,21 @@
 import faiss
+import io
 import json
 import os
-from typing import List, Dict, Any
+import threading
+from typing import List, Dict, Any, Tuple
 import numpy as np
-import clip
 import torch
 import logging
 
+from retreivers.batching import BatchingEncoder
+from retreivers import bundles, metrics, ondisk_index, sharding
+from retreivers.binary_index import search_binary_rerank
+from retreivers.encoders import TorchCLIPImageEncoder, load_clip_text_encoder
+from retreivers.quantized_index import read_raw_index
+from retreivers.resources import get_worker_cpu_sets
+from retreivers.workers import EncoderWorkerPool
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,31 +24,112 @@ logger = logging.getLogger(__name__)
 CLIP_DIR = "preprocess/clip/image_embedding"
 CLIP_INDEX_PATH = os.path.join(CLIP_DIR, "clip_index.faiss")
 CLIP_METADATA_PATH = os.path.join(CLIP_DIR, "clip_metadata.json")
+CLIP_BINARY_INDEX_PATH = os.path.join(CLIP_DIR, "clip_binary_index.faiss")
 MODEL_NAME = "ViT-B/32"
+# Query encoder backend: "torch", "onnx" or "onnx_int8" (see retreivers/encoders.py)
+ENCODER_BACKEND = os.getenv("CLIP_ENCODER_BACKEND", "torch")
+# Number of encoder worker processes (see retreivers/workers.py); 0 encodes in the API process
+NUM_ENCODER_WORKERS = int(os.getenv("CLIP_ENCODER_WORKERS", "0"))
+# Micro-batching of concurrent single-query encodes (see retreivers/batching.py)
+USE_BATCHING = os.getenv("CLIP_ENCODER_BATCHING", "false").lower() == "true"
+MAX_BATCH_SIZE = int(os.getenv("CLIP_MAX_BATCH_SIZE", "32"))
+MAX_BATCH_WAIT_MS = float(os.getenv("CLIP_MAX_BATCH_WAIT_MS", "2"))
+# Index variant built by preprocess/clip/clip_embedding.py, e.g. "int8", "pq_rerank" or "ivf_ondisk" (empty for float32)
+INDEX_VARIANT = os.getenv("CLIP_INDEX_VARIANT", "")
+# Hamming first pass over the binary index (built with --binary) followed by a float re-rank
+USE_BINARY_INDEX = os.getenv("CLIP_USE_BINARY_INDEX", "false").lower() == "true"
+BINARY_CANDIDATES = int(os.getenv("CLIP_BINARY_CANDIDATES", "100"))
+# Clusters scanned per query by an IVF index, e.g. the "ivf_ondisk" variant (0 keeps the value stored at build time)
+NPROBE = int(os.getenv("CLIP_NPROBE", "0"))
+# Time allowed to download an image added through live ingestion
+IMAGE_FETCH_TIMEOUT_S = float(os.getenv("CLIP_IMAGE_FETCH_TIMEOUT_S", "30"))
+
+# Global text encoder; the retriever (index and metadata) is cached per index bundle under "clip"
+_text_encoder = None
+_batcher = None
+_text_encoder_lock = threading.Lock()
+_retriever_lock = threading.Lock()
+# Image encoder, loaded on the first image added through live ingestion (see retreivers/ingestion.py)
+_image_encoder = None
+_image_encoder_lock = threading.Lock()
+
+def get_index_path(variant: str = INDEX_VARIANT) -> str:
+    """Get the CLIP FAISS index path for an index variant, in the current index bundle."""
+    if not variant:
+        return bundles.resolve(CLIP_INDEX_PATH)
+    return bundles.resolve(os.path.join(CLIP_DIR, f"clip_index_{variant}.faiss"))
+
+def get_shard_source() -> sharding.Source:
+    """Get the shard source of CLIP: its float32 index whatever variant is served, as shards copy vectors."""
+    return ("faiss", get_index_path(""), bundles.resolve(CLIP_METADATA_PATH))
+
+def _load_text_encoder():
+    """Load the CLIP text encoder, and its batcher when enabled, if not already loaded."""
+    global _text_encoder, _batcher
+    with _text_encoder_lock:
+        if _text_encoder is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            if NUM_ENCODER_WORKERS > 0:
+                text_encoder = EncoderWorkerPool(
+                    "clip", MODEL_NAME, ENCODER_BACKEND, NUM_ENCODER_WORKERS, device,
+                    cpu_sets=get_worker_cpu_sets("clip")
+                )
+            else:
+                text_encoder = load_clip_text_encoder(MODEL_NAME, ENCODER_BACKEND, device)
+            if USE_BATCHING:
+                _batcher = BatchingEncoder(text_encoder, MAX_BATCH_SIZE, MAX_BATCH_WAIT_MS, name="clip")
+            _text_encoder = text_encoder
+    return _text_encoder, _batcher
+
+def _encode_text(text_encoder, batcher: BatchingEncoder, query: str) -> np.ndarray:
+    """Get the normalized CLIP text embedding of a query, of shape (1, dimension)."""
+    if batcher is not None:
+        return batcher.encode(query).reshape(1, -1)
+    return text_encoder.encode([query], normalize_embeddings=True)
 
 class CLIPRetriever:
-    def __init__(self):
-        """Initialize CLIP retriever with model, processor, index and metadata."""
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model, self.preprocess = clip.load(MODEL_NAME, device=self.device)
+    def __init__(self, text_encoder, batcher: BatchingEncoder = None):
+        """Initialize CLIP retriever with a text encoder and the index and metadata of the current bundle."""
+        self.text_encoder = text_encoder
+        self.batcher = batcher
         
         # Load FAISS index
-        self.index = faiss.read_index(CLIP_INDEX_PATH)
+        self.index = ondisk_index.read_index(get_index_path(), NPROBE)
         
         # Load metadata
-        with open(CLIP_METADATA_PATH, 'r') as f:
+        with open(bundles.resolve(CLIP_METADATA_PATH), 'r') as f:
             self.metadata = json.load(f)
+        
+        # Optional binary first pass
+        self.binary_index = None
+        self._raw_index = None
+        self._vectors = None
+        if USE_BINARY_INDEX:
+            binary_index_path = bundles.resolve(CLIP_BINARY_INDEX_PATH)
+            if os.path.exists(binary_index_path):
+                self.binary_index = faiss.read_index_binary(binary_index_path)
+            else:
+                logger.warning("Missing CLIP binary index, using exact search")
+    
+    def get_raw_index(self) -> faiss.Index:
+        """Get the float32 index of the raw vectors: the served index, or the one next to the served variant."""
+        if self._raw_index is None:
+            if INDEX_VARIANT:
+                ondisk_index.check_in_memory(self.index, "Exact rescoring of stored vectors")
+                self._raw_index = read_raw_index(get_index_path(""), self.index)
+            else:
+                self._raw_index = self.index
+        return self._raw_index
+
+    def get_vectors(self) -> np.ndarray:
+        """Get the raw float vectors, in metadata order (exact even when a variant is served)."""
+        if self._vectors is None:
+            self._vectors = ondisk_index.reconstruct_all(self.get_raw_index())
+        return self._vectors
             
     def _get_text_embedding(self, query: str) -> np.ndarray:
         """Get text embedding for the query using CLIP."""
-        text = clip.tokenize([query]).to(self.device)
-        
-        with torch.no_grad():
-            text_features = self.model.encode_text(text)
-            text_features = text_features / text_features.norm(dim=-1, keepdim=True)
-            text_features = text_features.cpu().numpy()
-            
-        return text_features.astype('float32')
+        return _encode_text(self.text_encoder, self.batcher, query)
     
     def get_top_image_metadata(self, query: str, k: int = 1) -> List[Dict[str, Any]]:
         """
@@ -54,22 +144,108 @@ class CLIPRetriever:
         """
         try:
             # Get text embedding
-            query_embedding = self._get_text_embedding(query)
+            with metrics.time_stage("clip", "encode"):
+                query_embedding = self._get_text_embedding(query)
             
             # Search in FAISS index
-            distances, indices = self.index.search(query_embedding, k)
+            with metrics.time_stage("clip", "search"):
+                if sharding.is_enabled():
+                    indices = sharding.search(get_shard_source(), query_embedding[0], k)
+                elif self.binary_index is not None:
+                    indices = search_binary_rerank(
+                        self.binary_index, self.get_vectors(), query_embedding, k, BINARY_CANDIDATES
+                    )
+                else:
+                    _, indices = self.index.search(query_embedding, k)
+                    indices = indices[0]
             
             # Get metadata for the retrieved indices
-            results = []
-            for idx in indices[0]:
-                if idx < len(self.metadata):
-                    results.append(self.metadata[idx])
+            with metrics.time_stage("clip", "metadata"):
+                results = []
+                for idx in indices:
+                    if idx < len(self.metadata):
+                        results.append(self.metadata[idx])
                     
             return results
         except Exception as e:
             logger.error(f"Error retrieving images for query '{query}': {str(e)}")
+            metrics.record_error(str(e))
             return []
 
+def get_retriever() -> CLIPRetriever:
+    """Load the CLIP retriever of the current bundle if not already loaded."""
+    cache = bundles.cache("clip")
+    metrics.record_cache("clip_retriever", "retriever" in cache)
+    if "retriever" not in cache:
+        # Concurrent first requests load the index once
+        with _retriever_lock:
+            if "retriever" not in cache:
+                cache["retriever"] = CLIPRetriever(*_load_text_encoder())
+    return cache["retriever"]
+
+def get_loaded_index():
+    """Get the CLIP FAISS index if the current bundle's retriever is loaded, without loading it."""
+    retriever = bundles.cache("clip").get("retriever")
+    return retriever.index if retriever is not None else None
+
+def get_loaded_item_counts() -> Dict[str, Tuple[int, int]]:
+    """
+    Get the rows of the loaded index and the entries of its metadata, without loading them.
+
+    Returns:
+        Dict[str, Tuple[int, int]]: Repository-relative metadata path -> (index rows, metadata entries)
+    """
+    retriever = bundles.cache("clip").get("retriever")
+    if retriever is None:
+        return {}
+    return {CLIP_METADATA_PATH: (retriever.index.ntotal, len(retriever.metadata))}
+
+def get_batching_stats() -> Dict[str, float]:
+    """Get the micro-batching metrics of the CLIP encoder (empty when batching is off or idle)."""
+    if _batcher is None:
+        return {}
+    return _batcher.get_stats()
+
+def get_query_embedding(query: str) -> np.ndarray:
+    """
+    Get the normalized CLIP text embedding for a query, without loading the index (e.g. on a coordinator).
+    
+    Args:
+        query (str): The search query
+        
+    Returns:
+        np.ndarray: Query embedding of shape (dimension,)
+    """
+    return _encode_text(*_load_text_encoder(), query)[0]
+
+def get_image_embedding(image_url: str) -> np.ndarray:
+    """
+    Download an image and get its normalized CLIP embedding, as preprocess/clip/clip_embedding.py does.
+    
+    Args:
+        image_url (str): URL of the image
+        
+    Returns:
+        np.ndarray: Image embedding of shape (dimension,)
+    """
+    import httpx
+    from PIL import Image
+
+    global _image_encoder
+    with _image_encoder_lock:
+        if _image_encoder is None:
+            # A text encoder built from the full model (no text tower artifact) already holds the vision tower
+            loaded_model = getattr(_text_encoder, "model", None)
+            vision_tower = getattr(loaded_model, "visual", None)
+            device = next(vision_tower.parameters()).device.type if vision_tower is not None else (
+                "cuda" if torch.cuda.is_available() else "cpu"
+            )
+            _image_encoder = TorchCLIPImageEncoder(MODEL_NAME, device, vision_tower)
+    response = httpx.get(image_url, timeout=IMAGE_FETCH_TIMEOUT_S, follow_redirects=True)
+    response.raise_for_status()
+    image = Image.open(io.BytesIO(response.content))
+    return _image_encoder.encode([image])[0]
+
 def get_top_image_metadata(query: str, k: int = 1) -> List[Dict[str, Any]]:
     """
     Get the metadata of the top k images for a given query.
@@ -81,7 +257,7 @@ def get_top_image_metadata(query: str, k: int = 1) -> List[Dict[str, Any]]:
     Returns:
         List[Dict[str, Any]]: List of metadata for top k images
     """
-    retriever = CLIPRetriever()
+    retriever = get_retriever()
     return retriever.get_top_image_metadata(query, k)
 
 def get_multiple_images_metadata(query: str, k: int = 5) -> List[Dict[str, Any]]:
@@ -0,0 +1,114 @@
+"""
+The CLIP text tower as a standalone module.
+
+Query encoding only needs CLIP's text transformer, so the model artifacts built
+by preprocess/models/save_artifacts.py keep only its weights, under half of the
+full model. This module rebuilds the text tower from them without
+constructing or reading the vision tower. Its encode_text matches
+CLIP.encode_text.
+"""
+
+from typing import Any, Dict
+
+import torch
+from clip.model import LayerNorm, Transformer
+
+# State dict entries of the text tower in a full CLIP model
+TEXT_TOWER_PREFIXES = ("transformer.", "token_embedding.", "positional_embedding", "ln_final.", "text_projection")
+
+def build_attention_mask(context_length: int) -> torch.Tensor:
+    """Causal mask of the text transformer, as CLIP builds it."""
+    mask = torch.empty(context_length, context_length)
+    mask.fill_(float("-inf"))
+    mask.triu_(1)
+    return mask
+
+def get_text_tower_state_dict(model: torch.nn.Module) -> Dict[str, torch.Tensor]:
+    """Get the text tower weights of a full CLIP model."""
+    return {
+        name: tensor for name, tensor in model.state_dict().items() if name.startswith(TEXT_TOWER_PREFIXES)
+    }
+
+def get_text_tower_config(state_dict: Dict[str, torch.Tensor]) -> Dict[str, int]:
+    """Infer the text tower hyperparameters from its weights, as clip.model.build_model does."""
+    width = state_dict["ln_final.weight"].shape[0]
+    return {
+        "embed_dim": state_dict["text_projection"].shape[1],
+        "context_length": state_dict["positional_embedding"].shape[0],
+        "vocab_size": state_dict["token_embedding.weight"].shape[0],
+        "width": width,
+        "heads": width // 64,
+        "layers": len({name.split(".")[2] for name in state_dict if name.startswith("transformer.resblocks")}),
+    }
+
+class CLIPTextTower(torch.nn.Module):
+    """CLIP's text transformer and projection, without the vision tower."""
+
+    def __init__(self, embed_dim: int, context_length: int, vocab_size: int, width: int, heads: int, layers: int):
+        super().__init__()
+        self.context_length = context_length
+        self.transformer = Transformer(width, layers, heads, attn_mask=build_attention_mask(context_length))
+        self.token_embedding = torch.nn.Embedding(vocab_size, width)
+        self.positional_embedding = torch.nn.Parameter(torch.empty(context_length, width))
+        self.ln_final = LayerNorm(width)
+        self.text_projection = torch.nn.Parameter(torch.empty(width, embed_dim))
+
+    @property
+    def dtype(self) -> torch.dtype:
+        return self.text_projection.dtype
+
+    def encode_text(self, text: torch.Tensor) -> torch.Tensor:
+        """Encode tokenized text, as CLIP.encode_text."""
+        x = self.token_embedding(text).type(self.dtype)
+        x = x + self.positional_embedding.type(self.dtype)
+        x = x.permute(1, 0, 2)
+        x = self.transformer(x)
+        x = x.permute(1, 0, 2)
+        x = self.ln_final(x).type(self.dtype)
+        # Features of the end-of-text token, the highest token id in each sequence
+        return x[torch.arange(x.shape[0]), text.argmax(dim=-1)] @ self.text_projection
+
+    def forward(self, text: torch.Tensor) -> torch.Tensor:
+        return self.encode_text(text)
+
+def save_text_tower(model: torch.nn.Module, path: str) -> Dict[str, Any]:
+    """
+    Save the text tower of a full CLIP model in float32.
+
+    Args:
+        model (torch.nn.Module): CLIP model, e.g. from clip.load
+        path (str): File to write
+
+    Returns:
+        Dict[str, Any]: The text tower config
+    """
+    state_dict = {name: tensor.float().cpu() for name, tensor in get_text_tower_state_dict(model).items()}
+    config = get_text_tower_config(state_dict)
+    torch.save({"config": config, "state_dict": state_dict}, path)
+    return config
+
+def load_text_tower(path: str, device: str = "cpu") -> CLIPTextTower:
+    """
+    Load a text tower saved by save_text_tower.
+
+    The file is memory-mapped and the module is built on the meta device, so the
+    weights are neither randomly initialised nor copied before use.
+
+    Args:
+        path (str): File written by save_text_tower
+        device (str): Device to move the tower to
+
+    Returns:
+        CLIPTextTower: The tower in eval mode
+    """
+    checkpoint = torch.load(path, map_location="cpu", weights_only=True, mmap=True)
+    config = checkpoint["config"]
+    with torch.device("meta"):
+        tower = CLIPTextTower(**config)
+    tower.load_state_dict(checkpoint["state_dict"], assign=True)
+
+    # The attention mask is a plain attribute, not a parameter, so it was left on the meta device
+    mask = build_attention_mask(config["context_length"])
+    for block in tower.transformer.resblocks:
+        block.attn_mask = mask
+    return tower.to(device).eval()
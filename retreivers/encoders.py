@@ -0,0 +1,237 @@
+"""
+Pluggable query encoder backends for the BGE and CLIP text encoders.
+
+Every encoder exposes ``encode(texts, normalize_embeddings=True)`` with the
+same contract as ``SentenceTransformer.encode``: a single string gives a 1-D
+vector and a list of strings gives a 2-D array.
+
+Backends:
+    torch      the original SentenceTransformer / CLIP PyTorch models
+    onnx       graphs exported by preprocess/onnx/export_encoders.py, run with ONNX Runtime
+    onnx_int8  the same graphs with dynamically int8-quantised weights
+
+The torch backend loads the local model artifacts saved by
+preprocess/models/save_artifacts.py when they exist for the requested model,
+and otherwise resolves the weights through the Hugging Face / CLIP download
+caches. With MODELS_OFFLINE=true it loads from the artifacts only.
+"""
+
+import json
+import logging
+import os
+from typing import Any, List, Optional, Union
+
+import numpy as np
+
+from retreivers.resources import ONNX_NUM_THREADS
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants
+ONNX_DIR = "preprocess/onnx/models"
+BGE_TOKENIZER_DIR = os.path.join(ONNX_DIR, "bge_tokenizer")
+BACKENDS = ("torch", "onnx", "onnx_int8")
+# Pinned local model artifacts (see preprocess/models/save_artifacts.py)
+ARTIFACT_DIR = os.getenv("MODEL_ARTIFACT_DIR", "preprocess/models/artifacts")
+ARTIFACT_MANIFEST = "manifest.json"
+# Never download or resolve weights through the hub caches, load the artifacts only
+MODELS_OFFLINE = os.getenv("MODELS_OFFLINE", "false").lower() == "true"
+
+Texts = Union[str, List[str]]
+
+def get_onnx_path(name: str, backend: str) -> str:
+    """Get the exported ONNX graph path of an encoder ("bge" or "clip_text") for a backend."""
+    suffix = "_int8" if backend == "onnx_int8" else ""
+    return os.path.join(ONNX_DIR, f"{name}{suffix}.onnx")
+
+def get_artifact_path(name: str, model_name: str) -> Optional[str]:
+    """
+    Get the local artifact of an encoder ("bge", "clip_text" or "clip_image") if it was saved for model_name.
+
+    Raises:
+        FileNotFoundError: In offline mode, when there is no artifact for model_name
+    """
+    manifest_path = os.path.join(ARTIFACT_DIR, ARTIFACT_MANIFEST)
+    entry = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as f:
+            entry = json.load(f).get(name)
+    if entry is not None and entry["model_name"] == model_name:
+        path = os.path.join(ARTIFACT_DIR, entry["path"])
+        if os.path.exists(path):
+            logger.info(f"Loading {name} encoder from the local artifact {path}")
+            return path
+    if MODELS_OFFLINE:
+        raise FileNotFoundError(
+            f"No {name} artifact for {model_name} in {ARTIFACT_DIR}, run preprocess/models/save_artifacts.py first"
+        )
+    return None
+
+def _normalize(embeddings: np.ndarray) -> np.ndarray:
+    """L2-normalize embeddings along the last axis."""
+    return embeddings / np.linalg.norm(embeddings, axis=-1, keepdims=True)
+
+def _create_session(model_path: str):
+    """Create an ONNX Runtime CPU session with full graph optimisations."""
+    try:
+        import onnxruntime as ort
+    except ImportError as e:
+        raise ImportError("The onnx encoder backends require onnxruntime (pip install onnxruntime)") from e
+
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(
+            f"ONNX model not found at {model_path}, run preprocess/onnx/export_encoders.py first"
+        )
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if ONNX_NUM_THREADS:
+        options.intra_op_num_threads = ONNX_NUM_THREADS
+    return ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+
+class OnnxBGEEncoder:
+    """BGE encoder running the exported CLS-pooled transformer with ONNX Runtime."""
+
+    def __init__(self, backend: str = "onnx"):
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(BGE_TOKENIZER_DIR)
+        self.session = _create_session(get_onnx_path("bge", backend))
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+    def encode(self, texts: Texts, normalize_embeddings: bool = True, **kwargs) -> np.ndarray:
+        """Encode one text or a batch of texts."""
+        single = isinstance(texts, str)
+        batch = self.tokenizer(
+            [texts] if single else list(texts),
+            padding=True, truncation=True, max_length=512, return_tensors="np"
+        )
+        feeds = {name: batch[name].astype(np.int64) for name in self.input_names}
+        embeddings = self.session.run(None, feeds)[0]
+        if normalize_embeddings:
+            embeddings = _normalize(embeddings)
+        return embeddings[0] if single else embeddings
+
+class TorchCLIPTextEncoder:
+    """CLIP text encoder running the PyTorch model, or only its text tower when loaded from an artifact."""
+
+    def __init__(self, model_name: str, device: str = "cpu"):
+        self.device = device
+        artifact_path = get_artifact_path("clip_text", model_name)
+        if artifact_path is not None:
+            from retreivers.clip_text import load_text_tower
+            self.model = load_text_tower(artifact_path, device)
+        else:
+            import clip
+            self.model, _ = clip.load(model_name, device=device)
+
+    def encode(self, texts: Texts, normalize_embeddings: bool = True, **kwargs) -> np.ndarray:
+        """Encode one text or a batch of texts."""
+        import clip
+        import torch
+
+        single = isinstance(texts, str)
+        tokens = clip.tokenize([texts] if single else list(texts)).to(self.device)
+        with torch.no_grad():
+            text_features = self.model.encode_text(tokens)
+            if normalize_embeddings:
+                text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+        embeddings = text_features.cpu().numpy().astype('float32')
+        return embeddings[0] if single else embeddings
+
+class TorchCLIPImageEncoder:
+    """CLIP image encoder running the vision tower only, for images added to the index while serving."""
+
+    def __init__(self, model_name: str, device: str = "cpu", vision_tower: Optional[Any] = None):
+        """
+        Args:
+            model_name (str): CLIP model name
+            device (str): Device of the vision tower
+            vision_tower (Optional[Any]): Vision tower of an already loaded full CLIP model to reuse,
+                otherwise it is loaded from its local artifact, or from the full model
+        """
+        from retreivers.clip_image import get_preprocess, load_vision_tower
+
+        self.device = device
+        if vision_tower is None:
+            artifact_path = get_artifact_path("clip_image", model_name)
+            if artifact_path is not None:
+                vision_tower = load_vision_tower(artifact_path, device)
+            else:
+                import clip
+                vision_tower = clip.load(model_name, device=device)[0].visual
+        self.vision_tower = vision_tower
+        self.preprocess = get_preprocess(vision_tower)
+
+    def encode(self, images: List[Any], normalize_embeddings: bool = True, **kwargs) -> np.ndarray:
+        """Encode a batch of PIL images."""
+        import torch
+
+        batch = torch.stack([self.preprocess(image) for image in images]).to(self.device)
+        with torch.no_grad():
+            # As CLIP.encode_image
+            image_features = self.vision_tower(batch.type(self.vision_tower.conv1.weight.dtype))
+            if normalize_embeddings:
+                image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+        return image_features.cpu().numpy().astype('float32')
+
+class OnnxCLIPTextEncoder:
+    """CLIP text encoder running the exported text tower with ONNX Runtime."""
+
+    def __init__(self, backend: str = "onnx"):
+        self.session = _create_session(get_onnx_path("clip_text", backend))
+        self.input_name = self.session.get_inputs()[0].name
+
+    def encode(self, texts: Texts, normalize_embeddings: bool = True, **kwargs) -> np.ndarray:
+        """Encode one text or a batch of texts."""
+        import clip
+
+        single = isinstance(texts, str)
+        tokens = clip.tokenize([texts] if single else list(texts)).numpy()
+        embeddings = self.session.run(None, {self.input_name: tokens})[0].astype('float32')
+        if normalize_embeddings:
+            embeddings = _normalize(embeddings)
+        return embeddings[0] if single else embeddings
+
+def load_bge_encoder(model_name: str, backend: str = "torch"):
+    """
+    Load a BGE encoder for a backend.
+
+    Args:
+        model_name (str): SentenceTransformer model name used by the torch backend
+        backend (str): One of "torch", "onnx" or "onnx_int8"
+
+    Returns:
+        An encoder exposing encode(texts, normalize_embeddings=True)
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown encoder backend '{backend}', expected one of {BACKENDS}")
+    if backend == "torch":
+        artifact_path = get_artifact_path("bge", model_name)
+        if MODELS_OFFLINE:
+            os.environ["HF_HUB_OFFLINE"] = "1"
+        from sentence_transformers import SentenceTransformer
+        if artifact_path is not None:
+            return SentenceTransformer(artifact_path, local_files_only=True)
+        return SentenceTransformer(model_name)
+    return OnnxBGEEncoder(backend)
+
+def load_clip_text_encoder(model_name: str, backend: str = "torch", device: str = "cpu"):
+    """
+    Load a CLIP text encoder for a backend.
+
+    Args:
+        model_name (str): CLIP model name used by the torch backend
+        backend (str): One of "torch", "onnx" or "onnx_int8"
+        device (str): Device for the torch backend
+
+    Returns:
+        An encoder exposing encode(texts, normalize_embeddings=True)
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown encoder backend '{backend}', expected one of {BACKENDS}")
+    if backend == "torch":
+        return TorchCLIPTextEncoder(model_name, device)
+    return OnnxCLIPTextEncoder(backend)
@@ -0,0 +1,223 @@
+"""
+Two-stage hybrid retriever.
+
+Stage one gathers a few hundred candidates cheaply, either from the sparse
+BM25/TF-IDF engines or from a coarse IVF probe over the BGE vectors. Stage two
+rescores only those candidates with exact BGE (and optionally CLIP) similarity
+and fuses the dense rankings with reciprocal rank fusion.
+"""
+
+import faiss
+import logging
+from typing import List, Dict, Any, Literal, Optional, Tuple
+import numpy as np
+
+from retreivers import bge_retreiver, bm25_retreiver, bundles, clip_retreiver, metrics, tfidf_retreiver
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants
+NUM_CANDIDATES = 200
+RRF_K = 60
+ANN_NPROBE = 4
+
+# Image URL lookups ("hybrid_url_to_row"), exact CLIP vectors ("hybrid_clip") and coarse
+# indices ("hybrid_ann_indices") are cached per index bundle
+
+def _load_structure(structure_num: int) -> bool:
+    """Cache the image URL lookup for a structure."""
+    url_to_row = bundles.cache("hybrid_url_to_row")
+    if structure_num in url_to_row:
+        return True
+
+    index, metadata = bge_retreiver.get_structure_index_and_metadata(structure_num)
+    if index is None or not metadata:
+        logger.error(f"Structure {structure_num} not available")
+        metrics.record_error(f"Structure {structure_num} not available")
+        return False
+
+    structure_url_to_row = {}
+    for row, item in enumerate(metadata):
+        structure_url_to_row.setdefault(item.get("image_url"), row)
+    url_to_row[structure_num] = structure_url_to_row
+    return True
+
+def _load_clip_vectors() -> Tuple[np.ndarray, Dict[str, int]]:
+    """Cache the exact CLIP image vectors and the image URL lookup."""
+    cache = bundles.cache("hybrid_clip")
+    if "vectors" not in cache:
+        retriever = clip_retreiver.get_retriever()
+        clip_url_to_row = {}
+        for row, item in enumerate(retriever.metadata):
+            clip_url_to_row.setdefault(item.get("image_url"), row)
+        cache["url_to_row"] = clip_url_to_row
+        cache["vectors"] = retriever.get_vectors()
+    return cache["vectors"], cache["url_to_row"]
+
+def _load_ann_index(structure_num: int) -> faiss.Index:
+    """Build the coarse IVF index used for ANN candidate generation."""
+    ann_indices = bundles.cache("hybrid_ann_indices")
+    if structure_num not in ann_indices:
+        vectors = bge_retreiver.get_structure_vectors(structure_num)
+        # FAISS wants roughly 39 training points per centroid
+        nlist = max(1, min(int(np.sqrt(len(vectors))), len(vectors) // 39))
+        quantizer = faiss.IndexFlatIP(vectors.shape[1])
+        index = faiss.IndexIVFFlat(quantizer, vectors.shape[1], nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        index.add(vectors)
+        index.nprobe = min(ANN_NPROBE, nlist)
+        ann_indices[structure_num] = index
+    return ann_indices[structure_num]
+
+def _sparse_candidates(query: str, structure_num: int, num_candidates: int) -> List[int]:
+    """Get candidate BGE rows from the BM25 and TF-IDF engines."""
+    candidate_metadata = bm25_retreiver.get_multiple_images_metadata(
+        query, structure_num, "without_stopwords", num_candidates
+    )
+
+    # Shallow copy: the loaded retriever is shared between requests
+    tfidf = tfidf_retreiver.load_retriever(structure_num).copy(update={"k": num_candidates})
+    candidate_metadata += [doc.metadata for doc in tfidf.invoke(query)]
+
+    rows = []
+    seen = set()
+    for item in candidate_metadata:
+        row = bundles.cache("hybrid_url_to_row")[structure_num].get(item.get("image_url"))
+        if row is not None and row not in seen:
+            seen.add(row)
+            rows.append(row)
+    return rows
+
+def _ann_candidates(query_embedding: np.ndarray, structure_num: int, num_candidates: int) -> List[int]:
+    """Get candidate BGE rows from a coarse IVF probe."""
+    index = _load_ann_index(structure_num)
+    _, indices = index.search(query_embedding.reshape(1, -1), num_candidates)
+    return [int(idx) for idx in indices[0] if idx >= 0]
+
+def _reciprocal_rank_fusion(rankings: List[List[int]]) -> Dict[int, float]:
+    """Fuse several rankings of the same candidates into one score per candidate."""
+    scores = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking):
+            scores[row] = scores.get(row, 0.0) + 1.0 / (RRF_K + rank + 1)
+    return scores
+
+def _search_structure(
+    query: str,
+    query_embedding: np.ndarray,
+    clip_embedding: Optional[np.ndarray],
+    structure_num: int,
+    k: int,
+    candidate_source: Literal["sparse", "ann"],
+    num_candidates: int
+) -> List[Dict[str, Any]]:
+    """Generate candidates for one structure and rerank them with dense similarity."""
+    if not _load_structure(structure_num):
+        return []
+    _, metadata = bge_retreiver.get_structure_index_and_metadata(structure_num)
+
+    if candidate_source == "sparse":
+        try:
+            candidates = _sparse_candidates(query, structure_num, num_candidates)
+        except Exception as e:
+            logger.warning(f"Sparse candidate generation failed for structure {structure_num}, using ANN: {str(e)}")
+            candidates = []
+        if not candidates:
+            candidates = _ann_candidates(query_embedding, structure_num, num_candidates)
+    else:
+        candidates = _ann_candidates(query_embedding, structure_num, num_candidates)
+
+    if not candidates:
+        return []
+
+    # Exact BGE similarity on the candidates only
+    candidates = np.array(candidates)
+    bge_scores = bge_retreiver.get_structure_vectors(structure_num)[candidates] @ query_embedding
+    rankings = [candidates[np.argsort(-bge_scores)].tolist()]
+
+    # Optional exact CLIP similarity on the same candidates
+    if clip_embedding is not None:
+        clip_vectors, clip_url_to_row = _load_clip_vectors()
+        clip_rows = [clip_url_to_row.get(metadata[row].get("image_url"), -1) for row in candidates]
+        present = np.array([clip_row >= 0 for clip_row in clip_rows])
+        if present.any():
+            clip_scores = clip_vectors[np.array(clip_rows)[present]] @ clip_embedding
+            rankings.append(candidates[present][np.argsort(-clip_scores)].tolist())
+
+    fused = _reciprocal_rank_fusion(rankings)
+    top_rows = sorted(fused, key=fused.get, reverse=True)[:k]
+    return [metadata[row] for row in top_rows]
+
+def get_multiple_images_metadata(
+    query: str,
+    structure_num: int,
+    k: int = 5,
+    candidate_source: Literal["sparse", "ann"] = "sparse",
+    num_candidates: int = NUM_CANDIDATES,
+    use_clip: bool = False
+) -> List[Dict[str, Any]]:
+    """
+    Get the metadata of multiple top images for a given query using a specific structure.
+
+    Args:
+        query (str): The search query
+        structure_num (int): The structure number (1-5)
+        k (int): Number of results to return
+        candidate_source (str): Either "sparse" (BM25 + TF-IDF) or "ann" (coarse IVF probe)
+        num_candidates (int): Number of candidates to rescore per engine
+        use_clip (bool): Whether to fuse CLIP similarity into the rerank
+
+    Returns:
+        List[Dict[str, Any]]: List of metadata for top k images
+    """
+    return get_multiple_images_metadata_all_structures(
+        query, k, candidate_source, num_candidates, use_clip, structures=[structure_num]
+    ).get(structure_num, [])
+
+def get_multiple_images_metadata_all_structures(
+    query: str,
+    k: int = 5,
+    candidate_source: Literal["sparse", "ann"] = "sparse",
+    num_candidates: int = NUM_CANDIDATES,
+    use_clip: bool = False,
+    structures: Optional[List[int]] = None
+) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Get the metadata of multiple top images for a given query using all structures.
+
+    The query is encoded once and reused for every structure.
+
+    Args:
+        query (str): The search query
+        k (int): Number of results to return per structure
+        candidate_source (str): Either "sparse" (BM25 + TF-IDF) or "ann" (coarse IVF probe)
+        num_candidates (int): Number of candidates to rescore per engine
+        use_clip (bool): Whether to fuse CLIP similarity into the rerank
+        structures (Optional[List[int]]): Structures to search (default: 1-5)
+
+    Returns:
+        Dict[int, List[Dict[str, Any]]]: Dictionary mapping structure numbers to their top k image metadata
+    """
+    structures = structures or list(range(1, 6))
+    results = {structure_num: [] for structure_num in structures}
+    try:
+        with metrics.time_stage("hybrid", "encode"):
+            query_embedding = bge_retreiver.get_query_embedding(query)
+
+            clip_embedding = None
+            if use_clip:
+                _load_clip_vectors()
+                clip_embedding = clip_retreiver.get_query_embedding(query)
+
+        for structure_num in structures:
+            with metrics.time_structure("hybrid", structure_num):
+                results[structure_num] = _search_structure(
+                    query, query_embedding, clip_embedding, structure_num,
+                    k, candidate_source, num_candidates
+                )
+    except Exception as e:
+        logger.error(f"Error retrieving hybrid images for query '{query}': {str(e)}")
+        metrics.record_error(str(e))
+    return results
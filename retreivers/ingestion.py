@@ -0,0 +1,728 @@
+"""
+Live ingestion: adding and removing images without rebuilding the indices.
+
+An added image is embedded once and appended to every index the served
+retrievers search, in the bundle that serves queries: the BGE index of each of
+its text structures, the CLIP image index, the binary indices when loaded, and
+the BM25 and TF-IDF documents of each structure. Every retriever maps a result
+row to its metadata entry by position, so FAISS rows stay positional and each
+index keeps a map from image id to row instead of a FAISS ID map. An image's id
+is derived from its URL (see get_image_id).
+
+A removed image is tombstoned. Its rows stay in the indices until the next
+compaction, and its results are dropped from the retriever outputs: each
+retriever is asked for k plus the number of tombstones and the results are cut
+back to k (see run_search). The sparse statistics follow both changes right
+away. BM25 document frequencies, corpus size and average document length, and
+TF-IDF document frequencies and idf weights, are those of the live documents,
+so sparse scores equal those of a rebuild from the same items. Compaction
+removes the tombstoned rows from every index.
+
+Searches hold the bundle's read lock and changes hold its write lock, so a
+query never sees an index half updated. Caches derived from the indices (the
+hybrid and topic-routed lookups, the vectors kept for binary re-ranking) are
+dropped on each change and rebuilt by the next query.
+
+Ingestion updates full in-memory indices only. It is not available with
+sharded search or with on-disk IVF indices.
+"""
+
+import abc
+import hashlib
+import logging
+import math
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+from retreivers import bundles, sharding
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants
+STRUCTURES = range(1, 6)
+# Indices updated for each retriever served by /get-images
+METHOD_ENGINES = {
+    "bge": ["bge"],
+    "clip": ["clip"],
+    "tfidf": ["tfidf"],
+    "bm25_with_stopwords": ["bm25_with_stopwords"],
+    "bm25_without_stopwords": ["bm25_without_stopwords"],
+    "hybrid": ["bge", "clip", "bm25_without_stopwords", "tfidf"],
+    "topic_routed": ["bge"],
+}
+# Per-bundle caches derived from the indices, rebuilt by the next query after a change
+DERIVED_CACHES = [
+    "bge_vectors", "hybrid_url_to_row", "hybrid_clip", "hybrid_ann_indices", "topic_centroids", "topic_partitions"
+]
+DESCRIPTION_FIELDS = [
+    "topic_mapped_image_description", "context_free_description", "topic_definition", "subtopic_definition"
+]
+
+# NLTK data of the BM25 tokenizer (as preprocess/bm25/bm_25_tokenizer.py downloads): package -> resource
+NLTK_DATA = {"punkt_tab": "tokenizers/punkt_tab", "stopwords": "corpora/stopwords"}
+
+# Serialises changes to the indices with each other and with bundle swaps
+change_lock = threading.RLock()
+
+def get_image_id(image_url: str) -> str:
+    """Get the id of an image, derived from its URL."""
+    return hashlib.sha1(image_url.encode("utf-8")).hexdigest()[:16]
+
+def get_engines(methods: List[str]) -> List[str]:
+    """Get the indices to update for the served retrievers, e.g. ["bge", "clip", "tfidf"]."""
+    engines = []
+    for method in methods:
+        for engine in METHOD_ENGINES.get(method, []):
+            if engine not in engines:
+                engines.append(engine)
+    return engines
+
+def get_unavailable_reason() -> Optional[str]:
+    """Get why ingestion cannot run in this process, or None if it can."""
+    if sharding.is_enabled():
+        return "Ingestion is not available with sharded search (RETRIEVER_SHARDS > 1)"
+    if sharding.get_node_shard()[1] > 1:
+        return "Ingestion is not available on a shard node (NODE_SHARD)"
+    return None
+
+class ReadWriteLock:
+    """Any number of readers or one writer; a waiting writer holds off new readers."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def reading(self) -> Iterator[None]:
+        """Hold the lock shared for the block."""
+        with self._condition:
+            while self._writing or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def writing(self) -> Iterator[None]:
+        """Hold the lock exclusively for the block."""
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+# Texts and metadata of an item, as built by the preprocess scripts
+
+def get_structure_texts(item: Dict[str, Any]) -> Dict[int, str]:
+    """Get the text of each structure of an item, by structure number (as preprocess/bge/bge_embedding.py)."""
+    topic_mapped_image_description = item.get("topic_mapped_image_description", "")
+    context_free_description = item.get("context_free_description", "")
+    topic_definition = item.get("topic_definition", "")
+    subtopic_definition = item.get("subtopic_definition", "")
+    return {
+        1: context_free_description,
+        2: topic_mapped_image_description,
+        3: f"{topic_definition}, {subtopic_definition}",
+        4: f"{topic_definition}, {subtopic_definition}, {context_free_description}",
+        5: f"{topic_definition}, {subtopic_definition}, {topic_mapped_image_description}",
+    }
+
+def get_bge_texts(item: Dict[str, Any]) -> Dict[int, str]:
+    """Get the texts an item is embedded with by BGE: every structure with some text."""
+    return {structure_num: text for structure_num, text in get_structure_texts(item).items() if text.strip()}
+
+def _get_sparse_text(item: Dict[str, Any], structure_num: int) -> str:
+    """Get the text of a structure for BM25 and TF-IDF, empty unless all descriptions are set."""
+    if not all(item.get(field, "") for field in DESCRIPTION_FIELDS):
+        return ""
+    return get_structure_texts(item)[structure_num]
+
+def _get_bge_metadata(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Get the metadata of a BGE row (as preprocess/bge/bge_embedding.py)."""
+    metadata = {"image_url": item.get("image_url")}
+    metadata.update({field: item.get(field, "") for field in DESCRIPTION_FIELDS})
+    return metadata
+
+def _get_clip_metadata(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Get the metadata of a CLIP row (as preprocess/clip/clip_embedding.py)."""
+    return {
+        "topic": item.get("topic"),
+        "subtopic": item.get("subtopic"),
+        "image_url": item.get("image_url"),
+        "caption": item.get("caption"),
+        "image_id": item.get("image_id"),
+    }
+
+def _get_sparse_metadata(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Get the metadata of a BM25 document (as preprocess/bm25/bm_25_tokenizer.py)."""
+    metadata = {
+        "topic": item.get("topic"),
+        "subtopic": item.get("subtopic"),
+        "image_url": item.get("image_url"),
+        "caption": item.get("caption"),
+    }
+    metadata.update({field: item.get(field, "") for field in DESCRIPTION_FIELDS})
+    return metadata
+
+def check_tokenizer_data(engines: List[str]) -> None:
+    """
+    Make sure the NLTK data tokenize_bm25 needs is installed when a BM25 engine is updated, downloading it if missing.
+
+    Raises:
+        LookupError: If the data is missing and cannot be downloaded
+    """
+    if not any(engine.startswith("bm25_") for engine in engines):
+        return
+    import nltk
+
+    for package, resource in NLTK_DATA.items():
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            logger.info(f"Downloading the NLTK data '{package}' for the BM25 tokenizer")
+            if not nltk.download(package, quiet=True):
+                raise LookupError(f"The BM25 tokenizer needs the NLTK data '{package}', "
+                                  f"install it with: python -m nltk.downloader {package}")
+
+def tokenize_bm25(text: str, variant: str) -> List[str]:
+    """Tokenize a document for a BM25 variant (as preprocess/bm25/bm_25_tokenizer.py)."""
+    from nltk.corpus import stopwords
+    from nltk.tokenize import word_tokenize
+
+    words = [word for word in word_tokenize(text) if word.isalnum()]
+    if variant == "without_stopwords":
+        stop_words = set(stopwords.words("english"))
+        return [word.lower() for word in words if word.lower() not in stop_words]
+    return [word.lower() for word in words]
+
+def embed_item(item: Dict[str, Any], engines: List[str]) -> Dict[str, Any]:
+    """
+    Embed an item for the dense indices among engines (slow, call without holding any lock).
+
+    Args:
+        item (Dict[str, Any]): The image item, with the fields of preprocess/dataset/image_metadata.json
+        engines (List[str]): Indices to update, from get_engines
+
+    Returns:
+        Dict[str, Any]: "bge" (structure -> vector, as lists) and "clip" (the image vector) when needed
+    """
+    embeddings = {}
+    if "bge" in engines:
+        from retreivers import bge_retreiver
+        texts = get_bge_texts(item)
+        vectors = bge_retreiver.get_text_embeddings(list(texts.values())) if texts else []
+        embeddings["bge"] = {str(structure_num): vector.tolist() for structure_num, vector in zip(texts, vectors)}
+    if "clip" in engines:
+        from retreivers import clip_retreiver
+        embeddings["clip"] = clip_retreiver.get_image_embedding(item["image_url"]).tolist()
+    return embeddings
+
+# Indices
+
+class _Engine(abc.ABC):
+    """One index of the bundle, with the image id of each of its rows."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.row_ids = [get_image_id(image_url) for image_url in self.get_image_urls()]
+        self.rows = {image_id: row for row, image_id in enumerate(self.row_ids)}
+
+    @abc.abstractmethod
+    def get_image_urls(self) -> List[str]:
+        """Get the image URL of each row."""
+
+    @abc.abstractmethod
+    def prepare(self, item: Dict[str, Any], embeddings: Dict[str, Any]) -> Optional[Any]:
+        """Get what add() needs for an item, or None if the item has no row in this index."""
+
+    def add(self, entries: List[Tuple[str, Any]]) -> None:
+        """Append (image id, prepared entry) rows."""
+        for image_id, _ in entries:
+            self.rows[image_id] = len(self.row_ids)
+            self.row_ids.append(image_id)
+
+    def retire(self, rows: List[int]) -> None:
+        """Take tombstoned rows out of the index statistics (their rows stay until compaction)."""
+
+    def remove(self, rows: List[int]) -> None:
+        """Remove retired rows, shifting the rows after them down."""
+        removed = set(rows)
+        self.row_ids = [image_id for row, image_id in enumerate(self.row_ids) if row not in removed]
+        self.rows = {image_id: row for row, image_id in enumerate(self.row_ids)}
+
+def _remove_faiss_rows(index, rows: List[int]) -> None:
+    """Remove rows from a FAISS (or binary) index; a refine index removes them from both of its indices."""
+    import faiss
+
+    selector = faiss.IDSelectorBatch(np.array(rows, dtype=np.int64))
+    if isinstance(index, faiss.IndexRefine):
+        index.base_index.remove_ids(selector)
+        index.refine_index.remove_ids(selector)
+        index.ntotal = index.base_index.ntotal
+    else:
+        index.remove_ids(selector)
+
+class _FaissEngine(_Engine):
+    """A dense index: a FAISS index, its optional binary index and its metadata list."""
+
+    def __init__(self, name: str, index, metadata: List[Dict[str, Any]], binary_index=None,
+                 get_vector: Callable[[Dict[str, Any]], Optional[List[float]]] = None,
+                 get_metadata: Callable[[Dict[str, Any]], Dict[str, Any]] = None, raw_index=None):
+        from retreivers import ondisk_index
+
+        if ondisk_index.is_ivf(index):
+            raise ValueError(f"Ingestion does not support IVF indices ({name}), serve a flat or quantised variant")
+        self.index = index
+        self.metadata = metadata
+        self.binary_index = binary_index
+        # The float32 index kept next to a served variant for exact rescoring
+        self.raw_index = raw_index if raw_index is not index else None
+        self.get_vector = get_vector
+        self.get_metadata = get_metadata
+        super().__init__(name)
+
+    def get_image_urls(self) -> List[str]:
+        return [entry.get("image_url") for entry in self.metadata]
+
+    def prepare(self, item: Dict[str, Any], embeddings: Dict[str, Any]) -> Optional[Any]:
+        vector = self.get_vector(embeddings)
+        if vector is None:
+            return None
+        vector = np.asarray(vector, dtype=np.float32).reshape(1, -1)
+        if vector.shape[1] != self.index.d:
+            raise ValueError(f"Embedding of dimension {vector.shape[1]} for {self.name}, expected {self.index.d}")
+        return vector, self.get_metadata(item)
+
+    def add(self, entries: List[Tuple[str, Any]]) -> None:
+        from retreivers.binary_index import encode_binary
+
+        vectors = np.concatenate([vector for _, (vector, _) in entries])
+        self.index.add(vectors)
+        if self.raw_index is not None:
+            self.raw_index.add(vectors)
+        if self.binary_index is not None:
+            self.binary_index.add(encode_binary(vectors))
+        self.metadata.extend(metadata for _, (_, metadata) in entries)
+        super().add(entries)
+
+    def remove(self, rows: List[int]) -> None:
+        _remove_faiss_rows(self.index, rows)
+        if self.raw_index is not None:
+            _remove_faiss_rows(self.raw_index, rows)
+        if self.binary_index is not None:
+            _remove_faiss_rows(self.binary_index, rows)
+        removed = set(rows)
+        self.metadata[:] = [entry for row, entry in enumerate(self.metadata) if row not in removed]
+        super().remove(rows)
+
+class _BM25Engine(_Engine):
+    """The BM25 documents of a structure and variant, with live document frequencies."""
+
+    def __init__(self, name: str, model, structure_num: int, variant: str):
+        self.model = model
+        self.structure_num = structure_num
+        self.variant = variant
+        super().__init__(name)
+        self.document_frequencies = Counter()
+        for frequencies in model.doc_freqs:
+            self.document_frequencies.update(frequencies.keys())
+        self.num_documents = len(model.doc_freqs)
+        self.num_tokens = sum(model.doc_len)
+
+    def get_image_urls(self) -> List[str]:
+        return [entry.get("image_url") for entry in self.model.metadata]
+
+    def prepare(self, item: Dict[str, Any], embeddings: Dict[str, Any]) -> Optional[Any]:
+        text = _get_sparse_text(item, self.structure_num)
+        if not text.strip():
+            return None
+        return Counter(tokenize_bm25(text, self.variant)), _get_sparse_metadata(item)
+
+    def add(self, entries: List[Tuple[str, Any]]) -> None:
+        for _, (frequencies, metadata) in entries:
+            self.model.doc_freqs.append(dict(frequencies))
+            self.model.doc_len.append(sum(frequencies.values()))
+            self.model.metadata.append(metadata)
+            self.document_frequencies.update(frequencies.keys())
+            self.num_documents += 1
+            self.num_tokens += sum(frequencies.values())
+        super().add(entries)
+        self._update_statistics()
+
+    def retire(self, rows: List[int]) -> None:
+        for row in rows:
+            self.document_frequencies.subtract(self.model.doc_freqs[row].keys())
+            self.num_documents -= 1
+            self.num_tokens -= self.model.doc_len[row]
+        self.document_frequencies = +self.document_frequencies
+        self._update_statistics()
+
+    def remove(self, rows: List[int]) -> None:
+        removed = set(rows)
+        for name in ("doc_freqs", "doc_len", "metadata"):
+            values = getattr(self.model, name)
+            values[:] = [value for row, value in enumerate(values) if row not in removed]
+        super().remove(rows)
+        self._update_statistics()
+
+    def _update_statistics(self) -> None:
+        """Set the idf, corpus size and average length from the live documents (as BM25Okapi._calc_idf)."""
+        model = self.model
+        # Every stored document is scored, the tombstoned ones are dropped from the results
+        model.corpus_size = len(model.doc_freqs)
+        if not self.num_documents:
+            model.idf = {}
+            return
+        model.avgdl = self.num_tokens / self.num_documents
+        model.idf = {}
+        idf_sum = 0
+        negative_idfs = []
+        for word, frequency in self.document_frequencies.items():
+            idf = math.log(self.num_documents - frequency + 0.5) - math.log(frequency + 0.5)
+            model.idf[word] = idf
+            idf_sum += idf
+            if idf < 0:
+                negative_idfs.append(word)
+        model.average_idf = idf_sum / len(model.idf)
+        eps = model.epsilon * model.average_idf
+        for word in negative_idfs:
+            model.idf[word] = eps
+
+class _TfidfEngine(_Engine):
+    """The TF-IDF documents of a structure, with their term counts and live document frequencies."""
+
+    def __init__(self, name: str, retriever, structure_num: int):
+        from sklearn.feature_extraction.text import CountVectorizer
+
+        self.retriever = retriever
+        self.structure_num = structure_num
+        # The raw counts are not stored with the retriever, recount them once with the fitted vocabulary
+        self.counts = CountVectorizer.transform(retriever.vectorizer, [doc.page_content for doc in retriever.docs])
+        self.live = np.ones(self.counts.shape[0], dtype=bool)
+        super().__init__(name)
+
+    def get_image_urls(self) -> List[str]:
+        return [doc.metadata.get("image_url") for doc in self.retriever.docs]
+
+    def prepare(self, item: Dict[str, Any], embeddings: Dict[str, Any]) -> Optional[Any]:
+        from langchain_core.documents import Document
+
+        text = _get_sparse_text(item, self.structure_num).strip()
+        if not text:
+            return None
+        metadata = _get_sparse_metadata(item)
+        metadata["structure"] = self.structure_num
+        return Document(page_content=text, metadata=metadata)
+
+    def add(self, entries: List[Tuple[str, Any]]) -> None:
+        import scipy.sparse
+
+        vectorizer = self.retriever.vectorizer
+        analyzer = vectorizer.build_analyzer()
+        rows, columns, values = [], [], []
+        for row, (_, document) in enumerate(entries):
+            for term, count in Counter(analyzer(document.page_content)).items():
+                if term not in vectorizer.vocabulary_:
+                    vectorizer.vocabulary_[term] = len(vectorizer.vocabulary_)
+                rows.append(row)
+                columns.append(vectorizer.vocabulary_[term])
+                values.append(count)
+        num_terms = len(vectorizer.vocabulary_)
+        counts = scipy.sparse.csr_matrix(
+            (values, (rows, columns)), shape=(len(entries), num_terms), dtype=self.counts.dtype
+        )
+        self.counts.resize((self.counts.shape[0], num_terms))
+        self.counts = scipy.sparse.vstack([self.counts, counts], format="csr")
+        self.live = np.concatenate([self.live, np.ones(len(entries), dtype=bool)])
+        self.retriever.docs = self.retriever.docs + [document for _, document in entries]
+        super().add(entries)
+        self._update_weights()
+
+    def retire(self, rows: List[int]) -> None:
+        self.live[rows] = False
+        self._update_weights()
+
+    def remove(self, rows: List[int]) -> None:
+        keep = np.ones(self.counts.shape[0], dtype=bool)
+        keep[rows] = False
+        self.counts = self.counts[keep]
+        self.live = self.live[keep]
+        self.retriever.docs = [doc for row, doc in enumerate(self.retriever.docs) if keep[row]]
+        super().remove(rows)
+        self._update_weights()
+
+    def _update_weights(self) -> None:
+        """Set the idf and document vectors from the live documents (as TfidfVectorizer.fit_transform)."""
+        from sklearn.feature_extraction.text import TfidfTransformer
+
+        vectorizer = self.retriever.vectorizer
+        live_counts = self.counts[self.live]
+        document_frequencies = np.bincount(live_counts.indices, minlength=live_counts.shape[1]).astype(np.float64)
+        num_documents = live_counts.shape[0]
+        if vectorizer.smooth_idf:
+            idf = np.log((num_documents + 1) / (document_frequencies + 1)) + 1.0
+        else:
+            idf = np.log(num_documents / np.maximum(document_frequencies, 1)) + 1.0
+        # Terms left in no live document weigh nothing, as if they were not in the vocabulary
+        idf[document_frequencies == 0] = 0.0
+        # The vectorizer weighs queries with its fitted transformer, which also checks the vocabulary size
+        transformer = TfidfTransformer(norm=vectorizer.norm, sublinear_tf=vectorizer.sublinear_tf)
+        transformer.idf_ = idf
+        transformer.n_features_in_ = len(idf)
+        vectorizer._tfidf = transformer
+        self.retriever.tfidf_array = transformer.transform(self.counts)
+
+def _load_engines(engines: List[str]) -> Dict[str, _Engine]:
+    """Load the indices to update from the current bundle (the retrievers' own caches)."""
+    loaded: Dict[str, _Engine] = {}
+    if "bge" in engines:
+        from retreivers import bge_retreiver
+        binary_indices = bundles.cache("bge_binary_indices")
+        for structure_num in STRUCTURES:
+            index, metadata = bge_retreiver.get_structure_index_and_metadata(structure_num)
+            if index is None:
+                continue
+            loaded[f"bge_{structure_num}"] = _FaissEngine(
+                f"bge_{structure_num}", index, metadata, binary_indices.get(structure_num),
+                get_vector=lambda embeddings, key=str(structure_num): embeddings.get("bge", {}).get(key),
+                get_metadata=_get_bge_metadata, raw_index=bge_retreiver.get_raw_index(structure_num)
+            )
+    if "clip" in engines:
+        from retreivers import clip_retreiver
+        retriever = clip_retreiver.get_retriever()
+        loaded["clip"] = _FaissEngine(
+            "clip", retriever.index, retriever.metadata, retriever.binary_index,
+            get_vector=lambda embeddings: embeddings.get("clip"), get_metadata=_get_clip_metadata,
+            raw_index=retriever.get_raw_index()
+        )
+    for variant in ("with_stopwords", "without_stopwords"):
+        if f"bm25_{variant}" not in engines:
+            continue
+        from retreivers import bm25_retreiver
+        for structure_num in STRUCTURES:
+            try:
+                model = bm25_retreiver.load_retriever(structure_num, variant)
+            except FileNotFoundError as e:
+                logger.warning(f"BM25 {variant} structure {structure_num} is not served, not updated: {str(e)}")
+                continue
+            if hasattr(model, "metadata"):
+                name = f"bm25_{variant}_{structure_num}"
+                loaded[name] = _BM25Engine(name, model, structure_num, variant)
+    if "tfidf" in engines:
+        from retreivers import tfidf_retreiver
+        for structure_num in STRUCTURES:
+            try:
+                retriever = tfidf_retreiver.load_retriever(structure_num)
+            except FileNotFoundError as e:
+                logger.warning(f"TF-IDF structure {structure_num} is not served, not updated: {str(e)}")
+                continue
+            loaded[f"tfidf_{structure_num}"] = _TfidfEngine(f"tfidf_{structure_num}", retriever, structure_num)
+    return loaded
+
+# Live state of a bundle
+
+def _get_state(bundle: Optional[bundles.IndexBundle] = None) -> Dict[str, Any]:
+    """Get the ingestion state of a bundle (default: the current one): its lock, indices and tombstones."""
+    state = (bundle or bundles.current()).cache("ingestion")
+    if "lock" not in state:
+        state.setdefault("lock", ReadWriteLock())
+    return state
+
+@contextmanager
+def _changing(bundle: Optional[bundles.IndexBundle], engines: List[str]) -> Iterator[Dict[str, Any]]:
+    """Hold a bundle's write lock with its indices loaded, and drop the derived caches afterwards."""
+    bundle = bundle or bundles.get_active()
+    state = _get_state(bundle)
+    with change_lock, bundles.pinned(bundle), state["lock"].writing():
+        if "engines" not in state:
+            state["engines"] = _load_engines(engines)
+            state["tombstones"] = set()
+            state["deleted_urls"] = set()
+            state["urls"] = {}
+            for engine in state["engines"].values():
+                state["urls"].update(zip(engine.row_ids, engine.get_image_urls()))
+        try:
+            yield state
+        finally:
+            for name in DERIVED_CACHES:
+                bundle.cache(name).clear()
+            clip = bundle.cache("clip").get("retriever")
+            if clip is not None:
+                clip._vectors = None
+
+def _is_live(state: Dict[str, Any], image_id: str) -> bool:
+    """Whether an image is in the bundle's indices and not tombstoned."""
+    return image_id in state["urls"] and image_id not in state["tombstones"]
+
+def _compact(state: Dict[str, Any]) -> int:
+    """Remove the tombstoned rows from every index (write lock held)."""
+    tombstones = state["tombstones"]
+    if not tombstones:
+        return 0
+    for engine in state["engines"].values():
+        rows = sorted(engine.rows[image_id] for image_id in tombstones if image_id in engine.rows)
+        if rows:
+            engine.remove(rows)
+    for image_id in tombstones:
+        state["urls"].pop(image_id, None)
+    removed = len(tombstones)
+    state["tombstones"] = set()
+    state["deleted_urls"] = set()
+    return removed
+
+def add_images(entries: List[Dict[str, Any]], engines: List[str],
+               bundle: Optional[bundles.IndexBundle] = None,
+               journal: Optional[Callable[[List[str], List[Dict[str, Any]]], None]] = None) -> List[str]:
+    """
+    Append images to every index of a bundle.
+
+    Args:
+        entries (List[Dict[str, Any]]): {"item", "embeddings"} per image, embeddings from embed_item
+        engines (List[str]): Indices to update, from get_engines
+        bundle (Optional[bundles.IndexBundle]): Bundle to update (default: the active one)
+        journal (Optional[Callable]): Called with the ids and entries of the images to add once they are
+            validated, before the indices change and under the same lock; if it raises, nothing is added
+
+    Returns:
+        List[str]: Ids of the images added; images already in the bundle are skipped
+
+    Raises:
+        ValueError: If an entry cannot be indexed, e.g. its embeddings do not match an index
+    """
+    with _changing(bundle, engines) as state:
+        entries = [entry for entry in entries if not _is_live(state, get_image_id(entry["item"]["image_url"]))]
+        image_ids = [get_image_id(entry["item"]["image_url"]) for entry in entries]
+        if len(set(image_ids)) < len(image_ids):
+            raise ValueError("The same image is added twice")
+        # A tombstoned image keeps its rows until compaction, remove them before adding it again
+        if any(image_id in state["tombstones"] for image_id in image_ids):
+            _compact(state)
+
+        # Prepare every row first, so an invalid entry changes nothing
+        prepared = {name: [] for name in state["engines"]}
+        for image_id, entry in zip(image_ids, entries):
+            for name, engine in state["engines"].items():
+                row = engine.prepare(entry["item"], entry["embeddings"])
+                if row is not None:
+                    prepared[name].append((image_id, row))
+        if journal is not None and image_ids:
+            journal(image_ids, entries)
+        for name, rows in prepared.items():
+            if rows:
+                state["engines"][name].add(rows)
+        for image_id, entry in zip(image_ids, entries):
+            state["urls"][image_id] = entry["item"]["image_url"]
+    if image_ids:
+        logger.info(f"Added {len(image_ids)} image(s) to the indices")
+    return image_ids
+
+def delete_images(image_ids: List[str], engines: List[str],
+                  bundle: Optional[bundles.IndexBundle] = None,
+                  journal: Optional[Callable[[Dict[str, str]], None]] = None) -> Dict[str, str]:
+    """
+    Tombstone images in every index of a bundle; their rows are removed at the next compaction.
+
+    Args:
+        image_ids (List[str]): Ids of the images, from get_image_id
+        engines (List[str]): Indices to update, from get_engines
+        bundle (Optional[bundles.IndexBundle]): Bundle to update (default: the active one)
+        journal (Optional[Callable]): Called with the images to remove (id -> URL) before the indices
+            change and under the same lock; if it raises, nothing is removed
+
+    Returns:
+        Dict[str, str]: Image id -> URL of the images removed; ids not in the bundle are skipped
+    """
+    with _changing(bundle, engines) as state:
+        removed = {
+            image_id: state["urls"][image_id] for image_id in image_ids if _is_live(state, image_id)
+        }
+        if journal is not None and removed:
+            journal(removed)
+        for engine in state["engines"].values():
+            rows = [engine.rows[image_id] for image_id in removed if image_id in engine.rows]
+            if rows:
+                engine.retire(rows)
+        state["tombstones"].update(removed)
+        state["deleted_urls"].update(removed.values())
+    if removed:
+        logger.info(f"Tombstoned {len(removed)} image(s)")
+    return removed
+
+def compact(engines: List[str], bundle: Optional[bundles.IndexBundle] = None) -> int:
+    """
+    Remove the rows of tombstoned images from every index of a bundle (default: the active one).
+
+    Returns:
+        int: Number of images removed
+    """
+    if not get_num_tombstones(bundle):
+        return 0
+    with _changing(bundle, engines) as state:
+        removed = _compact(state)
+    logger.info(f"Compacted {removed} tombstoned image(s) out of the indices")
+    return removed
+
+def get_status(bundle: Optional[bundles.IndexBundle] = None) -> Dict[str, Any]:
+    """Get the number of images, tombstones and rows per index of a bundle (default: the active one)."""
+    state = _get_state(bundle or bundles.get_active())
+    if "engines" not in state:
+        return {"tracked": False, "tombstones": 0, "indices": {}}
+    with state["lock"].reading():
+        return {
+            "tracked": True,
+            "images": len(state["urls"]) - len(state["tombstones"]),
+            "tombstones": len(state["tombstones"]),
+            "indices": {name: len(engine.row_ids) for name, engine in state["engines"].items()},
+        }
+
+def get_num_tombstones(bundle: Optional[bundles.IndexBundle] = None) -> int:
+    """Get the number of tombstoned images of a bundle (default: the active one)."""
+    return len(_get_state(bundle or bundles.get_active()).get("tombstones", ()))
+
+# Searching
+
+def _filter_items(items: List[Dict[str, Any]], deleted_urls: Set[str], k: int) -> List[Dict[str, Any]]:
+    """Drop the tombstoned images from a result list and keep the top k."""
+    return [item for item in items if item.get("image_url") not in deleted_urls][:k]
+
+def filter_results(results: Any, deleted_urls: Set[str], k: int) -> Any:
+    """Drop the tombstoned images from a retriever's results (a list, or lists by structure) and keep the top k."""
+    if isinstance(results, dict):
+        return {key: _filter_items(items, deleted_urls, k) for key, items in results.items()}
+    return _filter_items(results, deleted_urls, k)
+
+def run_search(function: Callable, *args) -> Any:
+    """
+    Run a retriever function(query, ..., k) on the current bundle under its read lock,
+    without the tombstoned images.
+
+    The retriever is asked for k plus the number of tombstones, so that k results are
+    left once they are dropped.
+    """
+    *args, k = args
+    state = _get_state()
+    with state["lock"].reading():
+        deleted_urls = state.get("deleted_urls")
+        if not deleted_urls:
+            return function(*args, k)
+        return filter_results(function(*args, k + len(deleted_urls)), deleted_urls, k)
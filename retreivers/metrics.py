@@ -0,0 +1,147 @@
+"""
+Prometheus metrics for the retrieval stack.
+
+The metrics are process-wide prometheus_client collectors. Updating one is a
+lock-protected counter increment, cheap enough for the per-query hot path.
+The backend serves them in the Prometheus text format at /metrics.
+
+The same timers also record per-request spans when a request handler has
+started collecting them. The spans live in a context variable, which
+asyncio.to_thread copies into the retriever threads, so concurrent requests
+never mix their spans. The backend returns them as a Server-Timing header.
+
+Retrievers that catch a query's exception and return no results record it with
+record_error, so the call that ran them still counts as an error.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+if TYPE_CHECKING:
+    # Not imported at runtime, so sparse-only deployments never load FAISS
+    import faiss
+
+# Latency buckets in seconds, from sub-millisecond FAISS searches to multi-second cold loads
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by route and status code", ["path", "status"]
+)
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ["path"], buckets=LATENCY_BUCKETS
+)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served")
+
+RETRIEVER_REQUESTS = Counter(
+    "retriever_requests_total", "Retriever calls by method and outcome", ["method", "status"]
+)
+RETRIEVER_LATENCY = Histogram(
+    "retriever_latency_seconds", "Retriever call latency over all structures", ["method"], buckets=LATENCY_BUCKETS
+)
+STRUCTURE_LATENCY = Histogram(
+    "retriever_structure_latency_seconds", "Retriever latency for one structure", ["method", "structure"],
+    buckets=LATENCY_BUCKETS
+)
+STAGE_LATENCY = Histogram(
+    "retriever_stage_seconds", "Time spent in query encoding, index search and metadata assembly",
+    ["method", "stage"], buckets=LATENCY_BUCKETS
+)
+TASKS_QUEUED = Gauge("retriever_tasks_queued", "Retriever calls waiting for a thread-pool worker")
+TASKS_RUNNING = Gauge("retriever_tasks_running", "Retriever calls running on the thread pool")
+
+CACHE_REQUESTS = Counter(
+    "retriever_cache_requests_total", "Lookups in the in-process model, index and pickle caches",
+    ["cache", "result"]
+)
+
+IMPORT_SECONDS = Gauge("retriever_import_seconds", "Time to import a retriever module on first use", ["retriever"])
+
+INDEX_VECTORS = Gauge("index_vectors", "Vectors in each loaded index", ["retriever", "structure"])
+INDEX_BYTES = Gauge("index_bytes", "Approximate size of the codes in each loaded index", ["retriever", "structure"])
+
+# Span durations (seconds) by name for the current request, None outside a traced request
+_request_spans: ContextVar[Optional[Dict[str, List[float]]]] = ContextVar("request_spans", default=None)
+# Errors caught by the retriever call being tracked, None outside track_errors
+_retriever_errors: ContextVar[Optional[List[str]]] = ContextVar("retriever_errors", default=None)
+
+def start_request_spans() -> Dict[str, List[float]]:
+    """Start collecting spans for the current request (call before fanning out to threads)."""
+    spans = {}
+    _request_spans.set(spans)
+    return spans
+
+def record_span(name: str, seconds: float) -> None:
+    """Add a span to the current request, if one is collecting."""
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.setdefault(name, []).append(seconds)
+
+def summarize_spans(spans: Dict[str, List[float]]) -> Dict[str, Dict[str, float]]:
+    """Sum repeated spans, e.g. one encode per structure, into a total duration and count per name."""
+    return {
+        name: {"duration_ms": 1000 * sum(durations), "count": len(durations)}
+        for name, durations in spans.items()
+    }
+
+def format_server_timing(summary: Dict[str, Dict[str, float]]) -> str:
+    """Format summarized spans as a Server-Timing header value."""
+    return ", ".join(f"{name};dur={span['duration_ms']:.2f}" for name, span in summary.items())
+
+@contextmanager
+def time_stage(method: str, stage: str) -> Iterator[None]:
+    """Time a stage ("encode", "search" or "metadata") of a retriever."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.labels(method, stage).observe(elapsed)
+        record_span(f"{method}.{stage}", elapsed)
+
+@contextmanager
+def time_structure(method: str, structure_num: int) -> Iterator[None]:
+    """Time a retriever's work on one structure."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STRUCTURE_LATENCY.labels(method, str(structure_num)).observe(elapsed)
+        record_span(f"{method}.structure{structure_num}", elapsed)
+
+@contextmanager
+def track_errors() -> Iterator[List[str]]:
+    """Collect the errors that the retriever called in this block catches and records."""
+    errors = []
+    token = _retriever_errors.set(errors)
+    try:
+        yield errors
+    finally:
+        _retriever_errors.reset(token)
+
+def record_error(message: str) -> None:
+    """Record an error that a retriever caught instead of raising, if its call is tracked."""
+    errors = _retriever_errors.get()
+    if errors is not None:
+        errors.append(message)
+
+def record_cache(cache: str, hit: bool) -> None:
+    """Count a cache lookup as a hit or a miss."""
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+def index_memory_bytes(index: "faiss.Index") -> int:
+    """Approximate the memory of an index's codes."""
+    try:
+        return index.sa_code_size() * index.ntotal
+    except RuntimeError:
+        # Index types without a standalone codec, e.g. refine or pre-transform wrappers
+        return 4 * index.d * index.ntotal
+
+def set_index_size(retriever: str, structure: str, index: "faiss.Index") -> None:
+    """Publish the vector count and size of a loaded index."""
+    INDEX_VECTORS.labels(retriever, structure).set(index.ntotal)
+    INDEX_BYTES.labels(retriever, structure).set(index_memory_bytes(index))
@@ -0,0 +1,201 @@
+"""
+IVF indices with their inverted lists on disk.
+
+An IVF index splits the vectors into nlist clusters. The coarse quantiser, which
+holds the nlist centroids, is stored in the .faiss file and kept in memory. The
+vectors of each cluster (its inverted list) are stored in an .ivfdata file next
+to it. faiss maps that file with mmap, so the lists are read through the page
+cache. A query only scans the nprobe lists whose centroids are closest to it. The
+operating system keeps the lists used recently in memory and evicts them under
+memory pressure, so the corpus can be larger than RAM.
+
+The .ivfdata file is found next to the .faiss file, so the two can be moved
+together, e.g. into an index bundle.
+"""
+
+import math
+import os
+from typing import Callable
+
+import faiss
+import numpy as np
+
+# Constants
+ONDISK_VARIANT = "ivf_ondisk"
+IVFDATA_EXTENSION = ".ivfdata"
+DEFAULT_NPROBE = 16
+# faiss needs about 39 training points per centroid, and samples at most 256 per centroid
+MIN_POINTS_PER_CENTROID = 39
+TRAINING_POINTS_PER_CENTROID = 256
+CHUNK_SIZE = 100_000
+
+def get_ivfdata_path(index_path: str) -> str:
+    """Get the path of the inverted lists file of an on-disk index."""
+    return os.path.splitext(index_path)[0] + IVFDATA_EXTENSION
+
+def get_default_nlist(num_vectors: int) -> int:
+    """Get the number of clusters for a corpus size: 4 * sqrt(n), with enough training points per centroid."""
+    return max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // MIN_POINTS_PER_CENTROID))
+
+def _build_ondisk_ivf_index(get_rows: Callable[[np.ndarray], np.ndarray], num_vectors: int, dimension: int,
+                            index_path: str, nlist: int, nprobe: int, chunk_size: int) -> faiss.Index:
+    """
+    Train an IVF index on a sample of the vectors, index them chunk by chunk and
+    merge the chunks' lists into the .ivfdata file.
+
+    Each chunk is written to a temporary file and mapped back, so only one chunk
+    is in memory at a time. Merging all chunks at once lays every list out
+    contiguously in the file, with no free space.
+    """
+    nlist = nlist or get_default_nlist(num_vectors)
+    quantizer = faiss.IndexFlatL2(dimension)
+    index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+    rng = np.random.default_rng(0)
+    num_training = min(num_vectors, TRAINING_POINTS_PER_CENTROID * nlist)
+    index.train(get_rows(np.sort(rng.choice(num_vectors, num_training, replace=False))))
+
+    ivfdata_path = get_ivfdata_path(index_path)
+    chunk_paths = []
+    try:
+        for start in range(0, num_vectors, chunk_size):
+            rows = np.arange(start, min(start + chunk_size, num_vectors))
+            chunk_index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+            chunk_index.add_with_ids(get_rows(rows), rows)
+            chunk_paths.append(f"{ivfdata_path}.chunk{len(chunk_paths)}")
+            faiss.write_index(chunk_index, chunk_paths[-1])
+            del chunk_index
+
+        chunk_indices = [faiss.read_index(path, faiss.IO_FLAG_MMAP) for path in chunk_paths]
+        chunk_lists = faiss.InvertedListsPtrVector()
+        for chunk_index in chunk_indices:
+            chunk_lists.push_back(chunk_index.invlists)
+        if os.path.exists(ivfdata_path):
+            os.remove(ivfdata_path)
+        invlists = faiss.OnDiskInvertedLists(nlist, index.code_size, ivfdata_path)
+        invlists.merge_from_multiple(chunk_lists.data(), chunk_lists.size(), False, False)
+        del chunk_indices
+    finally:
+        for path in chunk_paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    index.replace_invlists(invlists, True)
+    invlists.this.disown()
+    index.ntotal = num_vectors
+    index.nprobe = min(nprobe, nlist)
+    return index
+
+def build_ondisk_ivf_index(embeddings: np.ndarray, index_path: str, nlist: int = None,
+                           nprobe: int = DEFAULT_NPROBE, chunk_size: int = CHUNK_SIZE) -> faiss.Index:
+    """
+    Build an IVF index over normalized embeddings with its inverted lists on disk.
+
+    The .faiss file is not written here: save the returned index to index_path
+    with faiss.write_index.
+
+    Args:
+        embeddings (np.ndarray): Normalized embeddings of shape (n, dimension), e.g. a np.memmap
+        index_path (str): Path the index will be saved to; its lists go to the .ivfdata file next to it
+        nlist (int): Number of clusters (default: get_default_nlist)
+        nprobe (int): Clusters scanned per query, stored in the index
+        chunk_size (int): Embeddings added at a time
+
+    Returns:
+        faiss.Index: The populated index, its lists backed by the .ivfdata file
+    """
+    def get_rows(rows: np.ndarray) -> np.ndarray:
+        return np.ascontiguousarray(embeddings[rows], dtype=np.float32)
+    return _build_ondisk_ivf_index(get_rows, len(embeddings), embeddings.shape[1], index_path, nlist, nprobe, chunk_size)
+
+def convert_to_ondisk_ivf(flat_index_path: str, index_path: str, nlist: int = None,
+                          nprobe: int = DEFAULT_NPROBE, chunk_size: int = CHUNK_SIZE) -> faiss.Index:
+    """
+    Build an on-disk IVF index from the vectors of a flat index, without loading them all.
+
+    The flat index file is mapped, not read, so it can be larger than RAM. Used for
+    corpora whose embeddings only exist as an index, e.g. synthetic corpora.
+
+    Args:
+        flat_index_path (str): Path of a flat float32 index, e.g. text_index_structure_1.faiss
+        index_path (str): Path the index will be saved to; its lists go to the .ivfdata file next to it
+        nlist (int): Number of clusters (default: get_default_nlist)
+        nprobe (int): Clusters scanned per query, stored in the index
+        chunk_size (int): Vectors added at a time
+
+    Returns:
+        faiss.Index: The populated index, its lists backed by the .ivfdata file
+    """
+    flat_index = faiss.read_index(flat_index_path, faiss.IO_FLAG_MMAP)
+    return _build_ondisk_ivf_index(
+        flat_index.reconstruct_batch, flat_index.ntotal, flat_index.d, index_path, nlist, nprobe, chunk_size
+    )
+
+def read_index(index_path: str, nprobe: int = 0) -> faiss.Index:
+    """
+    Read a FAISS index, finding the inverted lists of an on-disk index next to it.
+
+    Args:
+        index_path (str): Path of the .faiss file
+        nprobe (int): Clusters scanned per query by an IVF index, 0 to keep the stored value
+
+    Returns:
+        faiss.Index: The index; on-disk lists are mapped, not read
+    """
+    index = faiss.read_index(index_path, faiss.IO_FLAG_ONDISK_SAME_DIR)
+    if nprobe > 0 and is_ivf(index):
+        faiss.extract_index_ivf(index).nprobe = nprobe
+    return index
+
+def is_ivf(index: faiss.Index) -> bool:
+    """Whether an index is (or wraps) an IVF index."""
+    try:
+        faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return False
+    return True
+
+def is_ondisk(index: faiss.Index) -> bool:
+    """Whether an index is (or wraps) an IVF index with its inverted lists on disk."""
+    if not is_ivf(index):
+        return False
+    invlists = faiss.downcast_InvertedLists(faiss.extract_index_ivf(index).invlists)
+    return isinstance(invlists, faiss.OnDiskInvertedLists)
+
+def check_in_memory(index: faiss.Index, purpose: str) -> None:
+    """Reject an on-disk index for a use that would read all its vectors into memory."""
+    if is_ondisk(index):
+        raise ValueError(f"{purpose} reads every vector into memory, which an index with its inverted "
+                         f"lists on disk ({ONDISK_VARIANT}) is meant to avoid; serve a flat index variant instead")
+
+def stores_exact_vectors(index: faiss.Index) -> bool:
+    """Whether an index gives back exactly the vectors it was built from: flat, IVF-flat or refined with them."""
+    if isinstance(index, faiss.IndexRefine):
+        index = faiss.downcast_index(index.refine_index)
+    return isinstance(index, (faiss.IndexFlat, faiss.IndexIVFFlat))
+
+def make_reconstructable(index: faiss.Index) -> None:
+    """
+    Let an index return its stored vectors by row.
+
+    An IVF index first needs a map from rows to list entries, built here on
+    first use. For an on-disk index this reads the ids of every list.
+    """
+    if is_ivf(index):
+        ivf = faiss.extract_index_ivf(index)
+        if ivf.direct_map.type == faiss.DirectMap.NoMap:
+            ivf.make_direct_map()
+
+def reconstruct_all(index: faiss.Index) -> np.ndarray:
+    """
+    Get every vector stored in an index, in row order.
+
+    Raises:
+        ValueError: If the index has its inverted lists on disk, or cannot give back its vectors exactly
+            (a quantised or PCA-reduced variant: read the float32 index next to it instead)
+    """
+    check_in_memory(index, "Exact rescoring of stored vectors")
+    if not stores_exact_vectors(index):
+        raise ValueError(f"{type(index).__name__} stores approximate vectors, exact rescoring reads them "
+                         f"from the float32 index next to it (see quantized_index.read_raw_index)")
+    make_reconstructable(index)
+    return index.reconstruct_n(0, index.ntotal)
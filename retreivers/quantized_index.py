@@ -0,0 +1,134 @@
+"""
+Quantised and PCA-reduced FAISS index variants.
+
+The preprocess scripts build these next to the float32 index of the same
+embeddings. Scalar quantisers (fp16, int8) and product quantisers (PQ) shrink
+each vector, and can keep the float32 vectors to re-rank their top candidates
+exactly (IndexRefineFlat). A PCA reduction is learned at build time and stored
+in the index, so the index reduces each query itself at search time. By default
+a PQ has one sub-quantiser per 8 dimensions of the indexed (possibly reduced)
+vectors.
+
+A variant cannot give its vectors back exactly, so whatever rescores with the
+stored vectors (the binary re-rank, the hybrid and topic-routed retrievers)
+reads them from the float32 index next to it (see read_raw_index).
+"""
+
+import os
+
+import faiss
+import numpy as np
+
+# Constants
+QUANTIZATIONS = ["none", "fp16", "int8", "pq"]
+DIMENSIONS_PER_SUBQUANTIZER = 8
+
+def get_pq_m(dimension: int, pq_m: int = None) -> int:
+    """
+    Get the number of PQ sub-quantisers for an indexed dimension.
+
+    Args:
+        dimension (int): Dimension of the indexed vectors, after any PCA
+        pq_m (int): Requested number of sub-quantisers (default: one per 8 dimensions)
+
+    Returns:
+        int: The number of sub-quantisers
+
+    Raises:
+        ValueError: If pq_m does not divide the dimension
+    """
+    pq_m = pq_m or max(1, dimension // DIMENSIONS_PER_SUBQUANTIZER)
+    if dimension % pq_m:
+        raise ValueError(f"The number of PQ sub-quantisers ({pq_m}) must divide the indexed dimension ({dimension})")
+    return pq_m
+
+def build_index(embeddings: np.ndarray, quantization: str = "none", pq_m: int = None, pq_nbits: int = 8,
+                rerank: bool = False, rerank_k_factor: int = 4, pca_dim: int = None,
+                pca_whiten: bool = False) -> faiss.Index:
+    """
+    Build a FAISS index of the requested quantisation over normalized embeddings.
+
+    Args:
+        embeddings (np.ndarray): Normalized embeddings of shape (n, dimension)
+        quantization (str): One of "none", "fp16", "int8" or "pq"
+        pq_m (int): Number of PQ sub-quantisers (default: one per 8 indexed dimensions)
+        pq_nbits (int): Bits per PQ sub-quantiser code
+        rerank (bool): Keep float32 vectors to re-rank the top candidates exactly
+        rerank_k_factor (int): Candidates fetched per requested result when re-ranking
+        pca_dim (int): Reduce the embeddings to this many dimensions with a PCA stored in the index
+        pca_whiten (bool): Whiten the PCA output
+
+    Returns:
+        faiss.Index: The trained and populated index
+
+    Raises:
+        ValueError: If pq_m does not divide the indexed dimension
+    """
+    dimension = pca_dim or embeddings.shape[1]
+    if quantization == "fp16":
+        index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_fp16)
+    elif quantization == "int8":
+        index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit)
+    elif quantization == "pq":
+        index = faiss.IndexPQ(dimension, get_pq_m(dimension, pq_m), pq_nbits)
+    else:
+        index = faiss.IndexFlatL2(dimension)
+
+    if rerank and quantization != "none":
+        index = faiss.IndexRefineFlat(index)
+        index.k_factor = rerank_k_factor
+
+    if pca_dim:
+        pca = faiss.PCAMatrix(embeddings.shape[1], pca_dim, -0.5 if pca_whiten else 0.0)
+        index = faiss.IndexPreTransform(index)
+        index.prepend_transform(faiss.NormalizationTransform(pca_dim))
+        index.prepend_transform(pca)
+
+    index.train(embeddings)
+    index.add(embeddings)
+    return index
+
+def get_index_variant(quantization: str, rerank: bool = False, pca_dim: int = None,
+                      pca_whiten: bool = False) -> str:
+    """
+    Get the file name suffix of an index variant.
+
+    Args:
+        quantization (str): One of "none", "fp16", "int8" or "pq"
+        rerank (bool): Whether the index re-ranks with float32 vectors
+        pca_dim (int): Dimensions kept by the PCA, if any
+        pca_whiten (bool): Whether the PCA output is whitened
+
+    Returns:
+        str: Suffix such as "_int8_rerank" or "_pca128_whiten", empty for the float32 index
+    """
+    variant = ""
+    if pca_dim:
+        variant += f"_pca{pca_dim}_whiten" if pca_whiten else f"_pca{pca_dim}"
+    if quantization != "none":
+        variant += f"_{quantization}_rerank" if rerank else f"_{quantization}"
+    return variant
+
+def read_raw_index(index_path: str, served_index: faiss.Index) -> faiss.Index:
+    """
+    Read the float32 index written next to a served variant, which holds the raw vectors.
+
+    Args:
+        index_path (str): Path of the float32 index, e.g. text_index_structure_1.faiss
+        served_index (faiss.Index): The variant served, whose rows the float32 index must hold
+
+    Returns:
+        faiss.Index: The float32 index
+
+    Raises:
+        FileNotFoundError: If there is no float32 index next to the variant
+        ValueError: If the float32 index does not hold the variant's rows
+    """
+    if not os.path.exists(index_path):
+        raise FileNotFoundError(f"Rescoring with the stored vectors of an index variant needs the float32 index "
+                                f"{index_path} next to it")
+    index = faiss.read_index(index_path)
+    if not isinstance(index, faiss.IndexFlat) or index.d != served_index.d or index.ntotal != served_index.ntotal:
+        raise ValueError(f"{index_path} is not a float32 index of the {served_index.ntotal} rows "
+                         f"of dimension {served_index.d} of the served variant")
+    return index
@@ -0,0 +1,103 @@
+"""
+Registry of the retrievers served by /get-images, imported lazily.
+
+The retriever modules pull in heavy dependencies at import time (torch and
+CLIP, sentence-transformers, FAISS, langchain), so they are registered by
+module and function name and imported on their first call only. Only the
+methods enabled in RETRIEVERS_ENABLED are registered, so a sparse-only
+deployment never imports the dense stack. The import time of each retriever
+is logged and published as the retriever_import_seconds metric.
+
+Configuration:
+    RETRIEVERS_ENABLED   comma-separated retriever names, e.g.
+                         "bm25_with_stopwords,bm25_without_stopwords" (default: all)
+"""
+
+import importlib
+import logging
+import os
+import sys
+import threading
+import time
+from types import ModuleType
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from retreivers import metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Retriever name (the /get-images result key) -> (module, function, extra arguments after the query)
+RETRIEVERS: Dict[str, Tuple[str, str, Tuple]] = {
+    "bge": ("retreivers.bge_retreiver", "get_multiple_images_metadata_all_structures", ()),
+    "clip": ("retreivers.clip_retreiver", "get_multiple_images_metadata", ()),
+    "tfidf": ("retreivers.tfidf_retreiver", "get_multiple_images_metadata_all_structures", ()),
+    "bm25_with_stopwords": (
+        "retreivers.bm25_retreiver", "get_multiple_images_metadata_all_structures", ("with_stopwords",)
+    ),
+    "bm25_without_stopwords": (
+        "retreivers.bm25_retreiver", "get_multiple_images_metadata_all_structures", ("without_stopwords",)
+    ),
+    "hybrid": ("retreivers.hybrid_retreiver", "get_multiple_images_metadata_all_structures", ()),
+    "topic_routed": ("retreivers.topic_retreiver", "get_multiple_images_metadata_all_structures", ()),
+}
+
+class LazyRetriever:
+    """A retriever function that imports its module on the first call."""
+
+    def __init__(self, name: str, module: str, function: str):
+        self.name = name
+        self.module = module
+        self.function = function
+        self.import_time_s: Optional[float] = None
+        self._function: Optional[Callable] = None
+        self._lock = threading.Lock()
+
+    def load(self) -> Callable:
+        """Import the retriever's module, if not imported yet, and get the function."""
+        if self._function is None:
+            with self._lock:
+                if self._function is None:
+                    start = time.perf_counter()
+                    function = getattr(importlib.import_module(self.module), self.function)
+                    self.import_time_s = time.perf_counter() - start
+                    metrics.IMPORT_SECONDS.labels(self.name).set(self.import_time_s)
+                    logger.info(f"Imported retriever {self.name} in {self.import_time_s:.2f}s")
+                    self._function = function
+        return self._function
+
+    def __call__(self, *args, **kwargs) -> Any:
+        return self.load()(*args, **kwargs)
+
+def get_enabled_names() -> List[str]:
+    """Get the retrievers enabled in RETRIEVERS_ENABLED, in registry order."""
+    value = os.getenv("RETRIEVERS_ENABLED", "")
+    if not value:
+        return list(RETRIEVERS)
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = set(names) - set(RETRIEVERS)
+    if unknown:
+        raise ValueError(f"Unknown retrievers in RETRIEVERS_ENABLED: {sorted(unknown)}")
+    return [name for name in RETRIEVERS if name in names]
+
+def get_retrievers(names: Optional[List[str]] = None) -> Dict[str, Tuple[Callable, Tuple]]:
+    """
+    Get lazily imported retrievers.
+
+    Args:
+        names (Optional[List[str]]): Retrievers to get, the enabled ones by default
+
+    Returns:
+        Dict[str, Tuple[Callable, Tuple]]: Retriever name -> (function, extra arguments after the query),
+            called as function(query, *arguments, k)
+    """
+    names = get_enabled_names() if names is None else names
+    return {
+        name: (LazyRetriever(name, RETRIEVERS[name][0], RETRIEVERS[name][1]), RETRIEVERS[name][2])
+        for name in names
+    }
+
+def get_loaded_module(module: str) -> Optional[ModuleType]:
+    """Get a retriever module if something has imported it already, without importing it."""
+    return sys.modules.get(module)
@@ -0,0 +1,112 @@
+"""
+CPU thread budget for the retrieval stack.
+
+/get-images runs several retrievers at once, and by default torch, FAISS
+(OpenMP) and the BLAS behind numpy/scikit-learn each start one thread per
+core, so concurrent requests oversubscribe the CPU. The budget caps the
+intra-op threads of each component and can pin encoder worker processes to
+core sets.
+
+Configuration (unset means the library default):
+    TORCH_NUM_THREADS    torch intra-op threads
+    FAISS_NUM_THREADS    FAISS OpenMP threads
+    BLAS_NUM_THREADS     BLAS threads (through threadpoolctl)
+    ONNX_NUM_THREADS     ONNX Runtime intra-op threads per session
+    BGE_WORKER_CPUS / CLIP_WORKER_CPUS
+                         core sets for the encoder worker processes, one per
+                         worker separated by ";" and assigned round-robin,
+                         e.g. "0-1;2-3"
+
+Use evaluation/benchmark_threads.py to find a good budget for a machine.
+"""
+
+import logging
+import os
+from typing import Dict, List, Optional, Set
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def _env_int(name: str) -> Optional[int]:
+    """Read a positive integer from the environment, or None if unset."""
+    value = os.getenv(name, "")
+    return int(value) if value else None
+
+TORCH_NUM_THREADS = _env_int("TORCH_NUM_THREADS")
+FAISS_NUM_THREADS = _env_int("FAISS_NUM_THREADS")
+BLAS_NUM_THREADS = _env_int("BLAS_NUM_THREADS")
+ONNX_NUM_THREADS = _env_int("ONNX_NUM_THREADS")
+
+# Keeps the threadpoolctl limit alive for the lifetime of the process
+_blas_limiter = None
+
+def set_thread_budget(
+    torch_threads: Optional[int] = None,
+    faiss_threads: Optional[int] = None,
+    blas_threads: Optional[int] = None
+) -> Dict[str, Optional[int]]:
+    """
+    Cap the intra-op threads of torch, FAISS and BLAS in this process.
+
+    Args:
+        torch_threads (Optional[int]): torch intra-op threads (None leaves it unchanged)
+        faiss_threads (Optional[int]): FAISS OpenMP threads (None leaves it unchanged)
+        blas_threads (Optional[int]): BLAS threads (None leaves it unchanged)
+
+    Returns:
+        Dict[str, Optional[int]]: The budget that was applied
+    """
+    global _blas_limiter
+
+    if torch_threads:
+        import torch
+        torch.set_num_threads(torch_threads)
+    if faiss_threads:
+        import faiss
+        faiss.omp_set_num_threads(faiss_threads)
+    if blas_threads:
+        from threadpoolctl import threadpool_limits
+        _blas_limiter = threadpool_limits(limits=blas_threads, user_api="blas")
+
+    budget = {"torch": torch_threads, "faiss": faiss_threads, "blas": blas_threads}
+    if any(budget.values()):
+        logger.info(f"Thread budget: {budget}")
+    return budget
+
+def apply_thread_budget() -> Dict[str, Optional[int]]:
+    """Apply the thread budget configured in the environment."""
+    return set_thread_budget(TORCH_NUM_THREADS, FAISS_NUM_THREADS, BLAS_NUM_THREADS)
+
+def parse_cpu_sets(spec: str) -> List[Set[int]]:
+    """
+    Parse core sets such as "0-1;2-3" or "0,2,4;1,3,5".
+
+    Args:
+        spec (str): Core sets separated by ";", each a comma-separated list of cores or ranges
+
+    Returns:
+        List[Set[int]]: One set of core ids per entry
+    """
+    cpu_sets = []
+    for entry in filter(None, (part.strip() for part in spec.split(";"))):
+        cpus = set()
+        for item in entry.split(","):
+            if "-" in item:
+                first, last = item.split("-")
+                cpus.update(range(int(first), int(last) + 1))
+            else:
+                cpus.add(int(item))
+        cpu_sets.append(cpus)
+    return cpu_sets
+
+def get_worker_cpu_sets(model: str) -> List[Set[int]]:
+    """Get the configured core sets for a model's encoder workers ("bge" or "clip")."""
+    return parse_cpu_sets(os.getenv(f"{model.upper()}_WORKER_CPUS", ""))
+
+def pin_to_cpus(cpus: Set[int]) -> None:
+    """Pin the current process to a set of cores (Linux only)."""
+    if not hasattr(os, "sched_setaffinity"):
+        logger.warning("CPU pinning is not supported on this platform")
+        return
+    os.sched_setaffinity(0, cpus)
@@ -0,0 +1,317 @@
+"""
+Sharded scatter-gather search across local worker processes.
+
+With RETRIEVER_SHARDS=N (N > 1), the BGE and CLIP FAISS indices and the BM25
+and TF-IDF engines are split into N shards by image. An image belongs to shard
+crc32(image_url) % N in every index, so each shard holds the same images for
+every retriever. Each shard is served by its own worker process. A search
+sends the query (embedding, tokens or text) to every shard at once. Each
+shard returns its top k as (sort key, global row) pairs, and a heap merges the
+sorted partial lists into the global top k.
+
+The shards score exactly like the unsharded engines:
+  - The FAISS shards are flat indices over each shard's rows of the full index,
+    with the same metric.
+  - The BM25 shards keep the corpus-wide IDF and average document length.
+  - The TF-IDF shards share the full vectorizer.
+Only ties can come out in a different order.
+
+The workers load their shards lazily on first use, from the index bundle of
+the request (see retreivers/bundles.py), and keep only their own rows. The API
+process keeps loading the full indices for their metadata, and for the hybrid
+and topic-routed retrievers, which search them directly.
+
+A backend started with NODE_SHARD="i/N" serves shard i of N itself, as a
+node behind a coordinator (see backend/coordinator.py). It searches with
+search_node_shard() in its own process and keeps each result's metadata with
+its shard.
+
+Configuration:
+    RETRIEVER_SHARDS     number of shard worker processes (default 1, no sharding)
+    NODE_SHARD           shard served by this backend as a node, "i/N" (default "0/1", everything)
+
+Use evaluation/benchmark_shards.py to measure latency against the shard count.
+"""
+
+import atexit
+import copy
+import heapq
+import itertools
+import json
+import logging
+import multiprocessing as mp
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from retreivers import bundles, resources
+
+if TYPE_CHECKING:
+    import faiss
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants
+NUM_SHARDS = int(os.getenv("RETRIEVER_SHARDS", "1"))
+NODE_SHARD = os.getenv("NODE_SHARD", "0/1")
+# Bundles whose shards a worker keeps loaded, so requests still on the previous bundle do not reload it
+MAX_CACHED_BUNDLES = 2
+# Workers are spawned rather than forked so they never inherit torch or FAISS thread state
+_CONTEXT = mp.get_context("spawn")
+
+# A shard source, e.g. ("faiss", index_path, metadata_path), ("bm25", structure_num, variant) or
+# ("tfidf", structure_num); see _load_shard
+Source = Tuple
+
+def is_enabled() -> bool:
+    """Whether searches are sharded."""
+    return NUM_SHARDS > 1
+
+def get_node_shard() -> Tuple[int, int]:
+    """Get the (shard id, number of shards) this backend serves as a node."""
+    shard_id, separator, num_shards = NODE_SHARD.partition("/")
+    if not separator or not 0 <= int(shard_id) < int(num_shards):
+        raise ValueError(f"NODE_SHARD must be 'i/N' with 0 <= i < N, got '{NODE_SHARD}'")
+    return int(shard_id), int(num_shards)
+
+def get_shard(image_url: Optional[str], num_shards: int) -> int:
+    """Get the shard of an image, from a stable hash of its URL."""
+    return zlib.crc32((image_url or "").encode("utf-8")) % num_shards
+
+def get_shard_rows(metadata: List[Dict[str, Any]], shard_id: int, num_shards: int) -> np.ndarray:
+    """Get the rows of a metadata list (global row ids) that belong to a shard."""
+    return np.array(
+        [row for row, item in enumerate(metadata) if get_shard(item.get("image_url"), num_shards) == shard_id],
+        dtype=np.int64
+    )
+
+def merge_top_k(partial_results: List[List[Tuple[float, int]]], k: int) -> List[int]:
+    """
+    Merge per-shard top-k lists into the global top k.
+
+    Args:
+        partial_results (List[List[Tuple[float, int]]]): Per shard, (sort key, global row) pairs, ascending
+        k (int): Number of results to return
+
+    Returns:
+        List[int]: Global rows, best first
+    """
+    return [row for _, row in itertools.islice(heapq.merge(*partial_results), k)]
+
+class FaissShard:
+    """A shard of a FAISS index, searched exactly."""
+
+    def __init__(self, index: "faiss.Index", rows: np.ndarray, sign: float,
+                 metadata: Optional[List[Dict[str, Any]]] = None):
+        """
+        Args:
+            index (faiss.Index): Flat index of the shard's vectors
+            rows (np.ndarray): Global row of each vector
+            sign (float): 1 for distances (lower is better), -1 for similarities (higher is better)
+            metadata (Optional[List[Dict[str, Any]]]): Metadata of each vector, kept by nodes only
+        """
+        self.index = index
+        self.rows = rows
+        self.sign = sign
+        self.metadata = metadata
+
+    def search(self, query_embedding: np.ndarray, k: int) -> List[Tuple[float, int]]:
+        k = min(k, self.index.ntotal)
+        if k == 0:
+            return []
+        distances, indices = self.index.search(query_embedding.reshape(1, -1).astype(np.float32), k)
+        return [(self.sign * float(distance), int(idx)) for distance, idx in zip(distances[0], indices[0]) if idx >= 0]
+
+class ScoreShard:
+    """A shard of a sparse engine that scores every one of its documents."""
+
+    def __init__(self, score, rows: np.ndarray, metadata: Optional[List[Dict[str, Any]]] = None):
+        self.score = score
+        self.rows = rows
+        self.metadata = metadata
+
+    def search(self, query: Any, k: int) -> List[Tuple[float, int]]:
+        scores = np.asarray(self.score(query), dtype=np.float64)
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        # Ties are broken by global row, as the merge does
+        return sorted((-float(scores[idx]), int(idx)) for idx in top)
+
+def _select(metadata: List[Dict[str, Any]], rows: np.ndarray, keep_metadata: bool) -> Optional[List[Dict[str, Any]]]:
+    """Keep the metadata of a shard's rows, if asked to."""
+    return [metadata[row] for row in rows] if keep_metadata else None
+
+def _load_faiss_shard(index_path: str, metadata_path: str, shard_id: int, num_shards: int,
+                      keep_metadata: bool) -> FaissShard:
+    """Copy a shard's vectors out of a full in-memory float32 FAISS index into a flat index."""
+    import faiss
+    from retreivers import ondisk_index
+
+    with open(metadata_path, "r") as f:
+        metadata = json.load(f)
+    rows = get_shard_rows(metadata, shard_id, num_shards)
+    index = ondisk_index.read_index(index_path)
+    # Every shard worker copies its rows into memory, together the whole index
+    ondisk_index.check_in_memory(index, "Sharded search")
+    # Shards must search the vectors unsharded exact search would, not a variant's approximations
+    if not ondisk_index.stores_exact_vectors(index):
+        raise ValueError(f"Shards copy exact vectors, but {index_path} ({type(index).__name__}) "
+                         f"stores approximate ones; shard its float32 index")
+    ondisk_index.make_reconstructable(index)
+    rows = rows[rows < index.ntotal]
+    shard_index = faiss.IndexFlat(index.d, index.metric_type)
+    if len(rows):
+        shard_index.add(index.reconstruct_batch(rows))
+    sign = 1.0 if index.metric_type == faiss.METRIC_L2 else -1.0
+    return FaissShard(shard_index, rows, sign, _select(metadata, rows, keep_metadata))
+
+def _load_bm25_shard(structure_num: int, variant: str, shard_id: int, num_shards: int,
+                     keep_metadata: bool) -> ScoreShard:
+    """Keep a shard's documents of a BM25 model, with the corpus-wide IDF and average length."""
+    from retreivers import bm25_retreiver
+
+    model = bm25_retreiver._read_retriever(structure_num, variant)
+    rows = get_shard_rows(model.metadata, shard_id, num_shards)
+    shard = copy.copy(model)
+    shard.doc_freqs = [model.doc_freqs[row] for row in rows]
+    shard.doc_len = [model.doc_len[row] for row in rows]
+    shard.corpus_size = len(rows)
+    shard.metadata = None
+    return ScoreShard(shard.get_scores, rows, _select(model.metadata, rows, keep_metadata))
+
+def _load_tfidf_shard(structure_num: int, shard_id: int, num_shards: int, keep_metadata: bool) -> ScoreShard:
+    """Keep a shard's rows of a TF-IDF matrix, with the full vectorizer."""
+    from sklearn.metrics.pairwise import cosine_similarity
+    from retreivers import tfidf_retreiver
+
+    retriever = tfidf_retreiver._read_retriever(structure_num)
+    metadata = [doc.metadata for doc in retriever.docs]
+    rows = get_shard_rows(metadata, shard_id, num_shards)
+    matrix = retriever.tfidf_array[rows]
+    vectorizer = retriever.vectorizer
+    return ScoreShard(
+        lambda query: cosine_similarity(matrix, vectorizer.transform([query])).reshape(-1),
+        rows, _select(metadata, rows, keep_metadata)
+    )
+
+# Worker process state: the shard it serves and its loaded shards by bundle root, then by
+# (source, shard id, number of shards, whether metadata is kept)
+_shard_id = 0
+_num_shards = 1
+_shards: "OrderedDict[str, Dict[Tuple, Any]]" = OrderedDict()
+_shards_lock = threading.Lock()
+
+def _init_worker(shard_id: int, num_shards: int) -> None:
+    """Set up a shard worker process."""
+    global _shard_id, _num_shards
+    _shard_id, _num_shards = shard_id, num_shards
+    # Shards are the parallelism, so each worker searches on one thread by default
+    resources.set_thread_budget(None, resources.FAISS_NUM_THREADS or 1, resources.BLAS_NUM_THREADS or 1)
+
+def _load_shard(bundle_root: str, source: Source, shard_id: int, num_shards: int, keep_metadata: bool = False) -> Any:
+    """Load a shard of a source from a bundle, if not already loaded."""
+    key = (source, shard_id, num_shards, keep_metadata)
+    with _shards_lock:
+        if bundle_root not in _shards:
+            _shards[bundle_root] = {}
+            while len(_shards) > MAX_CACHED_BUNDLES:
+                _shards.popitem(last=False)
+        _shards.move_to_end(bundle_root)
+        shards = _shards[bundle_root]
+
+        if key not in shards:
+            with bundles.pinned(bundles.IndexBundle(bundle_root, bundle_root)):
+                kind, *arguments = source
+                if kind == "faiss":
+                    shards[key] = _load_faiss_shard(*arguments, shard_id, num_shards, keep_metadata)
+                elif kind == "bm25":
+                    shards[key] = _load_bm25_shard(*arguments, shard_id, num_shards, keep_metadata)
+                elif kind == "tfidf":
+                    shards[key] = _load_tfidf_shard(*arguments, shard_id, num_shards, keep_metadata)
+                else:
+                    raise ValueError(f"Unknown shard source '{kind}'")
+            logger.info(f"Shard {shard_id}/{num_shards} loaded {source} ({len(shards[key].rows)} rows)")
+        return shards[key]
+
+def _search_shard(bundle_root: str, source: Source, query: Any, k: int) -> List[Tuple[float, int]]:
+    """Search this worker's shard of a source (runs in the worker process)."""
+    shard = _load_shard(bundle_root, source, _shard_id, _num_shards)
+    return [(key, int(shard.rows[idx])) for key, idx in shard.search(query, k)]
+
+def search_node_shard(source: Source, query: Any, k: int) -> List[Tuple[float, int, Dict[str, Any]]]:
+    """
+    Search the shard of a source this backend serves as a node (NODE_SHARD), in this process.
+
+    Args:
+        source (Source): What to search, e.g. ("faiss", index_path, metadata_path)
+        query (Any): Query embedding for FAISS sources, token list for BM25, text for TF-IDF
+        k (int): Number of results to return
+
+    Returns:
+        List[Tuple[float, int, Dict[str, Any]]]: (sort key, global row, metadata), best first; sort keys
+            are comparable across the shards of a source, lower is better
+    """
+    shard_id, num_shards = get_node_shard()
+    shard = _load_shard(bundles.current().root, source, shard_id, num_shards, keep_metadata=True)
+    return [(key, int(shard.rows[idx]), shard.metadata[idx]) for key, idx in shard.search(query, k)]
+
+class ShardPool:
+    """One single-process executor per shard, so that each shard is always searched by the worker holding it."""
+
+    def __init__(self, num_shards: int = NUM_SHARDS):
+        self.num_shards = num_shards
+        self.executors = [
+            ProcessPoolExecutor(
+                max_workers=1, mp_context=_CONTEXT, initializer=_init_worker, initargs=(shard_id, num_shards)
+            )
+            for shard_id in range(num_shards)
+        ]
+        atexit.register(self.close)
+        logger.info(f"Started {num_shards} shard workers")
+
+    def search(self, source: Source, query: Any, k: int) -> List[int]:
+        """
+        Search every shard of a source in parallel and merge their top k.
+
+        Args:
+            source (Source): What to search, e.g. ("faiss", index_path, metadata_path)
+            query (Any): Query embedding for FAISS sources, token list for BM25, text for TF-IDF
+            k (int): Number of results to return
+
+        Returns:
+            List[int]: Global rows of the source, best first
+        """
+        bundle_root = bundles.current().root
+        futures = [executor.submit(_search_shard, bundle_root, source, query, k) for executor in self.executors]
+        return merge_top_k([future.result() for future in futures], k)
+
+    def close(self) -> None:
+        """Stop the shard workers."""
+        for executor in self.executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+# Global shard pool, started on the first sharded search
+_pool: Optional[ShardPool] = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ShardPool:
+    """Start the shard workers if not already started."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ShardPool(NUM_SHARDS)
+    return _pool
+
+def search(source: Source, query: Any, k: int) -> List[int]:
+    """Search a source across the shard workers (see ShardPool.search)."""
+    return get_pool().search(source, query, k)
@@ -2,18 +2,28 @@ from langchain_community.retrievers import TFIDFRetriever
 import os
 from typing import List, Dict, Any
 
+from retreivers import bundles, metrics, sharding
+
 # Constants
 PICKLE_DIR = "preprocess/tfidf/pickle_files"
 
 def load_retriever(structure_num: int) -> TFIDFRetriever:
-    """Load a TF-IDF retriever for a specific structure number."""
+    """Load a TF-IDF retriever of the current index bundle for a structure number if not already loaded."""
+    retrievers = bundles.cache("tfidf_retrievers")
+    metrics.record_cache("tfidf_retrievers", structure_num in retrievers)
+    if structure_num not in retrievers:
+        retrievers[structure_num] = _read_retriever(structure_num)
+    return retrievers[structure_num]
+
+def _read_retriever(structure_num: int) -> TFIDFRetriever:
+    """Read a TF-IDF retriever for a specific structure number from disk."""
     # The path is already a directory, not a file
-    pickle_path = os.path.join(PICKLE_DIR, f"tfidf_structure_{structure_num}.pkl")
+    pickle_path = bundles.resolve(os.path.join(PICKLE_DIR, f"tfidf_structure_{structure_num}.pkl"))
     
     # Check if the directory exists
     if not os.path.isdir(pickle_path):
         # Try using the fallback directory
-        pickle_path = os.path.join(PICKLE_DIR, "tfidf.pkl")
+        pickle_path = bundles.resolve(os.path.join(PICKLE_DIR, "tfidf.pkl"))
         if not os.path.isdir(pickle_path):
             raise FileNotFoundError(f"Could not find TF-IDF retriever files at {pickle_path}")
     
@@ -66,6 +76,9 @@ def get_multiple_images_metadata(query: str, structure_num: int, k: int = 5) ->
         List[Dict[str, Any]]: List of metadata for top k images
     """
     retriever = load_retriever(structure_num)
+    if sharding.is_enabled():
+        # Score each shard of the documents in its own worker process
+        return [retriever.docs[row].metadata for row in sharding.search(("tfidf", structure_num), query, k)]
     docs = retriever.get_relevant_documents(query, k=k)
     return [doc.metadata for doc in docs]
 
@@ -82,5 +95,6 @@ def get_multiple_images_metadata_all_structures(query: str, k: int = 5) -> Dict[
     """
     results = {}
     for structure_num in range(1, 6):
-        results[structure_num] = get_multiple_images_metadata(query, structure_num, k)
+        with metrics.time_structure("tfidf", structure_num):
+            results[structure_num] = get_multiple_images_metadata(query, structure_num, k)
     return results
@@ -0,0 +1,175 @@
+"""
+Topic-routed BGE retriever.
+
+Each structure's BGE index is partitioned by topic into per-topic sub-indices.
+A query is routed to its closest topics by comparing it with the BGE embeddings
+of the topic definitions, and only those sub-indices are searched. When the
+best topic is not similar enough to the query, the full index is searched.
+"""
+
+import faiss
+import logging
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+
+from retreivers import bge_retreiver, bundles, metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants
+NUM_TOPICS = 3
+MIN_ROUTING_SCORE = 0.5
+
+# Topic centroids ("topic_centroids") and per-topic sub-indices ("topic_partitions") are cached
+# per index bundle, as they are derived from its BGE indices and metadata
+
+def _load_centroids() -> Tuple[List[str], np.ndarray]:
+    """Embed every topic definition once to use as the routing centroids."""
+    cache = bundles.cache("topic_centroids")
+    if "centroids" not in cache:
+        definitions = set()
+        for structure_num in range(1, 6):
+            _, metadata = bge_retreiver.get_structure_index_and_metadata(structure_num)
+            definitions.update(item.get("topic_definition", "") for item in metadata)
+        topic_definitions = sorted(definition for definition in definitions if definition)
+        cache["definitions"] = topic_definitions
+        cache["centroids"] = bge_retreiver.get_text_embeddings(topic_definitions)
+    return cache["definitions"], cache["centroids"]
+
+def _load_partitions(structure_num: int) -> bool:
+    """Split a structure's BGE index into one sub-index per topic."""
+    all_partitions = bundles.cache("topic_partitions")
+    if structure_num in all_partitions:
+        return True
+
+    index, metadata = bge_retreiver.get_structure_index_and_metadata(structure_num)
+    if index is None or not metadata:
+        logger.error(f"Structure {structure_num} not available")
+        metrics.record_error(f"Structure {structure_num} not available")
+        return False
+
+    vectors = bge_retreiver.get_structure_vectors(structure_num)
+    rows_by_topic = {}
+    for row, item in enumerate(metadata[:index.ntotal]):
+        rows_by_topic.setdefault(item.get("topic_definition", ""), []).append(row)
+
+    partitions = {}
+    for topic_definition, rows in rows_by_topic.items():
+        sub_index = faiss.IndexFlatL2(vectors.shape[1])
+        sub_index.add(vectors[rows])
+        partitions[topic_definition] = (sub_index, np.array(rows))
+
+    all_partitions[structure_num] = partitions
+    return True
+
+def route_query(query_embedding: np.ndarray, num_topics: int = NUM_TOPICS) -> List[Tuple[str, float]]:
+    """
+    Rank topics by the similarity of their definition to the query.
+
+    Args:
+        query_embedding (np.ndarray): Normalized BGE query embedding
+        num_topics (int): Number of topics to return
+
+    Returns:
+        List[Tuple[str, float]]: (topic_definition, similarity) pairs, most similar first
+    """
+    topic_definitions, centroids = _load_centroids()
+    scores = centroids @ query_embedding
+    top = np.argsort(-scores)[:num_topics]
+    return [(topic_definitions[i], float(scores[i])) for i in top]
+
+def _search_structure(
+    query_embedding: np.ndarray,
+    structure_num: int,
+    k: int,
+    num_topics: int,
+    min_routing_score: float
+) -> List[Dict[str, Any]]:
+    """Search the routed topic sub-indices of a structure, or the full index if routing is unsure."""
+    index, metadata = bge_retreiver.get_structure_index_and_metadata(structure_num)
+    if not _load_partitions(structure_num):
+        return []
+
+    routes = route_query(query_embedding, num_topics)
+    query_embedding = query_embedding.reshape(1, -1)
+
+    if not routes or routes[0][1] < min_routing_score:
+        # Low routing confidence, fall back to the global index
+        _, indices = index.search(query_embedding, k)
+        return [metadata[idx] for idx in indices[0] if 0 <= idx < len(metadata)]
+
+    # Search each routed topic and merge the partial top-k lists by distance
+    partitions = bundles.cache("topic_partitions")[structure_num]
+    candidates = []
+    for topic_definition, _ in routes:
+        if topic_definition not in partitions:
+            continue
+        sub_index, rows = partitions[topic_definition]
+        distances, indices = sub_index.search(query_embedding, min(k, sub_index.ntotal))
+        for distance, idx in zip(distances[0], indices[0]):
+            if idx >= 0:
+                candidates.append((float(distance), int(rows[idx])))
+
+    candidates.sort()
+    return [metadata[row] for _, row in candidates[:k]]
+
+def get_multiple_images_metadata(
+    query: str,
+    structure_num: int,
+    k: int = 5,
+    num_topics: int = NUM_TOPICS,
+    min_routing_score: float = MIN_ROUTING_SCORE
+) -> List[Dict[str, Any]]:
+    """
+    Get the metadata of multiple top images for a given query using a specific structure.
+
+    Args:
+        query (str): The search query
+        structure_num (int): The structure number (1-5)
+        k (int): Number of results to return
+        num_topics (int): Number of topics to route the query to
+        min_routing_score (float): Best-topic similarity below which the full index is searched
+
+    Returns:
+        List[Dict[str, Any]]: List of metadata for top k images
+    """
+    return get_multiple_images_metadata_all_structures(
+        query, k, num_topics, min_routing_score, structures=[structure_num]
+    ).get(structure_num, [])
+
+def get_multiple_images_metadata_all_structures(
+    query: str,
+    k: int = 5,
+    num_topics: int = NUM_TOPICS,
+    min_routing_score: float = MIN_ROUTING_SCORE,
+    structures: Optional[List[int]] = None
+) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Get the metadata of multiple top images for a given query using all structures.
+
+    Args:
+        query (str): The search query
+        k (int): Number of results to return per structure
+        num_topics (int): Number of topics to route the query to
+        min_routing_score (float): Best-topic similarity below which the full index is searched
+        structures (Optional[List[int]]): Structures to search (default: 1-5)
+
+    Returns:
+        Dict[int, List[Dict[str, Any]]]: Dictionary mapping structure numbers to their top k image metadata
+    """
+    structures = structures or list(range(1, 6))
+    results = {structure_num: [] for structure_num in structures}
+    try:
+        with metrics.time_stage("topic_routed", "encode"):
+            query_embedding = bge_retreiver.get_query_embedding(query)
+        for structure_num in structures:
+            with metrics.time_structure("topic_routed", structure_num):
+                results[structure_num] = _search_structure(
+                    query_embedding, structure_num, k, num_topics, min_routing_score
+                )
+    except Exception as e:
+        logger.error(f"Error retrieving topic-routed images for query '{query}': {str(e)}")
+        metrics.record_error(str(e))
+    return results
@@ -0,0 +1,274 @@
+"""
+Out-of-process query encoders.
+
+An EncoderWorkerPool hosts copies of the BGE or CLIP text encoder in
+long-lived worker processes, so that model inference runs outside the API
+process and its GIL and can use several cores at once. Requests travel over a
+pipe as plain text; each worker writes its embeddings into a shared-memory
+buffer owned by the pool, and the pool copies them out, so vectors are never
+pickled.
+
+A worker that fails a request, or whose process died, is stopped and a new
+one is started in its place in the background. If the new one cannot start
+either, the worker is dropped from the pool.
+
+The pool exposes the same ``encode(texts, normalize_embeddings=True)``
+contract as the in-process encoders in retreivers/encoders.py, so retrievers
+(and the micro-batching encoder) can use it as a drop-in replacement.
+"""
+
+import atexit
+import logging
+import multiprocessing as mp
+import queue
+import threading
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+import numpy as np
+
+from retreivers import resources
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_MAX_BATCH_SIZE = 64
+# How often a request waiting for an idle worker checks that the pool still has workers
+IDLE_POLL_S = 1.0
+# Workers are spawned rather than forked so they never inherit torch or FAISS thread state
+_CONTEXT = mp.get_context("spawn")
+
+Texts = Union[str, List[str]]
+
+def _load_encoder(model: str, model_name: str, backend: str, device: str) -> Any:
+    """Load the encoder hosted by a worker."""
+    from retreivers.encoders import load_bge_encoder, load_clip_text_encoder
+
+    if model == "bge":
+        return load_bge_encoder(model_name, backend)
+    if model == "clip":
+        return load_clip_text_encoder(model_name, backend, device)
+    raise ValueError(f"Unknown encoder '{model}', expected 'bge' or 'clip'")
+
+def _worker_main(conn, model: str, model_name: str, backend: str, device: str, cpus: Optional[Set[int]]):
+    """
+    Worker process loop.
+
+    Protocol (tuples over the pipe):
+        worker -> pool  ("ready", dimension) once the encoder is loaded, or ("error", message)
+        pool -> worker  ("attach", shared_memory_name)
+        pool -> worker  ("encode", texts, normalize_embeddings) -> ("ok", rows) or ("error", message)
+        pool -> worker  ("stop",)
+    """
+    try:
+        # A pinned worker defaults to one intra-op thread per core it owns
+        if cpus:
+            resources.pin_to_cpus(cpus)
+        resources.set_thread_budget(
+            resources.TORCH_NUM_THREADS or (len(cpus) if cpus else None),
+            resources.FAISS_NUM_THREADS,
+            resources.BLAS_NUM_THREADS or (len(cpus) if cpus else None),
+        )
+        encoder = _load_encoder(model, model_name, backend, device)
+        dimension = np.asarray(encoder.encode(["warm up"], normalize_embeddings=True)).shape[1]
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+        return
+    conn.send(("ready", dimension))
+
+    _, shm_name = conn.recv()
+    shm = shared_memory.SharedMemory(name=shm_name)
+    buffer = np.ndarray((shm.size // (4 * dimension), dimension), dtype=np.float32, buffer=shm.buf)
+    try:
+        while True:
+            message = conn.recv()
+            if message[0] == "stop":
+                break
+            _, texts, normalize_embeddings = message
+            try:
+                embeddings = encoder.encode(texts, normalize_embeddings=normalize_embeddings)
+                buffer[:len(texts)] = embeddings
+                conn.send(("ok", len(texts)))
+            except Exception as e:
+                conn.send(("error", f"{type(e).__name__}: {e}"))
+    finally:
+        del buffer
+        shm.close()
+
+class _Worker:
+    """Pool-side handle of one worker process and its shared-memory output buffer."""
+
+    def __init__(self, slot: int, process, conn, shm: shared_memory.SharedMemory, dimension: int):
+        self.slot = slot
+        self.process = process
+        self.conn = conn
+        self.shm = shm
+        self.buffer = np.ndarray((shm.size // (4 * dimension), dimension), dtype=np.float32, buffer=shm.buf)
+
+class EncoderWorkerPool:
+    """Query encoder backed by a pool of worker processes."""
+
+    def __init__(self, model: str, model_name: str, backend: str = "torch", num_workers: int = 1,
+                 device: str = "cpu", max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+                 cpu_sets: Optional[List[Set[int]]] = None):
+        """
+        Start the worker processes and wait until every encoder is loaded.
+
+        Args:
+            model (str): "bge" or "clip"
+            model_name (str): Model name passed to the encoder loader
+            backend (str): Encoder backend, one of "torch", "onnx" or "onnx_int8"
+            num_workers (int): Number of worker processes
+            device (str): Device for the CLIP torch backend
+            max_batch_size (int): Rows of each worker's output buffer; larger batches are split
+            cpu_sets (Optional[List[Set[int]]]): Core sets the workers are pinned to, assigned round-robin
+        """
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.dimension = None
+        self.restarts = 0
+        self._arguments = (model, model_name, backend, device)
+        self._cpu_sets = cpu_sets
+        self._workers = []
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+
+        processes = [self._start_process(slot) for slot in range(max(1, num_workers))]
+        try:
+            for slot, (process, conn) in enumerate(processes):
+                worker = self._attach(slot, process, conn)
+                self._workers.append(worker)
+                self._idle.put(worker)
+        except Exception:
+            for process, _ in processes:
+                process.terminate()
+            self.close()
+            raise
+
+        atexit.register(self.close)
+        logger.info(f"Started {len(self._workers)} {model} encoder worker(s)")
+
+    def _start_process(self, slot: int) -> Tuple[Any, Any]:
+        """Start the worker process of a slot, pinned to the slot's cores."""
+        cpus = self._cpu_sets[slot % len(self._cpu_sets)] if self._cpu_sets else None
+        parent_conn, child_conn = _CONTEXT.Pipe()
+        process = _CONTEXT.Process(
+            target=_worker_main,
+            args=(child_conn, *self._arguments, cpus),
+            name=f"{self.model}-encoder-{slot}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+
+    def _attach(self, slot: int, process, conn) -> _Worker:
+        """Wait until a started worker has loaded its encoder and give it its output buffer."""
+        status, value = conn.recv()
+        if status != "ready":
+            raise RuntimeError(f"{process.name} failed to load its encoder: {value}")
+        shm = shared_memory.SharedMemory(create=True, size=4 * self.max_batch_size * value)
+        conn.send(("attach", shm.name))
+        self.dimension = value
+        return _Worker(slot, process, conn, shm, value)
+
+    def _stop(self, worker: _Worker) -> None:
+        """Stop a worker process and release its shared memory."""
+        try:
+            worker.conn.send(("stop",))
+        except (BrokenPipeError, OSError):
+            pass
+        worker.process.join(timeout=5)
+        if worker.process.is_alive():
+            worker.process.terminate()
+        worker.buffer = None
+        worker.shm.close()
+        worker.shm.unlink()
+
+    def _replace(self, worker: _Worker) -> None:
+        """Stop a failed worker and start a new one in its slot, or drop the slot (runs on its own thread)."""
+        self._stop(worker)
+        replacement = None
+        process = None
+        try:
+            process, conn = self._start_process(worker.slot)
+            replacement = self._attach(worker.slot, process, conn)
+        except Exception as e:
+            if process is not None:
+                process.terminate()
+            logger.error(f"Could not restart {worker.process.name}, dropping it from the pool: {str(e)}")
+        with self._lock:
+            if self._closed or replacement is None:
+                self._workers.remove(worker)
+            else:
+                self._workers[self._workers.index(worker)] = replacement
+                self.restarts += 1
+        if replacement is None:
+            return
+        if self._closed:
+            self._stop(replacement)
+            return
+        logger.info(f"Restarted {replacement.process.name}")
+        self._idle.put(replacement)
+
+    def _get_idle_worker(self) -> _Worker:
+        """Wait for an idle worker, failing once the pool has none left."""
+        while True:
+            if not self._workers:
+                raise RuntimeError(f"No {self.model} encoder worker is running")
+            try:
+                return self._idle.get(timeout=IDLE_POLL_S)
+            except queue.Empty:
+                continue
+
+    def _encode_chunk(self, texts: List[str], normalize_embeddings: bool) -> np.ndarray:
+        """Encode at most max_batch_size texts on the next idle worker."""
+        worker = self._get_idle_worker()
+        try:
+            worker.conn.send(("encode", texts, normalize_embeddings))
+            status, value = worker.conn.recv()
+            if status != "ok":
+                raise RuntimeError(f"{worker.process.name} failed to encode: {value}")
+            embeddings = worker.buffer[:value].copy()
+        except Exception as e:
+            # Never hand a failed or dead worker to the next request
+            threading.Thread(target=self._replace, args=(worker,), name=f"{worker.process.name}-restart",
+                             daemon=True).start()
+            if isinstance(e, (EOFError, OSError)):
+                raise RuntimeError(f"{worker.process.name} is not running") from e
+            raise
+        self._idle.put(worker)
+        return embeddings
+
+    def encode(self, texts: Texts, normalize_embeddings: bool = True, **kwargs) -> np.ndarray:
+        """Encode one text or a batch of texts."""
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        if not texts:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        embeddings = np.concatenate([
+            self._encode_chunk(texts[start:start + self.max_batch_size], normalize_embeddings)
+            for start in range(0, len(texts), self.max_batch_size)
+        ])
+        return embeddings[0] if single else embeddings
+
+    def get_stats(self) -> Dict[str, int]:
+        """Get the number of live and idle workers, and how many were restarted after a failure."""
+        workers = list(self._workers)
+        return {
+            "workers": len(workers),
+            "alive": sum(worker.process.is_alive() for worker in workers),
+            "idle": self._idle.qsize(),
+            "restarts": self.restarts,
+        }
+
+    def close(self):
+        """Stop the workers and release their shared memory."""
+        with self._lock:
+            self._closed = True
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            self._stop(worker)